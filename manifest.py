@@ -4,4 +4,10 @@ module("doc.py", base_path="src/")
 module("font_generator.py", base_path="src/")
 module("lcdFont.py", base_path="src/")
 module("lcd.py", base_path="src/")
+module("lcdCost.py", base_path="src/")
+module("lruCache.py", base_path="src/")
 module("rtc.py", base_path="src/")
+
+#st7789 font modules for [font=mod:NAME], e.g.: romfonts/vga1_16x32.py from st7789_mpy
+#  freezes every module in fonts/, if it exists
+freeze("fonts")
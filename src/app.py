@@ -12,7 +12,8 @@ import sys
 import doc
 from rtc import RTC_DS3231
 from lcd import LCD, FramebufConf
-from lcdFont import LcdFont
+from lcdFont import LcdFont, VEC_MODES
+from lcdCost import CostLCD
 
 BOARD_RP2040 = "RP2040"
 BOARD_RP2350 = "RP2350"
@@ -76,6 +77,7 @@ STATE_FILE_FRAMEBUF = "state-framebuf"
 STATE_FILE_TIMEOUT = "state-timeout"
 STATE_FILE_TIMEZONE = "state-timezone"
 PREFIX_STATE_FILE_TEMPLATE = "state-template-"
+PREFIX_STATE_FILE_LAYOUT = "state-layout-"
 
 DEFAULT_MARKUP_TEMPLATES = {
   'timeout': (""
@@ -115,12 +117,14 @@ def buttonPressedActions(btnName, controller):
   if btnName == "B2" or btnName == "A" or btnName == "BL":
     controller['lcd'].set_rotation_next()
     writeStateOrientation(controller['lcd'].get_rotation_degrees())
+    #layouts, widgets and the last diff frame were drawn at the old coordinates
+    controller['lcdFont'].clearRetained()
     controller['lcdFont'].show()
 
 def main():
   controller = {
     'lcdName': None, 'lcd': None, 'lcdFont': None,
-    'timeoutMarkupCache': None,
+    'templateMarkupCache': {},
     'rtc': None,
     'socket': None,
     'buttons': None,
@@ -178,10 +182,7 @@ def main():
         print('client connected from', addr)
       except:
         print("SOCKET TIMEOUT (" + str(controller['timeoutMillis']) + "ms)\n")
-        if controller['timeoutMarkupCache'] == None:
-          controller['timeoutMarkupCache'] = replaceMarkupTemplate('timeout',
-            {})
-        controller['lcdFont'].markup(controller['timeoutMarkupCache'])
+        drawMarkupTemplate(controller, 'timeout', {}, isRedraw=True)
         continue
 
       (cmdName, params, socketReader) = readCommandRequest(cl)
@@ -286,7 +287,7 @@ def cmdResetWifi(controller, params, socketReader):
   return out
 
 def cmdTemplate(controller, params, socketReader):
-  controller['timeoutMarkupCache'] = None #recalculate timeout markup on next timeout
+  controller['templateMarkupCache'] = {} #re-read template markup on next use
   templateName = maybeGetParamStr(params, "templateName", None)
   templateMarkup = socketReader.readDataStr()
   out = ""
@@ -332,6 +333,7 @@ def cmdClear(controller, params, socketReader):
   return None
 
 def cmdShow(controller, params, socketReader):
+  controller['lcd'].mark_all_dirty()
   controller['lcdFont'].show()
   return None
 
@@ -347,6 +349,7 @@ def cmdFill(controller, params, socketReader):
   else:
     controller['lcd'].fill(color)
     controller['lcd'].show()
+    controller['lcdFont'].clearRetained() #do not redraw layouts/widgets over the fill
   return out
 
 def cmdLCD(controller, params, socketReader):
@@ -378,7 +381,9 @@ def cmdFramebuf(controller, params, socketReader):
     controller['lcd'].get_lcd_landscape_width(),
     controller['lcd'].get_lcd_landscape_height())
   print("framebuf=" + str(fbConf))
-  return setFramebuf(controller['lcd'], fbConf)
+  out = setFramebuf(controller['lcd'], fbConf)
+  controller['lcdFont'].clearRetained()
+  return out
 
 def cmdStat(controller, params, socketReader):
   files = getAllFiles()
@@ -442,26 +447,179 @@ def cmdText(controller, params, socketReader):
   fbConfStr = maybeGetParamStr(params, "framebuf", None)
   orient = maybeGetParamStr(params, "orient", None)
   info = maybeGetParamBool(params, "info", False)
-  markup = socketReader.readDataStr()
+  isDiff = maybeGetParamBool(params, "diff", False)
 
   fbConf = FramebufConf.parseFramebufConfStr(
     fbConfStr,
     controller['lcd'].get_lcd_landscape_width(),
     controller['lcd'].get_lcd_landscape_height())
 
-  print("text: " + markup)
+  print("text: %d bytes" % socketReader.contentLen)
 
   out = ""
   if orient != None:
     out += setOrientation(controller, orient)
   if fbConf != None:
     out += setFramebuf(controller['lcd'], fbConf)
+    controller['lcdFont'].clearRetained()
 
   if info:
     out += cmdInfo(controller, None, None)
 
-  controller['lcdFont'].markup(markup, isClear=isClear, isShow=isShow)
+  if isDiff:
+    #the whole frame is needed to compare it with the last one
+    controller['lcdFont'].markup(
+      socketReader.readDataStr(), isClear=isClear, isShow=isShow, isDiff=True)
+  else:
+    #draw the markup while it is still arriving
+    controller['lcdFont'].markupChunks(
+      socketReader.readDataChunks(), isClear=isClear, isShow=isShow)
+
+  return out
+
+def cmdDl(controller, params, socketReader):
+  isClear = maybeGetParamBool(params, "clear", True)
+  isShow = maybeGetParamBool(params, "show", True)
+  data = socketReader.readData()
+
+  print("dl: %d bytes" % len(data))
+
+  controller['lcdFont'].displayList(data, isClear=isClear, isShow=isShow)
+
+  return ""
+
+def cmdCost(controller, params, socketReader):
+  isClear = maybeGetParamBool(params, "clear", True)
+  isShow = maybeGetParamBool(params, "show", True)
+  isActual = maybeGetParamBool(params, "actual", False)
+  markup = socketReader.readDataStr()
+
+  costLCD = CostLCD(controller['lcd'])
+  controller['lcdFont'].markupWithLCD(costLCD, markup, isClear=isClear, isShow=isShow)
+
+  out = ""
+  out += "primitives: %d\n" % costLCD.primitives
+  out += "spi transactions: %d\n" % costLCD.spiTransactions
+  out += "lcd px: %d\n" % costLCD.lcdPx
+  out += "framebuf px: %d\n" % costLCD.framebufPx
+  out += "show bytes: %d\n" % costLCD.showBytes
+  out += "files opened: %d\n" % costLCD.filesOpened
+  out += "uncalibrated estimate: %d ms\n" % (costLCD.get_uncalibrated_estimate_us() // 1000)
+
+  if isActual:
+    lcd = controller['lcd']
+    lcd.wait_show()
+    (spiTransactions, spiBytes) = (lcd.spiTransactions, lcd.spiBytes)
+    start = time.ticks_us()
+    controller['lcdFont'].markup(markup, isClear=isClear, isShow=isShow)
+    #include the DMA write of the framebuf, if any
+    lcd.wait_show()
+    out += "actual: %d ms\n" % (time.ticks_diff(time.ticks_us(), start) // 1000)
+    out += "actual spi transactions: %d\n" % (lcd.spiTransactions - spiTransactions)
+    out += "actual spi bytes: %d\n" % (lcd.spiBytes - spiBytes)
+
+  return out
+
+def cmdLayout(controller, params, socketReader):
+  layoutName = maybeGetParamStr(params, "name", None)
+  markup = socketReader.readDataStr()
+  if layoutName == None:
+    return "ERROR: missing layout name\n"
+
+  if markup != "":
+    writeStateLayout(layoutName, markup)
+  else:
+    markup = readStateLayout(layoutName)
+    if markup == None:
+      return "ERROR: layout '%s' does not exist\n" % layoutName
+
+  controller['lcdFont'].drawLayout(layoutName, markup)
+  return "layout[%s]: %d bytes\n" % (layoutName, len(markup))
+
+def cmdSet(controller, params, socketReader):
+  layoutName = maybeGetParamStr(params, "layout", None)
+  keyVals = {}
+  for key in params:
+    if key != "layout":
+      keyVals[key] = params[key]
+
+  lcdFont = controller['lcdFont']
+  if layoutName != None and layoutName != lcdFont.getLayoutName():
+    markup = readStateLayout(layoutName)
+    if markup == None:
+      return "ERROR: layout '%s' does not exist\n" % layoutName
+    lcdFont.vars.update(keyVals)
+    lcdFont.drawLayout(layoutName, markup)
+    return "set: %d vars, layout redrawn\n" % len(keyVals)
+
+  lineCount = lcdFont.setLayoutVars(keyVals)
+  if lineCount < 0:
+    return "set: %d vars, layout redrawn\n" % len(keyVals)
+  else:
+    return "set: %d vars, %d lines redrawn\n" % (len(keyVals), lineCount)
+
+def cmdUpdate(controller, params, socketReader):
+  widgetId = maybeGetParamStr(params, "id", None)
+  text = maybeGetParamStr(params, "text", None)
+  pct = maybeGetParamInt(params, "pct", None)
+  filename = maybeGetParamStr(params, "file", None)
+  isShow = maybeGetParamBool(params, "show", True)
+  if widgetId == None:
+    return "ERROR: missing widget id\n"
+
+  box = controller['lcdFont'].updateWidget(widgetId,
+    text=text, pct=pct, filename=filename, isShow=isShow)
+  if box == None:
+    return "ERROR: no widget with id=%s\n" % widgetId
+  (x, y, w, h) = box
+  return "update[%s]: %sx%s+%s+%s\n" % (widgetId, w, h, x, y)
+
+def cmdPush(controller, params, socketReader):
+  graphId = maybeGetParamStr(params, "id", None)
+  valsStr = maybeGetParamStr(params, "v", "")
+  isShow = maybeGetParamBool(params, "show", True)
+  if graphId == None:
+    return "ERROR: missing graph id\n"
+
+  vals = []
+  for valStr in valsStr.split(","):
+    try:
+      vals.append(int(valStr))
+    except:
+      return "ERROR: could not parse sample '%s'\n" % valStr
+
+  if not controller['lcdFont'].pushGraph(graphId, vals, isShow=isShow):
+    return "ERROR: no graph with id=%s\n" % graphId
+  return "push[%s]: %d samples\n" % (graphId, len(vals))
+
+def cmdVec(controller, params, socketReader):
+  mode = maybeGetParamStr(params, "mode", "polyline")
+  colorName = maybeGetParamStr(params, "color", None)
+  x = maybeGetParamInt(params, "x", 0)
+  y = maybeGetParamInt(params, "y", 0)
+  isClear = maybeGetParamBool(params, "clear", False)
+  isShow = maybeGetParamBool(params, "show", True)
+  data = socketReader.readData()
+
+  if mode not in VEC_MODES:
+    return "ERROR: invalid mode %s\n" % mode
+  color = None
+  if colorName != None:
+    color = controller['lcdFont'].maybeReadColor(colorName, None)
+    if color == None:
+      return "ERROR: could not parse color %s\n" % colorName
 
+  pointCount = controller['lcdFont'].vec(data, mode=mode, color=color, x=x, y=y,
+    isClear=isClear, isShow=isShow)
+  return "vec: %d points\n" % pointCount
+
+def cmdMeasure(controller, params, socketReader):
+  markup = socketReader.readDataStr()
+  (x, y, w, h) = controller['lcdFont'].measureMarkup(markup)
+  (winW, winH) = controller['lcd'].get_target_window_size()
+  out = ""
+  out += "box: %sx%s+%s+%s\n" % (w, h, x, y)
+  out += "window: %sx%s\n" % (winW, winH)
   return out
 
 #####
@@ -469,10 +627,13 @@ def cmdText(controller, params, socketReader):
 
 def ensureFont():
   try:
-    if not fileExists('font5x8.bin'):
+    if not fileExists('font5x8.bin') or not fileExists('font5x8.bin.rects'):
       gc.collect()
       import font_generator
-      font_generator.writeFontFile('font5x8.bin')
+      if not fileExists('font5x8.bin'):
+        font_generator.writeFontFile('font5x8.bin')
+      font_generator.writeFontRectsFile('font5x8.bin',
+        font_generator.getRectsFileName('font5x8.bin'))
       gc.collect()
   except Exception as e:
     print("WARNING: font-generator failed\n" + str(e))
@@ -595,6 +756,8 @@ def formatButtonCount(buttons):
 
 def setOrientation(controller, orient):
   out = setLCDOrientation(controller['lcd'], orient)
+  #layouts, widgets and the last diff frame were drawn at the old coordinates
+  controller['lcdFont'].clearRetained()
   controller['lcdFont'].show()
   return out
 
@@ -745,12 +908,15 @@ class SocketReader:
     self.lastReadMs = time.ticks_ms()
     self.bytesRead = 0
   def readDataStr(self):
-    data = b""
+    return self.readData().decode("utf8")
+  def readData(self):
+    return b"".join(self.readDataChunks())
+  #generator of non-empty chunks, as they arrive
+  def readDataChunks(self):
     while self.isReady():
       chunk = self.readDataChunk()
-      if chunk != None:
-        data += chunk
-    return data.decode("utf8")
+      if chunk != None and len(chunk) > 0:
+        yield chunk
   def readDataChunk(self):
     try:
       chunk = self.socket.recv(1024)
@@ -865,6 +1031,11 @@ def writeStateTemplate(templateName, templateMarkup):
   stateFile = PREFIX_STATE_FILE_TEMPLATE + templateName
   writeFile(stateFile, templateMarkup)
 
+def readStateLayout(layoutName):
+  return readFileContents(PREFIX_STATE_FILE_LAYOUT + layoutName)
+def writeStateLayout(layoutName, markup):
+  writeFile(PREFIX_STATE_FILE_LAYOUT + layoutName, markup)
+
 def readStateTimeout():
   val = readFileLine(STATE_FILE_TIMEOUT)
   try:
@@ -905,6 +1076,13 @@ def readFileLine(file):
   except:
     return None
 
+def readFileContents(file):
+  try:
+    with open(file, "r") as fh:
+      return fh.read()
+  except:
+    return None
+
 def writeFile(file, contents):
   try:
     with open(file, "w") as fh:
@@ -955,8 +1133,8 @@ def setupWifi(controller):
     while time.time() < endEpoch:
       status = wlan.status()
       print('waiting for connection (ssid=' + ssid + ', status=' + str(status) + ')...')
-      controller['lcdFont'].markup(replaceMarkupTemplate('wifi-waiting',
-        {'ssid':ssid}))
+      drawMarkupTemplate(controller, 'wifi-waiting',
+        {'ssid':ssid})
 
       if status in ARR_NW_STAT_IDLE or status in ARR_NW_STAT_FAILURE:
         if status in ARR_NW_STAT_FAILURE:
@@ -985,15 +1163,15 @@ def setupWifi(controller):
 
     controller['wlanInfo'] = {'mac': mac, 'ssid': connectedSSID, 'ip': ip}
 
-    controller['lcdFont'].markup(replaceMarkupTemplate('wifi-connected',
-      {'ip':ip}))
+    drawMarkupTemplate(controller, 'wifi-connected',
+      {'ip':ip})
 
 def setupAccessPoint(controller):
   ssid = "pico-lcd"
   password = "123456789"
 
-  controller['lcdFont'].markup(replaceMarkupTemplate('ap-waiting',
-    {'ssid':ssid}))
+  drawMarkupTemplate(controller, 'ap-waiting',
+    {'ssid':ssid})
 
   wlan = network.WLAN(network.AP_IF)
   wlan.config(essid=ssid, password=password)
@@ -1004,8 +1182,8 @@ def setupAccessPoint(controller):
     if wlan.active:
       break
     print('waiting for connection...')
-    controller['lcdFont'].markup(replaceMarkupTemplate('ap-waiting',
-      {'ssid':ssid}))
+    drawMarkupTemplate(controller, 'ap-waiting',
+      {'ssid':ssid})
     time.sleep(0.5)
 
   if not wlan.active:
@@ -1020,14 +1198,23 @@ def setupAccessPoint(controller):
   mac = wlan.config('mac').hex(":").upper()
   controller['wlanInfo'] = {'mac': mac, 'ssid': ssid, 'ip': ip}
 
-  controller['lcdFont'].markup(replaceMarkupTemplate('ap-active',
-    {'ssid':ssid, 'password':password, 'ip':ip}))
-
-def replaceMarkupTemplate(templateName, keyVals):
-  markup = readStateTemplate(templateName)
-  for key in keyVals.keys():
-    markup = markup.replace('[var=' + key + ']', keyVals[key])
-  return markup
+  drawMarkupTemplate(controller, 'ap-active',
+    {'ssid':ssid, 'password':password, 'ip':ip})
+
+# draw a status template as a layout, with keyVals for its [var=NAME] slots
+#   if the template is already on the screen, redraw only the lines with changed vars
+def drawMarkupTemplate(controller, templateName, keyVals, isRedraw=False):
+  lcdFont = controller['lcdFont']
+  layoutName = "template-" + templateName
+  if not isRedraw and lcdFont.getLayoutName() == layoutName:
+    lcdFont.setLayoutVars(keyVals)
+    return
+
+  markupCache = controller['templateMarkupCache']
+  if templateName not in markupCache:
+    markupCache[templateName] = readStateTemplate(templateName)
+  lcdFont.vars.update(keyVals)
+  lcdFont.drawLayout(layoutName, markupCache[templateName])
 
 def maybeGetRTC():
   rtc = RTC_DS3231()
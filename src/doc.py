@@ -191,7 +191,7 @@ CMD_SHOW = {
   "name":   "show",
   "params": {},
   "body":   None,
-  "desc":   "display LCD (write framebuf to LCD, no effect if framebuf=off)",
+  "desc":   "display LCD (write entire framebuf to LCD, no effect if framebuf=off)",
 }
 CMD_BUTTONS = {
   "name":   "buttons",
@@ -223,6 +223,9 @@ CMD_ORIENT = {
   "body":   None,
   "desc":   """
     set the orientation of the LCD
+    NOTE: when orientation changes, the framebuf is rotated in place,
+          so the LCD shows the same picture as before
+          (if there is not enough memory to rotate it, the framebuf is cleared instead)
     ORIENT_SYNONYM =
       0   = landscape | normal | default
       270 = portrait | -90
@@ -233,7 +236,7 @@ CMD_ORIENT = {
 CMD_FRAMEBUF = {
   "name":   "framebuf",
   "params": {
-    "framebuf": "[OPTIONAL] off | <FB_W>x<FB_H> | <FB_W>x<FB_H>+<FB_X>+<FB_Y> | <FB_NAME>"
+    "framebuf": "[OPTIONAL] off | band | band<ROWS> | <FB>[:pal4|:pal8]"
   },
   "body":   None,
   "desc":   """
@@ -242,13 +245,32 @@ CMD_FRAMEBUF = {
           <FB_W> and <FB_X> always refer to the longest dimension of the physical LCD
           <FB_H> and <FB_Y> always refer to the shortest dimension of the physical LCD
     NOTE: 'framebuf' uses a lot of memory. if memory allocation fails, framebuf is disabled
+          and markup is drawn in bands of 40 rows instead, as in 'band'
           the framebuf, if any, that is actually successfully allocated is returned
-          if 'framebuf: off' is returned instead of a framebuf, allocation likely failed
+          if 'framebuf: band40' is returned instead of a framebuf, allocation likely failed
 
     'framebuf' param:
+      <FB>          = <FB_W>x<FB_H> | <FB_W>x<FB_H>+<FB_X>+<FB_Y> | <FB_NAME>
+      <FB>:pal4     = same as <FB>, but store 4-bit palette indexes instead of colors
+                        -at most 16 colors per frame, including the 8 named colors,
+                          and other colors are drawn as the nearest color in the palette
+                        -the palette starts over when the framebuf is cleared,
+                          if the last frame ran out of colors
+                        -uses 1/4 the memory of RGB565 (320x240 is 38400 bytes instead of 153600)
+                        -colors are expanded to RGB565 when the framebuf is written to the LCD
+      <FB>:pal8     = same as <FB>:pal4, but with 8-bit palette indexes
+                        -at most 256 colors per frame, using 1/2 the memory of RGB565
       <FB_W>x<FB_H>+<FB_X>+<FB_Y> = enable framebuf with WxH and offset (0, 0)
       <FB_W>x<FB_H> = same as <FB_W>x<FB_H>+0+0
       off           = disable the framebuf
+      band<ROWS>    = disable the framebuf, but draw markup in bands of <ROWS> rows
+                        -markup that is cleared and shown, e.g.: 'text' with clear=true show=true,
+                          is drawn once per band in a small framebuf as wide as the LCD,
+                          and each band is written to the LCD when it is done
+                        -nothing is visible before it is completely drawn, as with a framebuf,
+                          using <LCD_W>x<ROWS> RGB565 instead of a full framebuf
+                        -everything else is drawn directly to the LCD, as with 'off'
+      band          = same as band40
       <FB_NAME>     = one of: full | left | right | top | bottom | square
       full          = same as <LCD_W>x<LCD_H>                      e.g.: 320x240
       left          = same as <HALF_LCD_W>x<LCD_H>                 e.g.: 160x240
@@ -309,18 +331,176 @@ CMD_TEXT = {
     "info":     "[OPTIONAL] if present, add output as in 'info' command (default=False)",
     "framebuf": "[OPTIONAL] if present, same as 'framebuf' command (default=None)",
     "orient":   "[OPTIONAL] if present, same as 'orient' command (default=None)",
+    "diff":     "[OPTIONAL] redraw only what changed since the last 'diff' markup (default=False)",
   },
   "body":   "markup to display",
   "desc":   """
-    -fetch 'markup' from body, decode as UTF-8
     -if 'orient' param is given, set the orientation as in the 'orient' cmd
     -if 'framebuf' param is given, set the framebuf as in the 'framebuf' cmd
-    -if 'markup' contains '[rtc]:
-      -fetch the current RTC epoch
-      -calculate the tz offset from CSV, if tz name is set and CSV exists
     -if 'clear' param is given, fill the window with black as in the 'fill' cmd
-    -draw the markup, in the framebuf or in the LCD
-    -if 'show' is given, copy the framebuf to the LCD as in the 'show' cmd
+    -fetch 'markup' from body, decode as UTF-8, and draw it while it arrives
+      -each part is drawn as soon as the rest of the markup cannot change it
+        -tags are drawn once the closing ']' arrives
+        -[fit] waits for its [/fit], aligned lines wait for the newline,
+           and wrapped text waits for each space
+      -if 'markup' contains '[rtc]:
+        -fetch the current RTC epoch
+        -calculate the tz offset from CSV, if tz name is set and CSV exists
+      -draw the markup, in the framebuf or in the LCD
+    -if 'show' is given, copy the parts of the framebuf that changed to the LCD
+    -if 'diff' is given, do not clear, and draw only what changed since the last 'diff' markup
+      -the markup is drawn after it arrives, and not while it is still arriving
+      -the position, style and text of each drawn element is compared with the last 'diff' markup
+      -elements that are gone or changed are filled with black
+      -new and changed elements are drawn, along with unchanged elements they overlap
+      -the first 'diff' markup, or the first after any other drawing, clears the window
+      -markup with both [wrap] and [align] is cleared and drawn in full
+  """,
+}
+CMD_DL = {
+  "name":   "dl",
+  "params": {
+    "clear":    "[OPTIONAL] fill LCD window with black (default=True)",
+    "show":     "[OPTIONAL] write framebuf to LCD if enabled (default=True)",
+  },
+  "body":   "binary display list, markup compiled on the host",
+  "desc":   """
+    -fetch the display list bytes from body
+      -a display list is markup parsed into ops by the host, e.g.: pico-lcd-msg --dl
+      -colors are sent as RGB, ints and floats as binary, and text as UTF-8
+      -a display list with a different format version is rejected, and nothing is drawn
+    -if 'clear' param is given, fill the window with black as in the 'fill' cmd
+    -draw the ops, exactly as in the 'text' cmd with the markup they were compiled from
+      -no markup is parsed on the device
+    -if 'show' is given, copy the parts of the framebuf that changed to the LCD
+  """,
+}
+CMD_COST = {
+  "name":   "cost",
+  "params": {
+    "clear":    "[OPTIONAL] include filling the window with black (default=True)",
+    "show":     "[OPTIONAL] include writing the framebuf to the LCD (default=True)",
+    "actual":   "[OPTIONAL] also draw the markup, and time it (default=False)",
+  },
+  "body":   "markup to estimate",
+  "desc":   """
+    -fetch 'markup' from body, decode as UTF-8
+    -run the 'text' command with the markup, against a counting stand-in for the LCD
+      -nothing is drawn, images are read only for their headers
+    -print the counts, and a render time estimated from per-op costs, formatted as:
+      "primitives: <DRAW_CALLS>\n"
+      "spi transactions: <SPI_WRITES>\n"
+      "lcd px: <PX_SENT_TO_LCD>\n"
+      "framebuf px: <PX_WRITTEN_TO_FRAMEBUF>\n"
+      "show bytes: <FRAMEBUF_BYTES_SENT_TO_LCD>\n"
+      "files opened: <FILE_COUNT>\n"
+      "uncalibrated estimate: <MILLIS> ms\n"
+    -the per-op costs are guesses, not measured on any board, so the estimate is UNCALIBRATED
+      -use it to compare markup, not as a time budget
+      -use 'actual' to measure the real render time on the device
+    -if 'actual' is given, draw the markup as in the 'text' command, and also print:
+      "actual: <MILLIS> ms\n"
+      "actual spi transactions: <SPI_WRITES>\n"
+      "actual spi bytes: <BYTES_SENT_TO_LCD>\n"
+    -actual spi counts do not include draws by the st7789 driver,
+      e.g.: PNG images, and rects/lines/text drawn directly with the framebuf off
+  """,
+}
+CMD_LAYOUT = {
+  "name":   "layout",
+  "params": {
+    "name":     "name of the layout, stored on the device",
+  },
+  "body":   "layout markup, blank to draw the stored layout",
+  "desc":   """
+    -fetch 'markup' from body, decode as UTF-8
+    -if markup is not blank, store it as layout 'name'
+    -clear the window and draw layout 'name' as in the 'text' command
+      -[var=NAME] draws the current value of variable NAME (see 'set')
+    -keep the layout on the screen, so 'set' can redraw only the lines that change
+  """,
+}
+CMD_SET = {
+  "name":   "set",
+  "params": {
+    "layout":   "[OPTIONAL] name of the layout to draw, if it is not already on the screen",
+    "<VAR>":    "[OPTIONAL] value of variable <VAR>, for [var=<VAR>] in layouts/templates",
+  },
+  "body":   None,
+  "desc":   """
+    -set each <VAR>=<VALUE> param as a variable
+    -if 'layout' is given and is not on the screen, draw the entire layout
+    -otherwise, erase and redraw only the lines of the current layout that show changed variables
+      -lines with [wrap] or [fit] redraw the entire layout
+  """,
+}
+CMD_UPDATE = {
+  "name":   "update",
+  "params": {
+    "id":       "name of the element, from [id=NAME] in the markup on the screen",
+    "text":     "[OPTIONAL] new text, for a text element",
+    "pct":      "[OPTIONAL] new integer percentage, for a [bar] element",
+    "file":     "[OPTIONAL] new image file, for a [png] or [pnm] element",
+    "show":     "[OPTIONAL] write the changed region of the framebuf to the LCD (default=True)",
+  },
+  "body":   None,
+  "desc":   """
+    -erase the bounding box of the element 'id', and redraw it with the new value
+      -the element is drawn at the same position, with the same size/color/font
+    -in framebuf mode, write only the erased and redrawn region to the LCD
+    -print the new bounding box of the element, formatted as:
+      "update[<ID>]: <W>x<H>+<X>+<Y>\n"
+  """,
+}
+CMD_PUSH = {
+  "name":   "push",
+  "params": {
+    "id":       "name of the graph, from [graph=ID,...] in markup drawn earlier",
+    "v":        "one integer sample, or a comma-separated list of samples, oldest first",
+    "show":     "[OPTIONAL] write the graph region of the framebuf to the LCD (default=True)",
+  },
+  "body":   None,
+  "desc":   """
+    -append the samples to the history of the graph, dropping the oldest
+    -if the graph is on the screen, scroll it left and draw only the new columns
+      -in framebuf mode, the old columns are moved in the framebuf,
+        and only the graph region is written to the LCD
+    -print the number of samples added, formatted as:
+      "push[<ID>]: <COUNT> samples\n"
+  """,
+}
+CMD_VEC = {
+  "name":   "vec",
+  "params": {
+    "mode":     "[OPTIONAL] one of: lines, polyline, poly, fill (default=polyline)",
+    "color":    "[OPTIONAL] color name or hex RGB (default=white)",
+    "x":        "[OPTIONAL] px to add to each X coordinate (default=0)",
+    "y":        "[OPTIONAL] px to add to each Y coordinate (default=0)",
+    "clear":    "[OPTIONAL] fill the window with black first (default=False)",
+    "show":     "[OPTIONAL] write the framebuf to the LCD after drawing (default=True)",
+  },
+  "body":   "binary little-endian int16 values X1,Y1,X2,Y2,...",
+  "desc":   """
+    -fetch packed coordinates from body, as in an array('h') on the device
+    -draw them with framebuf/st7789 line and polygon primitives, as one of:
+      lines    = separate line segments, 4 values each: X1,Y1,X2,Y2
+      polyline = one open path through all the points
+      poly     = a closed polygon outline
+      fill     = a filled polygon
+    -print the number of points, formatted as:
+      "vec: <POINT_COUNT> points\n"
+  """,
+}
+CMD_MEASURE = {
+  "name":   "measure",
+  "params": {},
+  "body":   "markup to measure",
+  "desc":   """
+    -fetch 'markup' from body, decode as UTF-8
+    -lay out the markup exactly as in the 'text' command, without drawing anything
+      -chars are measured without HSPACE/VSPACE, images by their file headers
+    -print the bounding box of the markup, and the size of the window, formatted as:
+      "box: <W>x<H>+<X>+<Y>\nwindow: <WINDOW_W>x<WINDOW_H>\n"
   """,
 }
 
@@ -2,6 +2,8 @@
 # Author: Tony DiCola
 # License: MIT (https://opensource.org/licenses/MIT)
 # Taken from glcdfont.c from Adafruit GFX Arduino library.
+import struct
+
 FONT = bytes((
     0x00, 0x00, 0x00, 0x00, 0x00,
     0x3E, 0x5B, 0x4F, 0x5B, 0x3E,
@@ -262,12 +264,146 @@ FONT = bytes((
 ))
 
 def writeFontFile(filename):
-  with open('font5x8.bin', 'wb') as outfile:
+  with open(filename, 'wb') as outfile:
       # Write a byte each for the character width, character height.
       outfile.write(bytes((5, 8)))
       # Now write all of the font character bytes.
       for font_byte in FONT:
           outfile.write(font_byte.to_bytes(1, 'big'))
 
+def getRectsFileName(fontFileName):
+  return fontFileName + ".rects"
+
+# rect cover file, for drawing each glyph with a few rects instead of one per dot
+#   format (all little-endian):
+#     GLYPH_COUNT      uint16
+#     RECT_OFFSETS     uint16 * (GLYPH_COUNT+1), index of the first rect of each glyph
+#     RECTS            4 bytes each: X, Y, W, H in dots
+#   the rects for glyph N are RECTS[RECT_OFFSETS[N]:RECT_OFFSETS[N+1]]
+#     (N is the codepoint in a flat font, and the position in the INDEX in a sparse font)
+def writeFontRectsFile(fontFileName, rectsFileName):
+  (w, h, glyphs) = readFontGlyphs(fontFileName)
+  glyphCount = len(glyphs)
+
+  offsets = [0]
+  rects = []
+  for glyphBytes in glyphs:
+    rects += getGlyphRectCover(glyphBytes, w, h)
+    offsets.append(len(rects))
+
+  with open(rectsFileName, 'wb') as outfile:
+    outfile.write(struct.pack('<H', glyphCount))
+    for offset in offsets:
+      outfile.write(struct.pack('<H', offset))
+    for rect in rects:
+      outfile.write(bytes(rect))
+
+SPARSE_FONT_MAGIC = b'\x00SPF'
+SPARSE_FONT_HEADER_FMT = '<4sBBBBHHHH'
+SPARSE_FONT_FLAG_INDEX_UINT32 = 0x01
+SPARSE_FONT_FLAG_ADVANCES = 0x02
+
+# sparse font file, for fonts with codepoints above 255 (see SparseFont in lcdFont.py)
+#   fixed-width and column-major only, see font-compiler for BDF/TTF fonts
+#   glyphs is a dict of codepoint => 1-bit column-major glyph bytes
+#   pageGlyphs is the number of glyphs read from the file at a time when drawing
+def writeSparseFontFile(filename, w, h, glyphs, pageGlyphs=64):
+  bytesPerGlyph = (w*h + 7) // 8
+  codepoints = sorted(glyphs.keys())
+  flags = 0
+  indexFmt = '<H'
+  if len(codepoints) > 0 and codepoints[-1] > 0xFFFF:
+    flags |= SPARSE_FONT_FLAG_INDEX_UINT32
+    indexFmt = '<I'
+
+  with open(filename, 'wb') as outfile:
+    outfile.write(struct.pack(SPARSE_FONT_HEADER_FMT, SPARSE_FONT_MAGIC, 1,
+      w, h, flags, len(codepoints), pageGlyphs, bytesPerGlyph, 0))
+    for codepoint in codepoints:
+      outfile.write(struct.pack(indexFmt, codepoint))
+    for codepoint in codepoints:
+      glyphBytes = bytes(glyphs[codepoint])
+      if len(glyphBytes) != bytesPerGlyph:
+        raise ValueError("glyph %d is %d bytes, expected %d"
+          % (codepoint, len(glyphBytes), bytesPerGlyph))
+      outfile.write(glyphBytes)
+
+# read the width, height and list of glyph bytes, in glyph index order,
+#   of either a flat font file or a sparse font file
+def readFontGlyphs(fontFileName):
+  with open(fontFileName, 'rb') as fh:
+    fontBytes = fh.read()
+  if fontBytes[0:len(SPARSE_FONT_MAGIC)] == SPARSE_FONT_MAGIC:
+    headerSize = struct.calcsize(SPARSE_FONT_HEADER_FMT)
+    (magic, version, w, h, flags, glyphCount, pageGlyphs, bytesPerGlyph, reserved,
+      ) = struct.unpack(SPARSE_FONT_HEADER_FMT, fontBytes[0:headerSize])
+    indexEntryBytes = 4 if flags & SPARSE_FONT_FLAG_INDEX_UINT32 else 2
+    glyphsOffset = headerSize + glyphCount*indexEntryBytes
+    if flags & SPARSE_FONT_FLAG_ADVANCES:
+      glyphsOffset += glyphCount
+  else:
+    (w, h) = (fontBytes[0], fontBytes[1])
+    bytesPerGlyph = int(w*h/8 + 0.5)
+    glyphCount = (len(fontBytes) - 2) // bytesPerGlyph
+    glyphsOffset = 2
+
+  glyphs = []
+  for glyphIdx in range(glyphCount):
+    start = glyphsOffset + glyphIdx*bytesPerGlyph
+    glyphs.append(fontBytes[start:start+bytesPerGlyph])
+  return (w, h, glyphs)
+
+# cover the lit dots of a column-major 1-bit glyph with a small set of rects
+#   merge vertical runs across columns, and horizontal runs across rows,
+#   and return whichever needs fewer rects, as a list of (x, y, w, h)
+def getGlyphRectCover(glyphBytes, w, h):
+  dots = []
+  for x in range(w):
+    col = []
+    for y in range(h):
+      bitIdx = x*h + y
+      col.append((glyphBytes[bitIdx >> 3] >> (bitIdx & 7)) & 1)
+    dots.append(col)
+
+  vertRects = mergeRuns(dots, w, h)
+  transposed = [[dots[x][y] for x in range(w)] for y in range(h)]
+  horizRects = [(x, y, rw, rh) for (y, x, rh, rw) in mergeRuns(transposed, h, w)]
+
+  if len(horizRects) < len(vertRects):
+    return horizRects
+  else:
+    return vertRects
+
+# find runs of lit dots in each column, and extend each run to the right
+#   into a rect for as long as the next column has the identical run
+#   dots[x][y] is 1 for lit, 0 for unlit
+def mergeRuns(dots, w, h):
+  rects = []
+  openRects = {}
+  for x in range(w + 1):
+    runs = []
+    if x < w:
+      y = 0
+      while y < h:
+        if dots[x][y] == 1:
+          runStart = y
+          while y < h and dots[x][y] == 1:
+            y += 1
+          runs.append((runStart, y - runStart))
+        else:
+          y += 1
+
+    nextOpenRects = {}
+    for run in runs:
+      if run in openRects:
+        nextOpenRects[run] = openRects.pop(run)
+      else:
+        nextOpenRects[run] = x
+    for (runStart, runLen), startX in openRects.items():
+      rects.append((startX, runStart, x - startX, runLen))
+    openRects = nextOpenRects
+  return rects
+
 if __name__ == '__main__':
   writeFontFile('font5x8.bin')
+  writeFontRectsFile('font5x8.bin', getRectsFileName('font5x8.bin'))
@@ -15,6 +15,34 @@ MADCTL_RGB = 0 #0:RGB                    1:BGR
 
 COLOR_PROFILE_RGB565 = "RGB565"
 COLOR_PROFILE_RGB444 = "RGB444"
+#palette indexes in the framebuf, of RGB565 colors
+COLOR_PROFILE_PAL4 = "PAL4"
+COLOR_PROFILE_PAL8 = "PAL8"
+
+#colors that are not in a full palette are matched to the nearest palette color
+#  and up to this many of those matches are remembered
+PALETTE_NEAREST_CACHE_MAX = 256
+
+#scratch buffer for writing pixel blocks directly to the LCD, sent in chunks of rows
+BLOCK_BUF_SIZE_BYTES = 4096
+
+#past this many separate dirty rects, they are merged into one
+DIRTY_RECTS_MAX = 8
+
+#rows per band, when the framebuf is off and markup is drawn in bands
+#  e.g.: 320x40 RGB565 is 25KiB
+BAND_ROWS_DEFAULT = 40
+
+#SPI1 registers and TX DREQ, for writing the framebuf with DMA
+#  keyed by the chip name in os.uname().machine
+SPI1_BASE_ADDRS = {"RP2040": 0x40040000, "RP2350": 0x40088000}
+SPI1_TX_DREQS   = {"RP2040": 18,         "RP2350": 26}
+SPI_SSPDR  = 0x08 #data
+SPI_SSPSR  = 0x0C #status
+SPI_SSPICR = 0x20 #interrupt clear
+SPI_SSPSR_RNE = 0x04    #RX FIFO not empty
+SPI_SSPSR_BSY = 0x10    #still shifting out a frame
+SPI_SSPICR_RORIC = 0x01 #clear RX overrun
 
 class LCD():
   def __init__(self, pins, landscapeWidth, landscapeHeight, rotationLayouts):
@@ -28,8 +56,27 @@ class LCD():
 
     self.buffer = None
     self.framebuf = None
+    self.monoPaletteBuf = None
+    self.monoPalette = None
+    self.blockBuf = None
     self.fbConf = FramebufConf(enabled=False)
     self.isWindowSetToFramebuf = False
+    #[x0, y0, x1, y1] parts of the framebuf changed since the last show()
+    self.dirtyRects = []
+    self.isAllDirty = True
+    #big-endian RGB565 color of each palette index, only for PAL4/PAL8 framebufs
+    self.paletteLUT = None
+    self.paletteIdxs = {}
+    self.paletteCount = 0
+    self.isPaletteFull = False
+    #incremented each time the palette is reset, and its indexes change
+    self.paletteGen = 0
+    #while set, colors not in the palette get the nearest index, and are not added
+    self.isPaletteFrozen = False
+    #band framebuf, when the framebuf is off, see start_band()
+    self.bandBuffer = None
+    self.bandY = 0
+    self.bandRows = 0
 
     self.colorProfile = None
     self.isColorProfileBigEndian = True
@@ -53,6 +100,23 @@ class LCD():
     self.spi = machine.SPI(1, 100_000_000, polarity=0, phase=0,
       sck=machine.Pin(self.pins['SCK']), mosi=machine.Pin(self.pins['MOSI']), miso=misoPin)
 
+    #preallocated, so that commands and windows do not allocate
+    self.cmdBuf = bytearray(1)
+    self.colmodBuf = bytearray(1)
+    self.windowBuf = bytearray(4)
+    #SPI transactions (one per CS assertion) and bytes sent to the LCD by this LCD,
+    #  not counting draws by the st7789 driver
+    self.spiTransactions = 0
+    self.spiBytes = 0
+
+    #DMA channel for show(), see write_data_async()
+    self.dma = None
+    self.dmaCtrl = None
+    self.dmaData = None
+    self.isDMABusy = False
+    self.spiBaseAddr = None
+    self.init_dma()
+
     self.tpcs = None
     if self.pins['TPCS'] != None:
       self.tpcs = machine.Pin(self.pins['TPCS'], machine.Pin.OUT)
@@ -72,6 +136,29 @@ class LCD():
     # blank entire memory, not just display size
     self.fill_mem_blank()
 
+  # claim a DMA channel that feeds SPI1 from memory, paced by the SPI1 TX DREQ
+  #   (machine.SPI enables the DMA requests of the SPI peripheral in spi_init())
+  #   without rp2.DMA, or on an unknown chip, show() writes synchronously instead
+  def init_dma(self):
+    chip = None
+    for chipName in SPI1_BASE_ADDRS:
+      if chipName in os.uname().machine:
+        chip = chipName
+    if chip == None:
+      return
+
+    try:
+      import rp2
+      self.dma = rp2.DMA()
+    except (ImportError, AttributeError, OSError) as e:
+      print("WARNING: DMA not available, show() will wait for SPI\n" + str(e))
+      self.dma = None
+      return
+
+    self.spiBaseAddr = SPI1_BASE_ADDRS[chip]
+    self.dmaCtrl = self.dma.pack_ctrl(
+      size=0, inc_read=True, inc_write=False, treq_sel=SPI1_TX_DREQS[chip])
+
   def convert_rotation_layout_to_tft_tuple(self, width, height, rotationLayout):
     madctl = (0
       | rotationLayout['MY']  << 7 #0:nothing  1:mirror row address
@@ -103,7 +190,10 @@ class LCD():
     return self.get_lcd_rotated_size()[1]
 
   #framebuf size, un-rotated (width is the dimension that is longer on the physical LCD)
+  #  while drawing a band, the band framebuf stands in for a framebuf the size of the LCD
   def get_framebuf_landscape_size(self):
+    if self.bandRows > 0:
+      return self.get_lcd_landscape_size()
     return (self.fbConf.fbW, self.fbConf.fbH)
   def get_framebuf_landscape_width(self):
     return self.get_framebuf_landscape_size()[0]
@@ -130,6 +220,8 @@ class LCD():
     return self.get_target_window_size()[1]
 
   def get_framebuf_landscape_offset(self):
+    if self.bandRows > 0:
+      return (0, 0)
     return (self.fbConf.fbX, self.fbConf.fbY)
   def get_framebuf_rotated_offset(self):
     return self.swapIfNotLandscape(self.get_framebuf_landscape_offset())
@@ -142,11 +234,20 @@ class LCD():
     return self.get_target_window_size() == self.get_lcd_rotated_size()
 
   def is_framebuf_enabled(self):
-    return self.fbConf.enabled
+    return self.fbConf.enabled or self.bandRows > 0
+
+  #framebuf is off, but markup can be drawn in bands
+  def is_band_enabled(self):
+    return not self.fbConf.enabled and self.bandBuffer != None
+
+  #a band is being drawn, between start_band() and end_bands()
+  def is_band_active(self):
+    return self.bandRows > 0
 
   def get_framebuf_conf(self):
     return self.fbConf
   def set_framebuf_conf(self, fbConf):
+    self.wait_show()
     if fbConf == None:
       self.fbConf = FramebufConf(enabled=False)
     else:
@@ -164,7 +265,12 @@ class LCD():
 
   def create_buffer(self):
     (fbW, fbH) = self.get_framebuf_landscape_size()
-    framebufSizeBytes = fbW * fbH * self.bits_per_px() // 8
+    if self.bits_per_px() == 4:
+      #GS4 rows start on a byte, in either orientation
+      framebufSizeBytes = ((fbW + 1) // 2) * ((fbH + 1) // 2) * 2
+    else:
+      #odd RGB444 sizes end in half a byte
+      framebufSizeBytes = (fbW * fbH * self.bits_per_px() + 7) // 8
 
     if self.buffer == None or len(self.buffer) != framebufSizeBytes:
       self.framebuf = None
@@ -175,22 +281,104 @@ class LCD():
         self.buffer = bytearray(framebufSizeBytes)
       except Exception as e:
         print(str(e))
-        print("WARNING: COULD NOT ALLOCATE BUFFER, DISABLING FRAMEBUF\n")
-        self.set_framebuf_conf(None)
+        print("WARNING: COULD NOT ALLOCATE BUFFER, DISABLING FRAMEBUF AND DRAWING IN BANDS\n")
+        self.set_framebuf_conf(FramebufConf(enabled=False, bandH=BAND_ROWS_DEFAULT))
 
   def init_framebuf(self):
     self.isWindowSetToFramebuf = False
+    self.mark_all_dirty()
     if self.buffer != None:
       (rotFBW, rotFBH) = self.get_framebuf_rotated_size()
       self.framebuf = framebuf.FrameBuffer(
-        self.buffer, rotFBW, rotFBH, self.framebufColorProfile)
+        self.buffer, rotFBW, rotFBH, self.get_framebuf_format())
+
+      #2x1 palette for blit_mono(): 0=>transparent key, 1=>color
+      self.monoPaletteBuf = bytearray(4)
+      self.monoPalette = framebuf.FrameBuffer(
+        self.monoPaletteBuf, 2, 1, self.get_framebuf_format())
 
       self.ensure_framebuf_window()
     else:
       self.framebuf = None
+      self.monoPaletteBuf = None
+      self.monoPalette = None
 
+    self.create_band_buffer()
     self.init_colors()
 
+  # allocate the band framebuf if bands are enabled, as wide as the LCD in any rotation
+  #   or release it if not
+  def create_band_buffer(self):
+    bandH = 0 if self.fbConf.enabled else self.fbConf.bandH
+    bandSizeBytes = max(self.get_lcd_landscape_size()) * bandH * 2
+    if bandSizeBytes == 0:
+      self.bandBuffer = None
+    elif self.bandBuffer == None or len(self.bandBuffer) != bandSizeBytes:
+      self.bandBuffer = None
+      gc.collect()
+      try:
+        self.bandBuffer = bytearray(bandSizeBytes)
+      except Exception as e:
+        print(str(e))
+        print("WARNING: COULD NOT ALLOCATE BAND BUFFER, DRAWING DIRECTLY\n")
+
+  # draw into a band of rows of the LCD, starting at row y, until end_bands()
+  #   the band framebuf is as wide as the LCD, and is drawn at LCD coordinates,
+  #     so anything outside of the band is clipped
+  #   the band is RGB565, in the same colors as drawing directly on the LCD,
+  #     and the bytes of each px are swapped in show()
+  def start_band(self, y):
+    (lcdW, lcdH) = self.get_lcd_rotated_size()
+    self.bandY = y
+    self.bandRows = min(self.fbConf.bandH, lcdH - y)
+    self.framebuf = framebuf.FrameBuffer(self.bandBuffer, lcdW, self.bandRows, framebuf.RGB565)
+    if self.monoPalette == None:
+      self.monoPaletteBuf = bytearray(4)
+      self.monoPalette = framebuf.FrameBuffer(self.monoPaletteBuf, 2, 1, framebuf.RGB565)
+    self.mark_all_dirty()
+
+  def end_bands(self):
+    self.bandY = 0
+    self.bandRows = 0
+    self.framebuf = None
+    self.monoPaletteBuf = None
+    self.monoPalette = None
+    self.isWindowSetToFramebuf = False
+
+  #(width, rows) of the band being drawn
+  def get_band_rotated_size(self):
+    return (self.get_lcd_rotated_width(), self.bandRows)
+
+  # write the band being drawn to its rows of the LCD
+  def show_band(self):
+    (w, h) = self.get_band_rotated_size()
+    byteCount = w * h * 2
+    self.swap_band_px_bytes(byteCount)
+    self.set_window_with_rotation_offset(w, h, 0, self.bandY, isMemWrite=True)
+    self.isWindowSetToFramebuf = False
+    self.write_data(memoryview(self.bandBuffer)[0:byteCount])
+
+  #framebuf RGB565 is little-endian, st7789 is big-endian
+  @micropython.viper
+  def swap_band_px_bytes(self, byteCount:int):
+    buf = ptr8(self.bandBuffer)
+    for i in range(0, byteCount, 2):
+      b = buf[i]
+      buf[i] = buf[i+1]
+      buf[i+1] = b
+
+  def get_framebuf_format(self):
+    if self.is_palette_enabled() and self.fbConf.paletteBits == 4:
+      return framebuf.GS4_HMSB
+    elif self.is_palette_enabled():
+      return framebuf.GS8
+    else:
+      return self.framebufColorProfile
+
+  #framebuf holds palette indexes, expanded to RGB565 in show()
+  def is_palette_enabled(self):
+    return self.fbConf.enabled and self.fbConf.paletteBits > 0
+
   def ensure_framebuf_window(self):
     if self.is_framebuf_enabled() and not self.isWindowSetToFramebuf:
       self.set_window_to_rotated_framebuf()
@@ -202,6 +390,14 @@ class LCD():
       self.colorProfile = COLOR_PROFILE_RGB565
       self.isColorProfileBigEndian = True
       self.set_lcd_RGB565()
+    elif self.is_palette_enabled():
+      #palette indexes in framebuf, RGB565 in the LCD
+      if self.fbConf.paletteBits == 4:
+        self.colorProfile = COLOR_PROFILE_PAL4
+      else:
+        self.colorProfile = COLOR_PROFILE_PAL8
+      self.isColorProfileBigEndian = True
+      self.set_lcd_RGB565()
     elif self.framebufColorProfile == framebuf.RGB565:
       #RGB565, little-endian in framebuf
       self.colorProfile = COLOR_PROFILE_RGB565
@@ -213,6 +409,19 @@ class LCD():
       self.isColorProfileBigEndian = True
       self.set_lcd_RGB444()
 
+    if self.is_palette_enabled() and self.paletteLUT != None and self.paletteCount <= (1 << self.fbConf.paletteBits):
+      #keep the palette of the px already in the framebuf, e.g.: after a rotation
+      self.init_named_colors()
+    elif self.is_palette_enabled():
+      self.reset_palette()
+    else:
+      self.paletteLUT = None
+      self.paletteIdxs = {}
+      self.init_named_colors()
+
+  #black is first, so that palette index 0 is black
+  def init_named_colors(self):
+    self.black   = self.get_color(0x00, 0x00, 0x00)
     self.red     = self.get_color(0xFF, 0x00, 0x00)
     self.green   = self.get_color(0x00, 0xFF, 0x00)
     self.blue    = self.get_color(0x00, 0x00, 0xFF)
@@ -220,7 +429,64 @@ class LCD():
     self.magenta = self.get_color(0xFF, 0x00, 0xFF)
     self.yellow  = self.get_color(0xFF, 0xFF, 0x00)
     self.white   = self.get_color(0xFF, 0xFF, 0xFF)
-    self.black   = self.get_color(0x00, 0x00, 0x00)
+
+  # empty the palette, and add the named colors to it
+  #   palette indexes of colors from before the reset are no longer valid
+  def reset_palette(self):
+    self.paletteLUT = bytearray(256*2)
+    self.paletteIdxs = {}
+    self.paletteCount = 0
+    self.isPaletteFull = False
+    self.paletteGen += 1
+    self.init_named_colors()
+
+  # start a new palette, if a color did not fit in the current one
+  #   call only before getting the colors of a new frame, e.g.: before clearing it
+  def maybe_reset_palette(self):
+    if self.is_palette_enabled() and self.isPaletteFull:
+      self.reset_palette()
+
+  # palette index of a big-endian RGB565 color, adding the color if there is room
+  #   or the index of the nearest color, if the palette is full or frozen
+  def get_palette_index(self, color):
+    idx = self.paletteIdxs.get(color, None)
+    if idx != None:
+      return idx
+    if self.isPaletteFrozen:
+      return self.get_palette_nearest_index(color)
+
+    maxColors = 1 << self.fbConf.paletteBits
+    if self.paletteCount < maxColors:
+      idx = self.paletteCount
+      self.paletteCount += 1
+      self.paletteLUT[idx*2] = color >> 8
+      self.paletteLUT[idx*2 + 1] = color & 0xff
+      self.paletteIdxs[color] = idx
+      return idx
+
+    self.isPaletteFull = True
+    idx = self.get_palette_nearest_index(color)
+    if len(self.paletteIdxs) < maxColors + PALETTE_NEAREST_CACHE_MAX:
+      self.paletteIdxs[color] = idx
+    return idx
+
+  # index of the palette color closest to an RGB565 color, by the sum of squares of R,G,B
+  @micropython.viper
+  def get_palette_nearest_index(self, color:int) -> int:
+    lut = ptr8(self.paletteLUT)
+    count = int(self.paletteCount)
+    (r, g, b) = ((color >> 11) & 0x1F, (color >> 5) & 0x3F, color & 0x1F)
+    (bestIdx, bestDist) = (0, -1)
+    for idx in range(0, count):
+      c = (lut[idx*2] << 8) | lut[idx*2 + 1]
+      #6-bit green is halved, to compare it with 5-bit red and blue
+      dr = ((c >> 11) & 0x1F) - r
+      dg = (((c >> 5) & 0x3F) - g) >> 1
+      db = (c & 0x1F) - b
+      dist = dr*dr + dg*dg + db*db
+      if bestDist < 0 or dist < bestDist:
+        (bestIdx, bestDist) = (idx, dist)
+    return bestIdx
 
   @micropython.viper
   def get_color_rgba(self, r:int, g:int, b:int, a:int) -> int:
@@ -241,7 +507,7 @@ class LCD():
   @micropython.viper
   def get_color(self, r:int, g:int, b:int) -> int:
     color = 0
-    if self.colorProfile == COLOR_PROFILE_RGB565:
+    if self.colorProfile == COLOR_PROFILE_RGB565 or self.paletteLUT != None:
       r5 = (0b11111  * r * 2 + 1) // (255*2)
       g6 = (0b111111 * g * 2 + 1) // (255*2)
       b5 = (0b11111  * b * 2 + 1) // (255*2)
@@ -259,6 +525,9 @@ class LCD():
       #RGB565 byte order is swapped in framebuf vs st7789
       color = int(self.swap_hi_lo_byte_order(color))
 
+    if self.paletteLUT != None:
+      color = int(self.get_palette_index(color))
+
     return color
 
   @micropython.viper
@@ -275,9 +544,12 @@ class LCD():
     bLo = h & 0xff
     return (bLo << 8) | (bHi & 0xff)
 
+  #bits per px in the framebuf, or in the LCD if framebuf is not enabled
   def bits_per_px(self):
-    if not self.is_framebuf_enabled():
+    if not self.is_framebuf_enabled() or self.bandRows > 0:
       return 16 #RGB565
+    elif self.is_palette_enabled():
+      return self.fbConf.paletteBits
     elif self.framebufColorProfile == framebuf.RGB565:
       return 16 #RGB565
     elif self.framebufColorProfile == framebuf.RGB444:
@@ -285,12 +557,21 @@ class LCD():
     else:
       return None
 
+  #bits per px written to the LCD
+  def get_lcd_bits_per_px(self):
+    if self.colorProfile == COLOR_PROFILE_RGB444:
+      return 12
+    else:
+      return 16
+
   def set_lcd_RGB565(self):
+      self.colmodBuf[0] = 0x05
       self.write_cmd(0x3a)
-      self.write_data(bytearray([0x05]))
+      self.write_data(self.colmodBuf)
   def set_lcd_RGB444(self):
+      self.colmodBuf[0] = 0x03
       self.write_cmd(0x3a)
-      self.write_data(bytearray([0x03]))
+      self.write_data(self.colmodBuf)
 
 
   def get_color_by_name(self, colorName):
@@ -340,7 +621,8 @@ class LCD():
     self.set_rotation_index((self.curRotationIdx + 1) % len(self.rotationLayouts))
 
   def set_rotation_index(self, rotationIdx):
-    wasLandscape = self.is_landscape()
+    self.wait_show()
+    oldDegrees = self.get_rotation_degrees()
 
     self.curRotationIdx = rotationIdx
     self.curRotationLayout = self.rotationLayouts[rotationIdx]
@@ -350,111 +632,156 @@ class LCD():
     if not self.is_fullscreen():
       self.fill_mem_blank()
 
-    if wasLandscape != self.is_landscape() and self.buffer != None:
-      # if framebuf is not a square, transpose row/col count (cut off right or bottom)
-      (fbW, fbH) = self.get_framebuf_landscape_size()
-      if fbW != fbH:
-        if fbW % 2 == 1 or fbH % 2 == 1:
-          # skip transpose of odd-width or odd-height framebuffers
-          self.fill(0)
-        else:
-          self.transposeBufferRowColCount()
+    # rotate the framebuf, into the transposed geometry for a quarter turn,
+    #   so it shows the same picture on the LCD as before
+    quarterTurns = ((self.get_rotation_degrees() - oldDegrees) % 360) // 90
+    if quarterTurns != 0 and self.buffer != None:
+      if not self.rotate_framebuf(quarterTurns):
+        self.fill(0)
 
     self.init_framebuf()
 
-  # transpose row count and column count, blanking the cut-off region
-  #   e.g.:
-  #     2x4 to 4x2 (chop off bottom px 5,6,7,8)
-  #     [1, 2, 3, 4, 5, 6, 7, 8] => [1, 2, 0, 0, 3, 4, 0, 0]
-  #        _____    _________
-  #        |1 2|    |1 2    |
-  #        |3 4| => |3 4    |
-  #        |5 6|    ---------
-  #        |7 8|
-  #        -----
-  #
-  #     4x2 to 2x4 (chop off right px 3,4,7,8)
-  #     [1, 2, 3, 4, 5, 6, 7, 8] => [1, 2, 5, 6, 0, 0, 0, 0]
-  #        _________     _____
-  #        |1 2 3 4|     |1 2|
-  #        |5 6 7 8|  => |5 6|
-  #        ---------     |   |
-  #                      |   |
-  #                      -----
-  #  (python => viper yields 26x faster performance, 1624ms => 62ms)
+  # rotate the framebuf px clockwise by quarterTurns*90 degrees, in place,
+  #   from the size of the previous orientation to the size of the current one
+  #   e.g.: 3x2 to 2x3, one quarter turn
+  #      _______     _____
+  #      |1 2 3|     |4 1|
+  #      |4 5 6|  => |5 2|
+  #      -------     |6 3|
+  #                  -----
+  #   returns False if the framebuf cannot be rotated
+  #     (no memory for the visited bitmap, or an odd PAL4 size, which has padded rows)
+  def rotate_framebuf(self, quarterTurns):
+    (fbW, fbH) = self.get_framebuf_rotated_size()
+    if self.bits_per_px() == 4 and (fbW % 2 == 1 or fbH % 2 == 1):
+      return False
+    try:
+      visited = bytearray((fbW*fbH + 7) // 8)
+    except MemoryError:
+      print("WARNING: could not allocate framebuf rotation bitmap")
+      return False
+    self.rotate_framebuf_px(visited, quarterTurns)
+    return True
+
+  # follow each cycle of the px permutation, moving px one nibble at a time
+  #   works for any size, since RGB565, RGB444, PAL8 and PAL4 px are all whole nibbles
+  #   visited is a bitmap of px already moved
   @micropython.viper
-  def transposeBufferRowColCount(self):
+  def rotate_framebuf_px(self, visited, quarterTurns:int):
     buf = ptr8(self.buffer)
-    (bufWObj, bufHObj) = self.get_framebuf_rotated_size()
-    bufW = int(bufWObj)
-    bufH = int(bufHObj)
-    bitsPerPx = int(self.bits_per_px())
+    seen = ptr8(visited)
+    (fbWObj, fbHObj) = self.get_framebuf_rotated_size()
+    newW = int(fbWObj)
+    newH = int(fbHObj)
+    oldW = newH
+    oldH = newW
+    if quarterTurns == 2:
+      oldW = newW
+      oldH = newH
+    nibblesPerPx = int(self.bits_per_px()) >> 2
+
+    pxCount = newW * newH
+    for start in range(0, pxCount):
+      if seen[start >> 3] & (1 << (start & 7)):
+        continue
+
+      #carry is the px being moved, least significant nibble last in the buffer
+      carry = 0
+      for j in range(0, nibblesPerPx):
+        n = (start + 1)*nibblesPerPx - 1 - j
+        if (n & 1) == 0:
+          nib = buf[n >> 1] >> 4
+        else:
+          nib = buf[n >> 1] & 0x0F
+        carry = carry | (nib << (j*4))
+
+      pxIdx = start
+      while True:
+        x = pxIdx % oldW
+        y = pxIdx // oldW
+        if quarterTurns == 1:
+          dest = x*newW + (oldH - 1 - y)
+        elif quarterTurns == 3:
+          dest = (oldW - 1 - x)*newW + y
+        else:
+          dest = (oldH - 1 - y)*newW + (oldW - 1 - x)
+        seen[dest >> 3] = seen[dest >> 3] | (1 << (dest & 7))
+
+        #swap carry with the px at dest
+        nextCarry = 0
+        for j in range(0, nibblesPerPx):
+          n = (dest + 1)*nibblesPerPx - 1 - j
+          nib = (carry >> (j*4)) & 0x0F
+          b = buf[n >> 1]
+          if (n & 1) == 0:
+            nextCarry = nextCarry | ((b >> 4) << (j*4))
+            buf[n >> 1] = (b & 0x0F) | (nib << 4)
+          else:
+            nextCarry = nextCarry | ((b & 0x0F) << (j*4))
+            buf[n >> 1] = (b & 0xF0) | nib
+        carry = nextCarry
 
-    bytesPer2Px = 2*bitsPerPx // 8 # 2px = 4 bytes for RGB565, 3 bytes for RGB444
-
-    diff = bufW - bufH
-    if diff < 0:
-      diff = 0 - diff
-    bufferSize = bufW * bufH * bitsPerPx // 8
-    if bufW >= bufH:
-      #was portrait, now landscape, chop off pixels on the bottom
-      for y in range(0, bufH):
-        y = bufH - y - 1 #reversed(range())
-        for x in range(0, bufW, 2): #even X only, 2px at a time
-          x = bufW - x - 2 #reversed(range())
-          pxIdx1 = y*bufW + x
-          pxIdx2 = pxIdx1 - (pxIdx1 // bufW)*diff
-
-          bIdx1 = pxIdx1*bitsPerPx//8
-          bIdx2 = pxIdx2*bitsPerPx//8
-
-          #copy 2 pixels, x and x+1
-          for i in range(0, bytesPer2Px):
-            if x >= bufH:
-              #old y (aka x) is outside of new height
-              buf[bIdx1 + i] = 0
-            else:
-              buf[bIdx1 + i] = buf[bIdx2 + i]
-    else:
-      #was landscape, now portrait, chop off pixels on the right
-      for y in range(0, bufH):
-        for x in range(0, bufW, 2): #even X only, 2px at a time
-          pxIdx1 = y*bufW + x
-          pxIdx2 = pxIdx1 + (pxIdx1 // bufW)*diff
-
-          bIdx1 = pxIdx1*bitsPerPx//8
-          bIdx2 = pxIdx2*bitsPerPx//8
-
-          #copy 2 pixels, x and x+1
-          for i in range(0, bytesPer2Px):
-            if y >= bufW:
-              #old x (aka y) is outside of new width
-              buf[bIdx1 + i] = 0
-            else:
-              buf[bIdx1 + i] = buf[bIdx2 + i]
+        pxIdx = dest
+        if pxIdx == start:
+          break
 
   def fill(self, color):
+    self.wait_show()
     if not self.is_framebuf_enabled():
       self.tft.fill(color)
     else:
       self.framebuf.fill(color)
+      self.mark_all_dirty()
 
   def pnm(self, filename, x, y, scale=1):
+    self.wait_show()
     try:
-      parser = PNMParser(filename, x, y, scale, self)
+      parser = PNMParser(filename, x, y - self.bandY, scale, self)
       parser.render()
       (w, h) = (parser.getWidth(), parser.getHeight())
       parser.close()
+      self.mark_dirty(x, y, w * scale, h * scale)
       return (w, h)
     except Exception as e:
       print("WARNING: PNM render failed\n" + str(e))
       return (0, 0)
 
+  # (width, height) of the Netpbm image from its header, without rendering it
+  def pnm_size(self, filename):
+    try:
+      parser = PNMParser(filename, 0, 0, 1, self)
+      parser.parseHeader()
+      (w, h) = (parser.getWidth(), parser.getHeight())
+      parser.close()
+      return (w, h)
+    except Exception as e:
+      print("WARNING: PNM header parse failed\n" + str(e))
+      return (0, 0)
+
+  # (width, height) of the PNG image from its IHDR chunk, without rendering it
+  def png_size(self, filename):
+    try:
+      with open(filename, 'rb') as fh:
+        header = fh.read(24)
+      #8-byte signature, 4-byte chunk len, 'IHDR', 4-byte width, 4-byte height
+      if len(header) < 24 or header[12:16] != b'IHDR':
+        raise Exception("ERROR: missing PNG IHDR")
+      w = int.from_bytes(header[16:20], 'big')
+      h = int.from_bytes(header[20:24], 'big')
+      return (w, h)
+    except Exception as e:
+      print("WARNING: PNG header parse failed\n" + str(e))
+      return (0, 0)
+
   def png(self, filename, x, y):
+    self.wait_show()
     if self.is_framebuf_enabled():
       #framebuf does not support PNG, so draw it directly
       # this moves the window, so need to reset it on next show
       (rotFBX, rotFBY) = self.get_framebuf_rotated_offset()
+      #the LCD no longer matches the framebuf under the PNG, until the next show()
+      (w, h) = self.png_size(filename)
+      self.mark_dirty(x, y, w, h)
       x += rotFBX
       y += rotFBY
       self.isWindowSetToFramebuf = False
@@ -473,47 +800,224 @@ class LCD():
       self.set_lcd_RGB444()
 
   def rect(self, x, y, w, h, color, fill=True):
+    self.wait_show()
     if not self.is_framebuf_enabled():
       if fill:
         self.tft.fill_rect(x, y, w, h, color)
       else:
         self.tft.rect(x, y, w, h, color)
     else:
-      self.framebuf.rect(x, y, w, h, color, fill)
+      self.framebuf.rect(x, y - self.bandY, w, h, color, fill)
+      self.mark_dirty(x, y, w, h)
 
   def fill_rect(self, x, y, w, h, color):
     self.rect(x, y, w, h, color, True)
 
+  # draw a 1-bit FrameBuffer (MONO_*) into the framebuf with a single blit
+  #   set bits are drawn in color, unset bits are transparent
+  #   w x h is the size of monoFramebuf
+  #   framebuf only, does nothing if framebuf is disabled
+  def blit_mono(self, monoFramebuf, x, y, w, h, color):
+    self.wait_show()
+    if not self.is_framebuf_enabled():
+      return
+    #any color other than 'color' works as the transparent key
+    key = color ^ 1
+    self.monoPalette.pixel(0, 0, key)
+    self.monoPalette.pixel(1, 0, color)
+    self.framebuf.blit(monoFramebuf, x, y - self.bandY, key, self.monoPalette)
+    self.mark_dirty(x, y, w, h)
+
+  # write one glyph cell directly to the LCD as a single window of RGB565 pixels
+  #   glyphBytes is a column-major 1-bit glyph of fontW x fontH dots
+  #   each dot is size x size px, the rest of the cellW x cellH cell is bgColor
+  #   direct mode only, returns False without drawing if framebuf is enabled
+  #     or if the cell does not fit entirely on the LCD
+  def draw_glyph_block(self, glyphBytes, fontW, fontH, x, y, size, cellW, cellH, color, bgColor):
+    if self.is_framebuf_enabled():
+      return False
+    (lcdW, lcdH) = self.get_lcd_rotated_size()
+    if x < 0 or y < 0 or x + cellW > lcdW or y + cellH > lcdH:
+      return False
+
+    if self.blockBuf == None:
+      self.blockBuf = bytearray(BLOCK_BUF_SIZE_BYTES)
+    rowBytes = cellW * 2
+    maxRows = len(self.blockBuf) // rowBytes
+    if maxRows == 0:
+      return False
+
+    self.set_window_with_rotation_offset(cellW, cellH, x, y, isMemWrite=True)
+    blockBufMV = memoryview(self.blockBuf)
+    row = 0
+    while row < cellH:
+      rowCount = min(maxRows, cellH - row)
+      self.fill_glyph_block_rows(glyphBytes, fontW, fontH, size,
+        cellW, row, rowCount, color, bgColor)
+      self.write_data(blockBufMV[0:rowCount*rowBytes])
+      row += rowCount
+    self.isWindowSetToFramebuf = False
+    return True
+
+  # draw text with an st7789 font module, using the driver's native text()/write()
+  #   w x h is the size of the text in px, as fg color on bgColor
+  #   direct mode only, returns False without drawing if framebuf is enabled
+  #     or if the text does not fit entirely on the LCD
+  def draw_text_native(self, fontModule, isWriteFont, text, x, y, w, h, color, bgColor):
+    if self.is_framebuf_enabled():
+      return False
+    (lcdW, lcdH) = self.get_lcd_rotated_size()
+    if x < 0 or y < 0 or x + w > lcdW or y + h > lcdH:
+      return False
+    self.wait_show()
+    if isWriteFont:
+      self.tft.write(fontModule, text, x, y, color, bgColor)
+    else:
+      self.tft.text(fontModule, text, x, y, color, bgColor)
+    self.isWindowSetToFramebuf = False
+    return True
+
+  # render rows [rowStart, rowStart+rowCount) of a glyph cell into blockBuf
+  #   as big-endian RGB565
+  @micropython.viper
+  def fill_glyph_block_rows(self, glyphBytes, fontW:int, fontH:int, size:int,
+                            cellW:int, rowStart:int, rowCount:int, color:int, bgColor:int):
+    buf = ptr8(self.blockBuf)
+    glyph = ptr8(glyphBytes)
+    colorHi = (color >> 8) & 0xff
+    colorLo = color & 0xff
+    bgHi = (bgColor >> 8) & 0xff
+    bgLo = bgColor & 0xff
+    i = 0
+    for row in range(rowStart, rowStart + rowCount):
+      dotY = row // size
+      for col in range(0, cellW):
+        dotX = col // size
+        lit = 0
+        if dotX < fontW and dotY < fontH:
+          bitIdx = dotX*fontH + dotY
+          lit = (glyph[bitIdx >> 3] >> (bitIdx & 7)) & 1
+        if lit == 1:
+          buf[i] = colorHi
+          buf[i+1] = colorLo
+        else:
+          buf[i] = bgHi
+          buf[i+1] = bgLo
+        i += 2
+
   def pixel(self, x, y, color):
+    self.wait_show()
     if not self.is_framebuf_enabled():
       self.tft.pixel(x, y, color)
     else:
-      self.framebuf.pixel(x, y, color)
+      self.framebuf.pixel(x, y - self.bandY, color)
+      self.mark_dirty(x, y, 1, 1)
 
   def hline(self, x, y, w, c):
+    self.wait_show()
     if not self.is_framebuf_enabled():
       self.tft.hline(x, y, w, c)
     else:
-      self.framebuf.hline(x, y, w, c)
+      self.framebuf.hline(x, y - self.bandY, w, c)
+      self.mark_dirty(x, y, w, 1)
 
   def vline(self, x, y, w, c):
+    self.wait_show()
     if not self.is_framebuf_enabled():
       self.tft.vline(x, y, w, c)
     else:
-      self.framebuf.vline(x, y, w, c)
+      self.framebuf.vline(x, y - self.bandY, w, c)
+      self.mark_dirty(x, y, 1, w)
 
   def line(self, x1, y1, x2, y2, c):
+    self.wait_show()
     if not self.is_framebuf_enabled():
       self.tft.line(x1, y1, x2, y2, c)
     else:
-      self.framebuf.line(x1, y1, x2, y2, c)
+      self.framebuf.line(x1, y1 - self.bandY, x2, y2 - self.bandY, c)
+      self.mark_dirty(min(x1, x2), min(y1, y2), abs(x2 - x1) + 1, abs(y2 - y1) + 1)
+
+  # line segments through packed X1,Y1,X2,Y2 coordinates, e.g.: an array('h'), offset by x,y
+  def lines(self, coords, x, y, c):
+    self.wait_show()
+    self.draw_segments(coords, x, y, c, 4)
+
+  # one open path through packed X,Y coordinates, e.g.: an array('h'), offset by x,y
+  #   direct mode draws the whole path with one st7789 polygon(), which is an open path
+  def polyline(self, coords, x, y, c):
+    self.wait_show()
+    if not self.is_framebuf_enabled():
+      points = [(coords[i], coords[i+1]) for i in range(0, len(coords) - 1, 2)]
+      if len(points) >= 2:
+        self.tft.polygon(points, x, y, c)
+    else:
+      self.draw_segments(coords, x, y, c, 2)
+
+  # draw line segments X1,Y1,X2,Y2 read from array('h') coords every 'step' values
+  #   step=4 for separate segments, step=2 for a path
+  def draw_segments(self, coords, x, y, c, step):
+    if self.is_framebuf_enabled():
+      self.draw_segments_viper(self.framebuf.line, coords, len(coords), x, y, self.bandY, c, step, 1)
+    else:
+      self.draw_segments_viper(self.tft.line, coords, len(coords), x, y, 0, c, step, 0)
+
+  # call lineFn once per segment, and mark the bounding box of all segments dirty once
+  @micropython.viper
+  def draw_segments_viper(self, lineFn, coords, coordCount:int, x:int, y:int, bandY:int,
+                          c:int, step:int, isMarkDirty:int):
+    vals = ptr16(coords)
+    minX = 0x7fffffff
+    minY = 0x7fffffff
+    maxX = -0x7fffffff
+    maxY = -0x7fffffff
+    i = 0
+    while i + 3 < coordCount:
+      #ptr16 is unsigned, sign-extend each int16
+      x1 = int(vals[i])
+      if x1 >= 0x8000:
+        x1 -= 0x10000
+      y1 = int(vals[i+1])
+      if y1 >= 0x8000:
+        y1 -= 0x10000
+      x2 = int(vals[i+2])
+      if x2 >= 0x8000:
+        x2 -= 0x10000
+      y2 = int(vals[i+3])
+      if y2 >= 0x8000:
+        y2 -= 0x10000
+      x1 += x
+      y1 += y
+      x2 += x
+      y2 += y
+      lineFn(x1, y1 - bandY, x2, y2 - bandY, c)
+      if x1 < minX:
+        minX = x1
+      if x2 < minX:
+        minX = x2
+      if y1 < minY:
+        minY = y1
+      if y2 < minY:
+        minY = y2
+      if x1 > maxX:
+        maxX = x1
+      if x2 > maxX:
+        maxX = x2
+      if y1 > maxY:
+        maxY = y1
+      if y2 > maxY:
+        maxY = y2
+      i += step
+    if isMarkDirty != 0 and maxX >= minX:
+      self.mark_dirty(minX, minY, maxX - minX + 1, maxY - minY + 1)
 
   def circle(self, centerX, centerY, radius, color, fill=True, quadrantMask=0b1111):
     self.ellipse(centerX, centerY, radius, radius, color, fill, quadrantMask)
 
   def ellipse(self, centerX, centerY, radiusX, radiusY, color, fill=True, quadrantMask=0b1111):
+    self.wait_show()
     if self.is_framebuf_enabled():
-      self.framebuf.ellipse(centerX, centerY, radiusX, radiusY, color, fill, quadrantMask)
+      self.framebuf.ellipse(centerX, centerY - self.bandY, radiusX, radiusY, color, fill, quadrantMask)
+      self.mark_dirty(centerX - radiusX, centerY - radiusY, radiusX*2 + 1, radiusY*2 + 1)
       return
 
     #NOTE:
@@ -611,41 +1115,92 @@ class LCD():
   # coords is an even-sized flat array of points describing closed, convex polygon
   #       e.g.: array('h', [x0, y0, x1, y1...])
   # NOTE:
-  #   fill=True is implemented only WITH framebuf
   #   rotateRad/rotateCX/rotateCY is implemented only WITHOUT framebuf
   def poly(self, coords, x, y, color, fill=False, rotateRad=0, rotateCX=0, rotateCY=0):
+    self.wait_show()
     if not self.is_framebuf_enabled():
-      if fill:
-        print("WARNING: 'fill' is not implemented in poly() for st7789_mpy")
       polygonXYPairs = []
-      for i in range(0, len(coords), 2):
+      for i in range(0, len(coords) - 1, 2):
         polygonXYPairs.append((coords[i], coords[i+1]))
 
-      self.tft.polygon(polygonXYPairs, x, y, color, rotateRad, rotateCX, rotateCY)
+      if fill:
+        self.tft.fill_polygon(polygonXYPairs, x, y, color, rotateRad, rotateCX, rotateCY)
+      else:
+        #st7789 polygon() is an open path, framebuf poly() is closed
+        if len(polygonXYPairs) > 2 and polygonXYPairs[0] != polygonXYPairs[-1]:
+          polygonXYPairs.append(polygonXYPairs[0])
+        self.tft.polygon(polygonXYPairs, x, y, color, rotateRad, rotateCX, rotateCY)
     else:
       if rotateRad != 0:
         print("WARNING: 'rotateRad' is not implemented in poly() for framebuf")
-      self.framebuf.poly(x, y, coords, color, fill)
+      self.framebuf.poly(x, y - self.bandY, coords, color, fill)
+      if len(coords) >= 2:
+        xs = [coords[i] for i in range(0, len(coords) - 1, 2)]
+        ys = [coords[i] for i in range(1, len(coords), 2)]
+        self.mark_dirty(x + min(xs), y + min(ys), max(xs) - min(xs) + 1, max(ys) - min(ys) + 1)
 
   def fill_show(self, color):
     self.fill(color)
     self.show()
 
   def write_cmd(self, cmd):
+    self.wait_show()
+    self.cmdBuf[0] = cmd
     self.cs(1)
     self.dc(0)
     self.cs(0)
-    self.spi.write(bytearray([cmd]))
+    self.spi.write(self.cmdBuf)
     self.cs(1)
+    self.spiTransactions += 1
+    self.spiBytes += 1
 
   def write_data(self, data):
+    self.wait_show()
     self.cs(1)
     self.dc(1)
     self.cs(0)
     self.spi.write(data)
     self.cs(1)
+    self.spiTransactions += 1
+    self.spiBytes += len(data)
+
+  # start writing data to the LCD with DMA, and return while it is still being written
+  #   data must not change until wait_show(), which every draw and SPI write calls first
+  #   same as write_data() if DMA is not available
+  def write_data_async(self, data):
+    if self.dma == None:
+      self.write_data(data)
+      return
+    self.wait_show()
+    self.cs(1)
+    self.dc(1)
+    self.cs(0)
+    self.dmaData = data
+    self.dma.config(read=data, write=self.spiBaseAddr + SPI_SSPDR, count=len(data),
+      ctrl=self.dmaCtrl, trigger=True)
+    self.isDMABusy = True
+    self.spiTransactions += 1
+    self.spiBytes += len(data)
+
+  # wait for the write from write_data_async() to finish, if any, and end the SPI transaction
+  def wait_show(self):
+    if not self.isDMABusy:
+      return
+    while self.dma.active():
+      pass
+    #the DMA is done when the last byte is in the TX FIFO, not when it is sent
+    while machine.mem32[self.spiBaseAddr + SPI_SSPSR] & SPI_SSPSR_BSY:
+      pass
+    #SPI reads a byte for every byte written, and nothing read the RX FIFO
+    while machine.mem32[self.spiBaseAddr + SPI_SSPSR] & SPI_SSPSR_RNE:
+      rxByte = machine.mem32[self.spiBaseAddr + SPI_SSPDR]
+    machine.mem32[self.spiBaseAddr + SPI_SSPICR] = SPI_SSPICR_RORIC
+    self.cs(1)
+    self.isDMABusy = False
+    self.dmaData = None
 
   def get_touch_coord(self, touchData):
+    self.wait_show()
     if self.tpcs == None or touchData == None:
       return (None, None)
     self.spi.init(baudrate=5_000_000)
@@ -689,51 +1244,328 @@ class LCD():
     memWidth = 320
     memHeight = 320
 
-    self.set_window(0, memWidth, 0, memHeight)
-    self.write_cmd(0x2C)
+    self.set_window(0, memWidth, 0, memHeight, isMemWrite=True)
 
-    buf = bytearray(memWidth*memHeight*self.bits_per_px()//8 // numberOfChunks)
+    buf = bytearray(memWidth*memHeight*self.get_lcd_bits_per_px()//8 // numberOfChunks)
     for i in range(0, numberOfChunks):
       self.write_data(buf)
     buf = None
 
     if self.is_framebuf_enabled():
       self.set_window_to_rotated_framebuf()
+      self.mark_all_dirty()
 
   def set_window_to_rotated_framebuf(self):
     (rotFBW, rotFBH) = self.get_framebuf_rotated_size()
     (rotFBX, rotFBY) = self.get_framebuf_rotated_offset()
     self.set_window_with_rotation_offset(rotFBW, rotFBH, rotFBX, rotFBY)
 
-  def set_window_with_rotation_offset(self, w, h, x, y):
+  def set_window_with_rotation_offset(self, w, h, x, y, isMemWrite=False):
     xStart = self.curRotationLayout['X'] + x
     xEnd = w + self.curRotationLayout['X'] + x - 1
     yStart = self.curRotationLayout['Y'] + y
     yEnd = h + self.curRotationLayout['Y'] + y - 1
 
-    self.set_window(xStart, xEnd, yStart, yEnd)
+    self.set_window(xStart, xEnd, yStart, yEnd, isMemWrite)
 
-  def set_window(self, xStart, xEnd, yStart, yEnd):
-    self.write_cmd(0x2A)
-    self.write_data(bytearray([xStart >> 8, xStart & 0xff, xEnd >> 8, xEnd & 0xff]))
-
-    self.write_cmd(0x2B)
-    self.write_data(bytearray([yStart >> 8, yStart & 0xff, yEnd >> 8, yEnd & 0xff]))
+  # CASET and RASET, and then RAMWR if isMemWrite, in a single SPI transaction
+  #   DC is low for each command byte and high for its params, with CS held low throughout
+  #   after RAMWR, px sent with write_data() fill the window
+  def set_window(self, xStart, xEnd, yStart, yEnd, isMemWrite=False):
+    self.wait_show()
+    self.cs(1)
+    self.cs(0)
+    self.write_window_cmd(0x2A, xStart, xEnd)
+    self.write_window_cmd(0x2B, yStart, yEnd)
+    if isMemWrite:
+      self.cmdBuf[0] = 0x2C
+      self.dc(0)
+      self.spi.write(self.cmdBuf)
+    self.cs(1)
+    self.spiTransactions += 1
+    self.spiBytes += 11 if isMemWrite else 10
 
+  #CASET or RASET, with CS already low
+  def write_window_cmd(self, cmd, start, end):
+    self.cmdBuf[0] = cmd
+    self.dc(0)
+    self.spi.write(self.cmdBuf)
+    buf = self.windowBuf
+    buf[0] = start >> 8
+    buf[1] = start & 0xff
+    buf[2] = end >> 8
+    buf[3] = end & 0xff
+    self.dc(1)
+    self.spi.write(buf)
+
+  # write the parts of the framebuf changed since the last show() to the LCD
+  #   each band of rows with dirty rects is written as one window,
+  #     as wide as all the dirty rects in it
+  #   the entire framebuf is written at once if that is less data,
+  #     or if mark_all_dirty() was called, e.g.: after fill() or a rotation
+  #   full rows are written with DMA, if available, so show() can return before they are sent
   def show(self):
-    if self.is_framebuf_enabled():
+    if not self.is_framebuf_enabled():
+      return
+    if self.bandRows > 0:
+      self.show_band()
+      return
+    bands = self.get_dirty_bands()
+    (self.dirtyRects, self.isAllDirty) = ([], False)
+    if bands == None and self.is_palette_enabled():
+      (fbW, fbH) = self.get_framebuf_rotated_size()
+      self.write_framebuf_region(0, 0, fbW, fbH)
+    elif bands == None:
       self.ensure_framebuf_window()
       self.write_cmd(0x2C)
-      self.write_data(self.buffer)
+      self.write_data_async(self.buffer)
+    else:
+      for (x0, y0, x1, y1) in bands:
+        self.write_framebuf_region(x0, y0, x1, y1)
+
+  # mark the WxH+X+Y part of the framebuf as changed, to be written by the next show()
+  #   rects that overlap or touch are merged, and past DIRTY_RECTS_MAX, all are merged
+  def mark_dirty(self, x, y, w, h):
+    if self.isAllDirty:
+      return
+    (fbW, fbH) = self.get_framebuf_rotated_size()
+    (x0, y0) = (max(0, x), max(0, y))
+    (x1, y1) = (min(fbW, x + w), min(fbH, y + h))
+    if x1 <= x0 or y1 <= y0:
+      return
+
+    for rect in self.dirtyRects:
+      if x0 <= rect[2] and rect[0] <= x1 and y0 <= rect[3] and rect[1] <= y1:
+        rect[0] = min(rect[0], x0)
+        rect[1] = min(rect[1], y0)
+        rect[2] = max(rect[2], x1)
+        rect[3] = max(rect[3], y1)
+        return
+
+    self.dirtyRects.append([x0, y0, x1, y1])
+    if len(self.dirtyRects) > DIRTY_RECTS_MAX:
+      rects = self.dirtyRects
+      self.dirtyRects = [[
+        min([rect[0] for rect in rects]),
+        min([rect[1] for rect in rects]),
+        max([rect[2] for rect in rects]),
+        max([rect[3] for rect in rects]),
+      ]]
+
+  # write the entire framebuf on the next show()
+  #   e.g.: after the LCD or the framebuf changed in a way that is not tracked
+  def mark_all_dirty(self):
+    self.dirtyRects = []
+    self.isAllDirty = True
+
+  # (x0, y0, x1, y1) of each band of rows that overlap the same dirty rects,
+  #   as wide as those dirty rects
+  #   or None if the entire framebuf should be written instead
+  def get_dirty_bands(self):
+    if self.isAllDirty:
+      return None
+    (fbW, fbH) = self.get_framebuf_rotated_size()
+    bitsPerPx = self.bits_per_px()
+    if bitsPerPx == 12 and fbW % 2 == 1 and len(self.dirtyRects) > 0:
+      #rows do not start on a byte boundary
+      return None
+
+    bands = []
+    for (x0, y0, x1, y1) in sorted(self.dirtyRects, key=lambda rect: rect[1]):
+      if bitsPerPx == 12:
+        #RGB444 packs 2px into 3 bytes
+        x0 -= x0 % 2
+        x1 += x1 % 2
+      if len(bands) > 0 and y0 < bands[-1][3]:
+        band = bands[-1]
+        band[0] = min(band[0], x0)
+        band[2] = max(band[2], x1)
+        band[3] = max(band[3], y1)
+      else:
+        bands.append([x0, y0, x1, y1])
+
+    #a window per band, and partial rows copied into blockBuf, are not free
+    dirtyPx = 0
+    for (x0, y0, x1, y1) in bands:
+      dirtyPx += (x1 - x0) * (y1 - y0)
+    if dirtyPx * 2 > fbW * fbH:
+      return None
+    return bands
+
+  # move the WxH+X+Y part of the framebuf left by dx px, leaving the right dx columns as-is
+  #   the region must be entirely inside the framebuf
+  #   RGB444 and PAL4 pixels are not whole bytes, so odd positions are copied one nibble at a time
+  def scroll_framebuf_region_left(self, x, y, w, h, dx):
+    self.wait_show()
+    self.scroll_framebuf_rows_left(x, y, w, h, dx)
+    self.mark_dirty(x, y, w, h)
+
+  @micropython.viper
+  def scroll_framebuf_rows_left(self, x:int, y:int, w:int, h:int, dx:int):
+    buf = ptr8(self.buffer)
+    (fbWObj, fbHObj) = self.get_framebuf_rotated_size()
+    fbW = int(fbWObj)
+    bitsPerPx = int(self.bits_per_px())
+    if dx <= 0 or dx >= w:
+      return
+
+    if bitsPerPx == 16 or bitsPerPx == 8:
+      bytesPerPx = bitsPerPx >> 3
+      count = (w - dx)*bytesPerPx
+      for row in range(y, y+h):
+        dst = (row*fbW + x)*bytesPerPx
+        src = dst + dx*bytesPerPx
+        for i in range(0, count):
+          buf[dst+i] = buf[src+i]
+      return
+
+    #RGB444 px are 3 nibbles, PAL4 px are 1 nibble in rows that start on a byte
+    nibblesPerPx = bitsPerPx >> 2
+    if bitsPerPx == 4:
+      fbW = ((fbW + 1) >> 1) << 1
+    count = (w - dx)*nibblesPerPx
+    for row in range(y, y+h):
+      dstN = (row*fbW + x)*nibblesPerPx
+      srcN = dstN + dx*nibblesPerPx
+      i = 0
+      if (dstN & 1) == 0 and (srcN & 1) == 0:
+        #both start on a byte, copy whole bytes
+        dst = dstN >> 1
+        src = srcN >> 1
+        for b in range(0, count >> 1):
+          buf[dst+b] = buf[src+b]
+        i = (count >> 1) << 1
+      while i < count:
+        n = srcN + i
+        if (n & 1) == 0:
+          nibble = buf[n >> 1] >> 4
+        else:
+          nibble = buf[n >> 1] & 0x0F
+        n = dstN + i
+        if (n & 1) == 0:
+          buf[n >> 1] = (buf[n >> 1] & 0x0F) | (nibble << 4)
+        else:
+          buf[n >> 1] = (buf[n >> 1] & 0xF0) | nibble
+        i += 1
+
+  # write only the WxH+X+Y part of the framebuf to the LCD, clipped to the framebuf
+  #   rows are copied into blockBuf and written in as few SPI writes as fit
+  #   RGB444 packs 2px into 3 bytes, so the region is widened to an even X and W
+  def show_region(self, x, y, w, h):
+    if not self.is_framebuf_enabled():
+      return
+    (fbW, fbH) = self.get_framebuf_rotated_size()
+    bitsPerPx = self.bits_per_px()
+    if bitsPerPx == 12 and fbW % 2 == 1:
+      #rows do not start on a byte boundary
+      self.mark_all_dirty()
+      self.show()
+      return
+
+    (x0, y0) = (max(0, x), max(0, y))
+    (x1, y1) = (min(fbW, x + w), min(fbH, y + h))
+    if bitsPerPx == 12:
+      x0 -= x0 % 2
+      x1 += x1 % 2
+    if x1 <= x0 or y1 <= y0:
+      return
+    self.write_framebuf_region(x0, y0, x1, y1)
+
+  # write columns [x0, x1) of rows [y0, y1) of the framebuf to the LCD
+  #   the region must be inside the framebuf, with an even x0 and x1 for RGB444
+  def write_framebuf_region(self, x0, y0, x1, y1):
+    (fbW, fbH) = self.get_framebuf_rotated_size()
+    bitsPerPx = self.bits_per_px()
+    (rotFBX, rotFBY) = self.get_framebuf_rotated_offset()
+    self.set_window_with_rotation_offset(x1 - x0, y1 - y0, rotFBX + x0, rotFBY + y0, isMemWrite=True)
+    self.isWindowSetToFramebuf = False
+
+    if self.blockBuf == None:
+      self.blockBuf = bytearray(BLOCK_BUF_SIZE_BYTES)
+    blockBufMV = memoryview(self.blockBuf)
+
+    if self.is_palette_enabled():
+      #as many rows as fit in blockBuf, expanded to RGB565
+      rowBytes = (x1 - x0) * 2
+      maxRows = max(1, len(self.blockBuf) // rowBytes)
+      row = y0
+      while row < y1:
+        rowCount = min(maxRows, y1 - row)
+        self.expand_palette_rows(x0, row, x1 - x0, rowCount)
+        self.write_data(blockBufMV[0 : rowCount*rowBytes])
+        row += rowCount
+      return
+
+    bufMV = memoryview(self.buffer)
+    rowBytes = (x1 - x0) * bitsPerPx // 8
+    if x0 == 0 and x1 == fbW:
+      #full rows are contiguous
+      self.write_data_async(bufMV[y0*rowBytes : y1*rowBytes])
+      return
+
+    maxRows = max(1, len(self.blockBuf) // rowBytes)
+    fbRowBytes = fbW * bitsPerPx // 8
+    rowOffset = x0 * bitsPerPx // 8
+    row = y0
+    while row < y1:
+      if rowBytes > len(self.blockBuf):
+        start = row*fbRowBytes + rowOffset
+        self.write_data(bufMV[start : start + rowBytes])
+        row += 1
+        continue
+      rowCount = min(maxRows, y1 - row)
+      for i in range(0, rowCount):
+        start = (row + i)*fbRowBytes + rowOffset
+        blockBufMV[i*rowBytes : (i+1)*rowBytes] = bufMV[start : start + rowBytes]
+      self.write_data(blockBufMV[0 : rowCount*rowBytes])
+      row += rowCount
+
+  # copy w palette indexes from each of rowCount framebuf rows into blockBuf, as big-endian RGB565
+  #   PAL4 rows start on a byte, with the first px in the high nibble
+  @micropython.viper
+  def expand_palette_rows(self, x:int, y:int, w:int, rowCount:int):
+    src = ptr8(self.buffer)
+    dst = ptr8(self.blockBuf)
+    lut = ptr8(self.paletteLUT)
+    (fbWObj, fbHObj) = self.get_framebuf_rotated_size()
+    stride = int(fbWObj)
+    bitsPerPx = int(self.bits_per_px())
+
+    i = 0
+    if bitsPerPx == 4:
+      stride = ((stride + 1) >> 1) << 1
+      for row in range(y, y+rowCount):
+        start = row*stride + x
+        for px in range(start, start + w):
+          idx = src[px >> 1]
+          if (px & 1) == 0:
+            idx = idx >> 4
+          else:
+            idx = idx & 0x0F
+          dst[i] = lut[idx*2]
+          dst[i+1] = lut[idx*2 + 1]
+          i += 2
+    else:
+      for row in range(y, y+rowCount):
+        start = row*stride + x
+        for px in range(start, start + w):
+          idx = src[px]
+          dst[i] = lut[idx*2]
+          dst[i+1] = lut[idx*2 + 1]
+          i += 2
 
 
 class FramebufConf():
-  def __init__(self, enabled=False, fbW=0, fbH=0, fbX=0, fbY=0):
+  #bandH is the rows per band, to draw markup in bands when the framebuf is not enabled
+  #paletteBits is 4 or 8 to store palette indexes in the framebuf instead of colors, or 0
+  def __init__(self, enabled=False, fbW=0, fbH=0, fbX=0, fbY=0, bandH=0, paletteBits=0):
     self.enabled = enabled
     self.fbW = fbW
     self.fbH = fbH
     self.fbX = fbX
     self.fbY = fbY
+    self.bandH = bandH
+    self.paletteBits = paletteBits
 
   @classmethod
   def getNamedConfs(self, width, height):
@@ -755,10 +1587,21 @@ class FramebufConf():
 
     fbConf = None
     fbConfStr = fbConfStr.lower()
+
+    paletteBits = 0
+    if fbConfStr.endswith(":pal4"):
+      (fbConfStr, paletteBits) = (fbConfStr[:-5], 4)
+    elif fbConfStr.endswith(":pal8"):
+      (fbConfStr, paletteBits) = (fbConfStr[:-5], 8)
+
     if fbConfStr == "off":
       fbConf = None
+    elif fbConfStr == "band":
+      fbConf = FramebufConf(enabled=False, bandH=BAND_ROWS_DEFAULT)
+    elif fbConfStr.startswith("band") and fbConfStr[4:].isdigit() and int(fbConfStr[4:]) > 0:
+      fbConf = FramebufConf(enabled=False, bandH=int(fbConfStr[4:]))
     elif fbConfStr in namedConfs:
-      return namedConfs[fbConfStr]
+      fbConf = namedConfs[fbConfStr]
     else:
       nums = []
       curNum = ""
@@ -782,6 +1625,8 @@ class FramebufConf():
 
     if fbConf == None:
       fbConf = FramebufConf(enabled=False)
+    elif fbConf.enabled:
+      fbConf.paletteBits = paletteBits
 
     return fbConf
 
@@ -789,12 +1634,18 @@ class FramebufConf():
     return self.format()
 
   def format(self):
-    if not self.enabled:
+    if not self.enabled and self.bandH > 0:
+      return 'band%d' % self.bandH
+    elif not self.enabled:
       return "off"
-    elif self.fbX == 0 and self.fbY == 0:
-      return '%dx%d' % (self.fbW, self.fbH)
+
+    if self.fbX == 0 and self.fbY == 0:
+      fmt = '%dx%d' % (self.fbW, self.fbH)
     else:
-      return '%dx%d+%d+%d' % (self.fbW, self.fbH, self.fbX, self.fbY)
+      fmt = '%dx%d+%d+%d' % (self.fbW, self.fbH, self.fbX, self.fbY)
+    if self.paletteBits > 0:
+      fmt += ':pal%d' % self.paletteBits
+    return fmt
 
 class PNMParser:
   def __init__(self, filename, offsetX, offsetY, scale, lcd):
@@ -0,0 +1,243 @@
+#LCD Cost - counting stand-in for LCD, to estimate render time without drawing anything
+#Copyright 2026 Elliot Wolk
+#License: GPLv2
+
+import math
+
+from lcd import BLOCK_BUF_SIZE_BYTES
+
+#UNCALIBRATED guesses of per-op costs for an RP2040 at 125MHz, not measured on any board
+#  so the 'uncalibrated estimate' of the 'cost' command is only a rough guide, not a budget
+#  compare it with 'actual' from the 'cost' command before relying on any of these
+#LCD requests 100MHz SPI, but the RP2040 can only divide clk_peri=125MHz down to 62.5MHz
+COST_SPI_HZ = 62_500_000
+#CS/DC toggles and the python call around one spi.write()
+COST_US_PER_SPI_TRANSACTION = 15
+#python call overhead of one LCD draw primitive
+COST_US_PER_PRIMITIVE = 40
+#framebuf fill/rect/hline in C, per px
+COST_US_PER_FRAMEBUF_PX = 0.02
+#viper fill of a glyph block buffer, per px
+COST_US_PER_GLYPH_BLOCK_PX = 0.15
+#PNM decode in viper, per image px, before scaling
+COST_US_PER_PNM_PX = 3
+#PNG decode in the st7789 driver, per image px
+COST_US_PER_PNG_PX = 0.5
+#open a file on flash and read its header
+COST_US_PER_FILE_OPEN = 2000
+
+#CASET cmd, CASET data, RASET cmd, RASET data, RAMWR cmd, before the pixel data, in the st7789 driver
+SPI_TRANSACTIONS_PER_WINDOW = 5
+#LCD.set_window() sends CASET, RASET and RAMWR in one transaction
+SPI_TRANSACTIONS_PER_LCD_WINDOW = 1
+
+# same interface as LCD for everything LcdFont draws with, but only counts the work
+#   geometry, colors and framebuf state are read from the real LCD
+#   images are measured by their headers, and glyph blocks/native text are bounds-checked,
+#     exactly as LCD does, so LcdFont takes the same drawing path
+#   framebuf blits are counted as primitives only, since the blit size is not known
+class CostLCD:
+  def __init__(self, lcd):
+    self.lcd = lcd
+    self.reset()
+
+  def reset(self):
+    self.primitives = 0
+    self.spiTransactions = 0
+    self.lcdPx = 0
+    self.framebufPx = 0
+    self.showBytes = 0
+    self.filesOpened = 0
+    self.decodeUs = 0
+
+  def __getattr__(self, name):
+    return getattr(self.lcd, name)
+
+  #ops compiled with a frozen palette must not be cached for the real LCD
+  @property
+  def paletteGen(self):
+    if self.lcd.is_palette_enabled():
+      return None
+    return self.lcd.paletteGen
+
+  #a dry run must not start a new palette on the real LCD
+  def maybe_reset_palette(self):
+    pass
+
+  # colors as the real LCD resolves them, without adding colors to its palette
+  #   a color that is not in the palette yet gets the index of the nearest one
+  def get_color(self, r, g, b):
+    self.lcd.isPaletteFrozen = True
+    try:
+      return self.lcd.get_color(r, g, b)
+    finally:
+      self.lcd.isPaletteFrozen = False
+
+  def get_color_hex_rgb(self, hex_rgb):
+    self.lcd.isPaletteFrozen = True
+    try:
+      return self.lcd.get_color_hex_rgb(hex_rgb)
+    finally:
+      self.lcd.isPaletteFrozen = False
+
+  # estimated render time in microseconds, from all counts so far, with the uncalibrated costs
+  def get_uncalibrated_estimate_us(self):
+    spiBitsUs = self.lcdPx * self.lcd.get_lcd_bits_per_px() * 1000000 / COST_SPI_HZ
+    return int(0
+      + self.primitives * COST_US_PER_PRIMITIVE
+      + self.spiTransactions * COST_US_PER_SPI_TRANSACTION
+      + spiBitsUs
+      + self.framebufPx * COST_US_PER_FRAMEBUF_PX
+      + self.filesOpened * COST_US_PER_FILE_OPEN
+      + self.decodeUs
+    )
+
+  def add_windows(self, windowCount, dataWriteCount, px, transactionsPerWindow=SPI_TRANSACTIONS_PER_WINDOW):
+    self.spiTransactions += windowCount * transactionsPerWindow + dataWriteCount
+    self.lcdPx += px
+
+  # one primitive of px pixels, in the framebuf or as windowCount LCD windows
+  def add_draw(self, px, windowCount=1):
+    self.primitives += 1
+    if self.lcd.is_framebuf_enabled():
+      self.framebufPx += px
+    else:
+      self.add_windows(windowCount, windowCount, px)
+
+  def fill(self, color):
+    if self.lcd.is_band_active():
+      (w, h) = self.lcd.get_band_rotated_size()
+    elif self.lcd.is_framebuf_enabled():
+      (w, h) = self.lcd.get_framebuf_rotated_size()
+    else:
+      (w, h) = self.lcd.get_lcd_rotated_size()
+    self.add_draw(w * h)
+
+  def rect(self, x, y, w, h, color, fill=True):
+    if fill:
+      self.add_draw(w * h)
+    else:
+      self.add_draw(2*w + 2*h, windowCount=4)
+
+  def fill_rect(self, x, y, w, h, color):
+    self.rect(x, y, w, h, color, True)
+
+  def hline(self, x, y, w, c):
+    self.add_draw(w)
+
+  def vline(self, x, y, w, c):
+    self.add_draw(w)
+
+  def pixel(self, x, y, color):
+    self.add_draw(1)
+
+  #direct mode draws a diagonal line one px at a time
+  def line(self, x1, y1, x2, y2, c):
+    px = max(abs(x2 - x1), abs(y2 - y1)) + 1
+    self.add_draw(px, windowCount=px)
+
+  def lines(self, coords, x, y, c):
+    for i in range(0, len(coords) - 3, 4):
+      self.line(coords[i], coords[i+1], coords[i+2], coords[i+3], c)
+
+  def polyline(self, coords, x, y, c):
+    for i in range(2, len(coords) - 1, 2):
+      self.line(coords[i-2], coords[i-1], coords[i], coords[i+1], c)
+
+  #a filled polygon is counted as half of its bounding box, one row at a time
+  def poly(self, coords, x, y, color, fill=False, rotateRad=0, rotateCX=0, rotateCY=0):
+    if len(coords) < 4:
+      return
+    if fill:
+      xs = [coords[i] for i in range(0, len(coords) - 1, 2)]
+      ys = [coords[i] for i in range(1, len(coords), 2)]
+      (w, h) = (max(xs) - min(xs) + 1, max(ys) - min(ys) + 1)
+      self.add_draw(w * h // 2, windowCount=h)
+    else:
+      self.polyline(coords, x, y, color)
+      self.line(coords[-2], coords[-1], coords[0], coords[1], color)
+
+  #direct mode draws each step of the ellipse as 4 rects or 4 pixels
+  def ellipse(self, centerX, centerY, radiusX, radiusY, color, fill=True, quadrantMask=0b1111):
+    steps = radiusX + radiusY + 2
+    if fill:
+      px = int(math.pi * (radiusX + 1) * (radiusY + 1))
+    else:
+      px = 4 * steps
+    self.add_draw(px, windowCount=4*steps)
+
+  def blit_mono(self, monoFramebuf, x, y, w, h, color):
+    if self.lcd.is_framebuf_enabled():
+      self.primitives += 1
+
+  def draw_glyph_block(self, glyphBytes, fontW, fontH, x, y, size, cellW, cellH, color, bgColor):
+    if self.lcd.is_framebuf_enabled():
+      return False
+    (lcdW, lcdH) = self.lcd.get_lcd_rotated_size()
+    if x < 0 or y < 0 or x + cellW > lcdW or y + cellH > lcdH:
+      return False
+    maxRows = BLOCK_BUF_SIZE_BYTES // (cellW * 2)
+    if maxRows == 0:
+      return False
+
+    self.primitives += 1
+    self.add_windows(1, (cellH + maxRows - 1) // maxRows, cellW * cellH,
+      transactionsPerWindow=SPI_TRANSACTIONS_PER_LCD_WINDOW)
+    self.decodeUs += cellW * cellH * COST_US_PER_GLYPH_BLOCK_PX
+    return True
+
+  #the st7789 driver writes one window per char
+  def draw_text_native(self, fontModule, isWriteFont, text, x, y, w, h, color, bgColor):
+    if self.lcd.is_framebuf_enabled():
+      return False
+    (lcdW, lcdH) = self.lcd.get_lcd_rotated_size()
+    if x < 0 or y < 0 or x + w > lcdW or y + h > lcdH:
+      return False
+    self.primitives += 1
+    self.add_windows(len(text), len(text), w * h)
+    return True
+
+  #PNGs are always drawn directly to the LCD, one window per row
+  def png(self, filename, x, y):
+    (w, h) = self.lcd.png_size(filename)
+    self.filesOpened += 1
+    self.primitives += 1
+    self.add_windows(h, h, w * h)
+    self.decodeUs += w * h * COST_US_PER_PNG_PX
+
+  #PNMs are drawn one rect per image px
+  def pnm(self, filename, x, y, scale=1):
+    (w, h) = self.lcd.pnm_size(filename)
+    self.filesOpened += 1
+    self.primitives += 1
+    if self.lcd.is_framebuf_enabled():
+      self.framebufPx += w * h * scale * scale
+    else:
+      self.add_windows(w * h, w * h, w * h * scale * scale)
+    self.decodeUs += w * h * COST_US_PER_PNM_PX
+    return (w, h)
+
+  def png_size(self, filename):
+    self.filesOpened += 1
+    return self.lcd.png_size(filename)
+
+  def pnm_size(self, filename):
+    self.filesOpened += 1
+    return self.lcd.pnm_size(filename)
+
+  def fill_mem_blank(self):
+    self.primitives += 1
+    self.add_windows(1, 256, 320 * 320, transactionsPerWindow=SPI_TRANSACTIONS_PER_LCD_WINDOW)
+
+  #the entire framebuf, or the band being drawn, is counted, even if only part of it is dirty
+  def show(self):
+    if self.lcd.is_band_active():
+      (w, h) = self.lcd.get_band_rotated_size()
+      self.primitives += 1
+      self.showBytes += w * h * 2
+      self.add_windows(1, 1, w * h, transactionsPerWindow=SPI_TRANSACTIONS_PER_LCD_WINDOW)
+    elif self.lcd.is_framebuf_enabled():
+      (w, h) = self.lcd.get_framebuf_rotated_size()
+      self.primitives += 1
+      self.showBytes += w * h * self.lcd.get_lcd_bits_per_px() // 8
+      self.add_windows(1, 1, w * h, transactionsPerWindow=SPI_TRANSACTIONS_PER_LCD_WINDOW)
@@ -3,8 +3,406 @@
 #Copyright 2023 Elliot Wolk
 #License: GPLv2
 
+import framebuf
 import time
+import ubinascii
 import ustruct
+from array import array
+from collections import OrderedDict
+
+from lruCache import LRUCache
+
+#scaled 1-bit glyph framebufs, e.g.: 5x8 at size=8 is 40x64 = 320 bytes
+GLYPH_CACHE_MAX_BYTES = 8192
+#glyphs larger than this are drawn with rects instead of cached and blitted
+GLYPH_CACHE_MAX_ENTRY_BYTES = GLYPH_CACHE_MAX_BYTES // 4
+#in direct mode, draw chars at this size or larger as a rect cover instead of a block
+RECT_COVER_MIN_SIZE = 8
+#glyph pages of a sparse font kept in RAM, e.g.: 16x16 at 64 glyphs/page is 2KiB/page
+FONT_PAGE_CACHE_MAX_BYTES = 8192
+#drawn in place of chars that are not in the font
+MISSING_CHAR = '?'
+#[font=mod:NAME] is the st7789 font module NAME, instead of a font file
+MODULE_FONT_PREFIX = 'mod:'
+#fonts kept open, including the default font, the least-recently-used others are closed
+LOADED_FONTS_MAX = 4
+#line breaks of wrapped text, e.g.: 200 bytes for a 100-char paragraph
+LINE_BREAK_CACHE_MAX_BYTES = 2048
+#compiled markup ops, e.g.: the timeout template is about 20 ops in 800 bytes
+MARKUP_CACHE_MAX_BYTES = 4096
+#approximate RAM for one op tuple, for the markup cache budget
+MARKUP_OP_BYTES = 32
+
+#markup ops, compiled from markup once and rendered on each draw
+OP_TEXT = 0
+OP_NEWLINE = 1
+OP_HLINE = 2
+OP_PNG = 3
+OP_PNM = 4
+OP_RECT = 5
+OP_ELLIPSE = 6
+OP_SHIFT = 7
+OP_BAR = 8
+OP_RTC = 9
+OP_SHOW = 10
+OP_FIT = 11
+OP_FIT_END = 12
+OP_CURSOR = 13
+OP_CURSOR_PREV = 14
+OP_VAR = 15
+OP_ID = 16
+OP_GRAPH = 17
+OP_VEC = 18
+
+# binary display list, markup ops compiled on the host, e.g.: by pico-lcd-msg --dl
+#   format (all little-endian):
+#     MAGIC           4 bytes, DISPLAY_LIST_MAGIC
+#     VERSION         uint8, DISPLAY_LIST_VERSION, other versions are rejected
+#     OPS             until the end of the data, each is an OPCODE uint8 and its ARGS:
+#       OP_TEXT         LEN uint16, LEN bytes of UTF-8 text
+#       OP_NEWLINE      (none)
+#       OP_HLINE        (none)
+#       OP_PNG          LEN uint8, LEN bytes of filename
+#       OP_PNM          SCALE uint8, LEN uint8, LEN bytes of filename
+#       OP_RECT         W int16, H int16, FLAGS uint8 (0x01=fill, 0x02=symbol)
+#       OP_ELLIPSE      RAD_X float32, RAD_Y float32, FLAGS uint8 (0x01=fill, 0x02=symbol)
+#       OP_SHIFT        X int16, Y int16
+#       OP_BAR          W int16, H int16, PCT int16, FILL_COLOR uint32, EMPTY_COLOR uint32
+#       OP_RTC          LEN uint8, LEN bytes of format
+#       OP_SHOW         (none)
+#       OP_FIT          (none), ends at the next OP_FIT_END
+#       OP_FIT_END      (none)
+#       OP_CURSOR       KEY uint8, index of DISPLAY_LIST_CURSOR_KEYS, and its VAL:
+#                         color|bg      COLOR uint32
+#                         size|x|y      int16
+#                         hspace|vspace float32
+#                         font          LEN uint8, LEN bytes of font name
+#                         align         uint8, index of DISPLAY_LIST_ALIGNS
+#                         wrap          uint8, 0 or 1
+#       OP_CURSOR_PREV  KEY uint8, index of DISPLAY_LIST_CURSOR_KEYS
+#       OP_VAR          LEN uint8, LEN bytes of var name
+#       OP_ID           LEN uint8, LEN bytes of widget id
+#       OP_GRAPH        LEN uint8, LEN bytes of graph id, W int16, H int16,
+#                         MIN int16, MAX int16, COLOR uint32
+#       OP_VEC          MODE uint8, index of VEC_MODES, COLOR uint32,
+#                         COUNT uint16, COUNT x int16 coordinates
+#     COLOR is 0xRRGGBB, or DISPLAY_LIST_NO_COLOR for the default color
+DISPLAY_LIST_MAGIC = b'\x00PDL'
+DISPLAY_LIST_VERSION = 1
+DISPLAY_LIST_HEADER_SIZE = 5
+DISPLAY_LIST_NO_COLOR = 0xFFFFFFFF
+DISPLAY_LIST_CURSOR_KEYS = ["color", "size", "x", "y", "hspace", "vspace", "font", "align", "wrap", "bg"]
+DISPLAY_LIST_ALIGNS = ["left", "center", "right"]
+
+#[vec] drawing modes for packed int16 X,Y coordinates
+#  lines    = separate segments, X1,Y1,X2,Y2 each
+#  polyline = one open path through all points
+#  poly     = a closed polygon outline
+#  fill     = a filled polygon
+VEC_MODES = ["lines", "polyline", "poly", "fill"]
+
+#ops that do not draw anything, so they do not align the line
+NON_DRAWING_OPS = (OP_NEWLINE, OP_HLINE, OP_SHOW, OP_FIT, OP_FIT_END, OP_CURSOR, OP_CURSOR_PREV, OP_ID)
+#ops that [id=NAME] can apply to
+WIDGET_OPS = (OP_TEXT, OP_BAR, OP_PNG, OP_PNM)
+
+MARKUP_MAX_ARG_COUNTS = {
+  "rect"    :4,
+  "ellipse" :4,
+  "bar"     :5,
+  "shift"   :2,
+  "pnm"     :2,
+  "graph"   :6,
+  "vec"     :3,
+}
+#allow <X>x<Y> syntax instead of <X>,<Y> for first arg
+MARKUP_POINT_ARG_CMDS = [
+  "rect",
+  "ellipse",
+  "bar",
+  "shift",
+]
+
+#first 4 bytes of a sparse font file (a flat font starts with its nonzero width)
+SPARSE_FONT_MAGIC = b'\x00SPF'
+SPARSE_FONT_HEADER_FMT = '<4sBBBBHHHH'
+SPARSE_FONT_HEADER_SIZE = 16
+SPARSE_FONT_FLAG_INDEX_UINT32 = 0x01
+SPARSE_FONT_FLAG_ADVANCES = 0x02
+SPARSE_FONT_FLAG_ROW_MAJOR = 0x04
+
+# flat font file, one glyph per codepoint 0-255, read entirely into RAM
+#   format:
+#     WIDTH           uint8
+#     HEIGHT          uint8
+#     GLYPHS          ceil(WIDTH*HEIGHT/8) bytes each, 1-bit column-major
+class FlatFont:
+  def __init__(self, fontFileName):
+    #read the entire font into RAM once (1282 bytes for 5x8)
+    #  glyphs are zero-copy slices, no filesystem access while drawing
+    with open(fontFileName, 'rb') as fh:
+      self.fontData = memoryview(bytearray(fh.read()))
+    self.width, self.height = ustruct.unpack('BB', self.fontData[0:2])
+    self.bytesPerGlyph = int(self.width*self.height/8 + 0.5)
+    self.glyphCount = (len(self.fontData) - 2) // self.bytesPerGlyph
+    self.isRowMajor = False
+
+  def getGlyphIndex(self, codepoint):
+    if codepoint >= self.glyphCount:
+      return -1
+    return codepoint
+
+  def getGlyphBytes(self, glyphIdx):
+    start = glyphIdx * self.bytesPerGlyph + 2
+    return self.fontData[start:start+self.bytesPerGlyph]
+
+  def getGlyphRowBytes(self, glyphIdx):
+    return None
+
+  def getAdvance(self, glyphIdx):
+    return self.width
+
+  def close(self):
+    self.fontData = None
+
+# sparse font file, any set of unicode codepoints, glyphs loaded one page at a time
+#   format (all little-endian):
+#     MAGIC           4 bytes, SPARSE_FONT_MAGIC
+#     VERSION         uint8, 1
+#     WIDTH           uint8
+#     HEIGHT          uint8
+#     FLAGS           uint8, any of:
+#                       SPARSE_FONT_FLAG_INDEX_UINT32 - INDEX is uint32, for codepoints above 0xFFFF
+#                       SPARSE_FONT_FLAG_ADVANCES     - ADVANCES is present
+#                       SPARSE_FONT_FLAG_ROW_MAJOR    - ROW_GLYPHS is present
+#     GLYPH_COUNT     uint16
+#     PAGE_GLYPHS     uint16, glyphs per page
+#     BYTES_PER_GLYPH uint16, ceil(WIDTH*HEIGHT/8)
+#     RESERVED        uint16
+#     INDEX           uint16 or uint32 * GLYPH_COUNT, sorted codepoint of each glyph
+#     ADVANCES        (optional) uint8 * GLYPH_COUNT, px to move the cursor after each glyph
+#     GLYPHS          BYTES_PER_GLYPH each, 1-bit column-major, in INDEX order
+#     ROW_GLYPHS      (optional) ceil(WIDTH/8)*HEIGHT bytes each, 1-bit MONO_HLSB, in INDEX order
+#   only INDEX and ADVANCES are kept in RAM, pages of glyphs are read as needed into an LRU cache
+#   written by font_generator.writeSparseFontFile() or by the font-compiler host script
+class SparseFont:
+  def __init__(self, fontFileName):
+    self.fh = open(fontFileName, 'rb')
+    try:
+      (magic, version, self.width, self.height, flags, self.glyphCount,
+        self.pageGlyphs, self.bytesPerGlyph, reserved,
+      ) = ustruct.unpack(SPARSE_FONT_HEADER_FMT, self.fh.read(SPARSE_FONT_HEADER_SIZE))
+      if magic != SPARSE_FONT_MAGIC or version != 1:
+        raise OSError("invalid sparse font header: " + str(fontFileName))
+      self.indexEntryBytes = 4 if flags & SPARSE_FONT_FLAG_INDEX_UINT32 else 2
+      #separate bytearray, so it is word-aligned for findGlyphIndex()
+      self.index = bytearray(self.glyphCount * self.indexEntryBytes)
+      self.fh.readinto(self.index)
+      self.advances = None
+      if flags & SPARSE_FONT_FLAG_ADVANCES:
+        self.advances = self.fh.read(self.glyphCount)
+      self.glyphsOffset = self.fh.tell()
+      self.isRowMajor = flags & SPARSE_FONT_FLAG_ROW_MAJOR != 0
+      self.bytesPerRowGlyph = ((self.width + 7) // 8) * self.height
+      self.rowGlyphsOffset = self.glyphsOffset + self.glyphCount*self.bytesPerGlyph
+      self.pageCache = LRUCache(FONT_PAGE_CACHE_MAX_BYTES)
+    except:
+      self.fh.close()
+      raise
+
+  def getGlyphIndex(self, codepoint):
+    return findGlyphIndex(self.index, self.glyphCount, codepoint, self.indexEntryBytes)
+
+  def getGlyphBytes(self, glyphIdx):
+    return self.getPageGlyph(glyphIdx, False, self.glyphsOffset, self.bytesPerGlyph)
+
+  #MONO_HLSB glyph bytes, or None if the font has no row-major glyphs
+  def getGlyphRowBytes(self, glyphIdx):
+    if not self.isRowMajor:
+      return None
+    return self.getPageGlyph(glyphIdx, True, self.rowGlyphsOffset, self.bytesPerRowGlyph)
+
+  def getAdvance(self, glyphIdx):
+    if self.advances == None:
+      return self.width
+    return self.advances[glyphIdx]
+
+  def getPageGlyph(self, glyphIdx, isRowMajor, offset, glyphSize):
+    pageIdx = glyphIdx // self.pageGlyphs
+    key = pageIdx*2 + (1 if isRowMajor else 0)
+    page = self.pageCache.get(key)
+    if page == None:
+      page = self.readPage(pageIdx, offset, glyphSize)
+      self.pageCache.put(key, page, len(page))
+    start = (glyphIdx - pageIdx*self.pageGlyphs) * glyphSize
+    return page[start:start+glyphSize]
+
+  def readPage(self, pageIdx, offset, glyphSize):
+    firstGlyphIdx = pageIdx * self.pageGlyphs
+    pageGlyphCount = min(self.pageGlyphs, self.glyphCount - firstGlyphIdx)
+    page = memoryview(bytearray(pageGlyphCount * glyphSize))
+    self.fh.seek(offset + firstGlyphIdx*glyphSize)
+    self.fh.readinto(page)
+    return page
+
+  def close(self):
+    self.pageCache.clear()
+    self.fh.close()
+
+# st7789 font module, frozen into the firmware, used for [font=mod:NAME]
+#   either a bitmap font for st7789.text() (from font_to_py/romfonts):
+#     WIDTH, HEIGHT, FIRST, LAST, FONT (MONO_HLSB glyphs for codepoints FIRST-LAST)
+#   or a proportional 1-bit font for st7789.write() (from write_font_converter):
+#     MAP, BPP, HEIGHT, MAX_WIDTH, WIDTHS, OFFSET_WIDTH, OFFSETS, BITMAPS
+#       (MSB-first row-major bitstream, each glyph starting at its big-endian bit offset)
+#   text in these fonts is drawn natively by the LCD driver when possible,
+#     otherwise glyphs are converted as needed, and drawn like any other font
+class ModuleFont:
+  def __init__(self, module):
+    self.module = module
+    self.isWriteFont = hasattr(module, 'MAP')
+    if self.isWriteFont:
+      if getattr(module, 'BPP', 1) != 1:
+        raise OSError("only 1-bit st7789 write() fonts are supported")
+      self.width = module.MAX_WIDTH
+    else:
+      self.width = module.WIDTH
+    self.height = module.HEIGHT
+    self.isRowMajor = True
+    self.bytesPerRow = (self.width + 7) // 8
+    self.bytesPerGlyph = (self.width*self.height + 7) // 8
+    #converted glyphs, 'glyphIdx*2 + isRowMajor' => glyph bytes
+    self.glyphCache = LRUCache(FONT_PAGE_CACHE_MAX_BYTES)
+
+  def getGlyphIndex(self, codepoint):
+    if self.isWriteFont:
+      return self.module.MAP.find(chr(codepoint))
+    elif self.module.FIRST <= codepoint <= self.module.LAST:
+      return codepoint - self.module.FIRST
+    else:
+      return -1
+
+  def getAdvance(self, glyphIdx):
+    if self.isWriteFont:
+      return self.module.WIDTHS[glyphIdx]
+    else:
+      return self.width
+
+  # st7789.text() iterates bytes, not UTF-8 chars, so only ASCII is drawn natively
+  def canDrawNative(self, text):
+    for ch in text:
+      if self.getGlyphIndex(ord(ch)) < 0 or (not self.isWriteFont and ord(ch) >= 128):
+        return False
+    return True
+
+  def getGlyphRowBytes(self, glyphIdx):
+    rowBytesPerGlyph = self.bytesPerRow * self.height
+    if not self.isWriteFont:
+      start = glyphIdx * rowBytesPerGlyph
+      return memoryview(self.module.FONT)[start:start+rowBytesPerGlyph]
+    return self.getConvertedGlyph(glyphIdx, True, rowBytesPerGlyph)
+
+  def getGlyphBytes(self, glyphIdx):
+    return self.getConvertedGlyph(glyphIdx, False, self.bytesPerGlyph)
+
+  def getConvertedGlyph(self, glyphIdx, isRowMajor, glyphSize):
+    key = glyphIdx*2 + (1 if isRowMajor else 0)
+    glyphBytes = self.glyphCache.get(key)
+    if glyphBytes == None:
+      glyphBytes = bytearray(glyphSize)
+      for y in range(self.height):
+        for x in range(self.width):
+          if self.getDot(glyphIdx, x, y):
+            if isRowMajor:
+              glyphBytes[y*self.bytesPerRow + (x >> 3)] |= 0x80 >> (x & 7)
+            else:
+              bitIdx = x*self.height + y
+              glyphBytes[bitIdx >> 3] |= 1 << (bitIdx & 7)
+      self.glyphCache.put(key, glyphBytes, glyphSize)
+    return glyphBytes
+
+  def getDot(self, glyphIdx, x, y):
+    if self.isWriteFont:
+      glyphW = self.module.WIDTHS[glyphIdx]
+      if x >= glyphW:
+        return False
+      offsetWidth = self.module.OFFSET_WIDTH
+      bitIdx = 0
+      for i in range(offsetWidth):
+        bitIdx = (bitIdx << 8) | self.module.OFFSETS[glyphIdx*offsetWidth + i]
+      bitIdx += y*glyphW + x
+      return (self.module.BITMAPS[bitIdx >> 3] >> (7 - (bitIdx & 7))) & 1 == 1
+    else:
+      glyphRowBytes = self.getGlyphRowBytes(glyphIdx)
+      return (glyphRowBytes[y*self.bytesPerRow + (x >> 3)] >> (7 - (x & 7))) & 1 == 1
+
+  def close(self):
+    self.glyphCache.clear()
+
+# next item of an iterator, or None at the end
+def getNextOrNone(iterator):
+  try:
+    return next(iterator)
+  except StopIteration:
+    return None
+
+# index of the incomplete UTF-8 char at the end of data, or len(data) if the last char is whole
+def getUtf8TailIdx(data):
+  dataLen = len(data)
+  i = dataLen - 1
+  while i >= 0 and i > dataLen - 4 and data[i] & 0xC0 == 0x80:
+    i -= 1
+  if i < 0:
+    return dataLen
+  leadByte = data[i]
+  if leadByte >= 0xF0:
+    charLen = 4
+  elif leadByte >= 0xE0:
+    charLen = 3
+  elif leadByte >= 0xC0:
+    charLen = 2
+  else:
+    charLen = 1
+  return i if i + charLen > dataLen else dataLen
+
+# binary search of a sorted uint16/uint32 codepoint index
+#   returns the glyph index of codepoint, or -1 if it is not in the index
+@micropython.viper
+def findGlyphIndex(index, glyphCount:int, codepoint:int, entryBytes:int) -> int:
+  lo = 0
+  hi = glyphCount - 1
+  if entryBytes == 4:
+    index32 = ptr32(index)
+    while lo <= hi:
+      mid = (lo + hi) >> 1
+      val = int(index32[mid])
+      if val < codepoint:
+        lo = mid + 1
+      elif val > codepoint:
+        hi = mid - 1
+      else:
+        return mid
+  else:
+    index16 = ptr16(index)
+    while lo <= hi:
+      mid = (lo + hi) >> 1
+      val = int(index16[mid])
+      if val < codepoint:
+        lo = mid + 1
+      elif val > codepoint:
+        hi = mid - 1
+      else:
+        return mid
+  return -1
+
+# open a FlatFont or a SparseFont, by the magic at the start of the file
+def openFont(fontFileName):
+  with open(fontFileName, 'rb') as fh:
+    magic = fh.read(len(SPARSE_FONT_MAGIC))
+  if magic == SPARSE_FONT_MAGIC:
+    return SparseFont(fontFileName)
+  else:
+    return FlatFont(fontFileName)
 
 class LcdFont:
   def __init__(self, fontFileName, lcd, rtc=None):
@@ -12,53 +410,143 @@ class LcdFont:
     self.lcd = lcd
     self.rtc = rtc
     self.defaultColorName = 'white'
-    self.fontHandle = None
+    #fontFileName => (font, rectsData), for the default font and any [font=FILE] in markup
+    #  least-recently-used first
+    self.fonts = OrderedDict()
+    self.fontName = None
+    self.font = None
+    self.rectsData = None
     self.fontWidth = None
     self.fontHeight = None
-    self.bitsPerChar = None
-    self.bytesPerChar = None
     self.fontReady = False
     self.cursor = None
+    #[minX, minY, maxX, maxY] of everything 'drawn' while measuring, None when drawing
+    self.measureBox = None
+    #stop measuring at the first newline
+    self.isMeasureLine = False
+    self.isMeasureDone = False
     self.pngInfosToShow = []
+    self.glyphCache = LRUCache(GLYPH_CACHE_MAX_BYTES)
+    self.lineBreakCache = LRUCache(LINE_BREAK_CACHE_MAX_BYTES)
+    self.markupCache = LRUCache(MARKUP_CACHE_MAX_BYTES)
+    #values for [var=NAME]
+    self.vars = {}
+    #the layout on the screen, to redraw only what changes when a var is set
+    self.layout = None
+    #[id=NAME] elements on the screen, by NAME, to redraw one with updateWidget()
+    self.widgets = {}
+    #[graph] sample history, by graph id, kept when the graph is not on the screen
+    self.graphs = {}
+    #(key, box) of each draw op of the last markup drawn with isDiff=True
+    self.frame = None
 
   def setup(self):
     if not self.fontReady:
-      try:
-        self.fontHandle = open(self.fontFileName, 'rb')
-        self.fontWidth, self.fontHeight = ustruct.unpack('BB', self.fontHandle.read(2))
-        self.bitsPerChar = self.fontWidth * self.fontHeight
-        self.bytesPerChar = int(self.bitsPerChar/8 + 0.5)
-        self.fontReady = True
-      except OSError as e:
-        print("ERROR LOADING FONT: " + str(self.fontFileName))
-        self.fontReady = False
+      self.fontReady = self.selectFont(self.fontFileName)
 
   def close(self):
     if self.fontReady:
-      self.fontHandle.close()
-      self.fontHandle = None
+      for (font, rectsData) in self.fonts.values():
+        font.close()
+      self.fonts = OrderedDict()
+      self.fontName = None
+      self.font = None
+      self.rectsData = None
+      self.glyphCache.clear()
+      self.lineBreakCache.clear()
       self.fontWidth = None
       self.fontHeight = None
-      self.bitsPerChar = None
-      self.bytesPerChar = None
       self.fontReady = False
 
+  # open the font file, and its rect cover if present, once
+  #   returns (font, rectsData), or None if the font cannot be loaded
+  #   past LOADED_FONTS_MAX, closes the least-recently-used font other than the default
+  def loadFont(self, fontFileName):
+    if fontFileName in self.fonts:
+      #move to the end, most recently used
+      fontInfo = self.fonts.pop(fontFileName)
+      self.fonts[fontFileName] = fontInfo
+      return fontInfo
+
+    if fontFileName.startswith(MODULE_FONT_PREFIX):
+      try:
+        font = ModuleFont(__import__(fontFileName[len(MODULE_FONT_PREFIX):]))
+      except (ImportError, AttributeError, OSError) as e:
+        print("ERROR LOADING FONT: " + str(fontFileName))
+        return None
+      self.fonts[fontFileName] = (font, None)
+      self.evictFonts()
+      return self.fonts[fontFileName]
+
+    try:
+      font = openFont(fontFileName)
+    except OSError as e:
+      print("ERROR LOADING FONT: " + str(fontFileName))
+      return None
+
+    #optional rect cover of each glyph, generated by font_generator
+    try:
+      with open(fontFileName + ".rects", 'rb') as fh:
+        rectsData = memoryview(fh.read())
+    except OSError as e:
+      rectsData = None
+
+    self.fonts[fontFileName] = (font, rectsData)
+    self.evictFonts()
+    return self.fonts[fontFileName]
+
+  # close the least-recently-used fonts until at most LOADED_FONTS_MAX are open
+  #   the default font and the selected font are never closed
+  def evictFonts(self):
+    while len(self.fonts) > LOADED_FONTS_MAX:
+      evictName = None
+      for fontFileName in self.fonts:
+        if fontFileName != self.fontFileName and fontFileName != self.fontName:
+          evictName = fontFileName
+          break
+      if evictName == None:
+        return
+      (font, rectsData) = self.fonts.pop(evictName)
+      font.close()
+
+  # use the font for all drawing, loading it if needed
+  #   returns False, leaving the current font selected, if the font cannot be loaded
+  def selectFont(self, fontFileName):
+    if fontFileName == self.fontName:
+      return True
+    fontInfo = self.loadFont(fontFileName)
+    if fontInfo == None:
+      return False
+    (self.font, self.rectsData) = fontInfo
+    self.fontName = fontFileName
+    self.fontWidth = self.font.width
+    self.fontHeight = self.font.height
+    return True
+
+  #the retained layout, widgets and diff frame were drawn on the old LCD
   def setLCD(self, lcd):
     self.lcd = lcd
+    self.clearRetained()
 
   def setRTC(self, rtc):
     self.rtc = rtc
 
   def getCharGridSize(self, size):
     (winW, winH) = self.lcd.get_target_window_size()
+    #no font could be loaded
+    if self.fontWidth == None:
+      return (0, 0)
     charW = int(winW / ((self.fontWidth+1)*size))
     charH = int(winH / ((self.fontHeight+1)*size))
     return (charW, charH)
 
-  def getFontCharBytes(self, charStr):
-    asciiIndex = ord(charStr)
-    self.fontHandle.seek(asciiIndex * self.bytesPerChar + 2)
-    return ustruct.unpack('B'*self.bytesPerChar, self.fontHandle.read(self.bytesPerChar))
+  #index of the glyph for the char in the font, or of MISSING_CHAR if it is not in the font
+  #  returns -1 if neither is in the font
+  def getGlyphIndex(self, charStr):
+    glyphIdx = self.font.getGlyphIndex(ord(charStr))
+    if glyphIdx < 0:
+      glyphIdx = self.font.getGlyphIndex(ord(MISSING_CHAR))
+    return glyphIdx
 
   def getCursorColor(self):
     return self.getOptColor(self.cursor['color'])
@@ -68,6 +556,7 @@ class LcdFont:
     return color
 
   def cursorSet(self, startX, startY, x, y, size, color, hspace, vspace):
+    self.selectFont(self.fontFileName)
     self.cursor = {
       "startX": startX,
       "startY": startY,
@@ -75,18 +564,48 @@ class LcdFont:
       "y" : y,
       "size": size,
       "color": color,
+      #background of each char cell, None for transparent
+      "bg": None,
       "hspace": hspace,
-      "vspace": vspace
+      "vspace": vspace,
+      "font": self.fontFileName,
+      "align": "left",
+      "wrap": False,
     }
   def cursorDrawChar(self, charStr):
-    self.drawChar(charStr,
-      self.cursor['x'], self.cursor['y'], self.cursor['size'], self.cursor['color'])
-    self.cursor['x'] += self.cursor['size'] * self.fontWidth
+    (x, y, size) = (self.cursor['x'], self.cursor['y'], self.cursor['size'])
+    glyphIdx = self.getGlyphIndex(charStr)
+    if glyphIdx < 0:
+      advance = self.fontWidth
+    else:
+      advance = self.font.getAdvance(glyphIdx)
+      if self.measureBox != None:
+        self.measureAdd(x, y, size * advance, size * self.fontHeight)
+      elif self.cursor['bg'] == None:
+        #transparent, only the dots of the char are drawn
+        self.drawGlyph(glyphIdx, x, y, size, self.cursor['color'])
+      else:
+        #the entire cell, including hspace+vspace, is filled with bg
+        cellW = size * advance + int(size * self.cursor['hspace'])
+        cellH = int(size * (self.fontHeight + self.cursor['vspace']))
+        if self.lcd.is_framebuf_enabled() or (
+          size >= RECT_COVER_MIN_SIZE and self.rectsData != None
+        ):
+          #a few large rects are cheaper than a large block
+          self.lcd.fill_rect(x, y, cellW, cellH, self.cursor['bg'])
+          self.drawGlyph(glyphIdx, x, y, size, self.cursor['color'])
+        else:
+          self.drawGlyphBlock(glyphIdx, x, y, size, self.cursor['color'],
+            self.cursor['bg'], cellW, cellH)
+    self.cursor['x'] += size * advance
     self.cursorIndentHspace()
   def cursorIndentHspace(self):
     self.cursor['x'] += int(self.cursor['size'] * self.cursor['hspace'])
   def cursorDrawPNG(self, filename):
-    if self.lcd.is_framebuf_enabled():
+    if self.measureBox != None:
+      (w, h) = self.lcd.png_size(filename)
+      self.measureAdd(self.cursor['x'], self.cursor['y'], w, h)
+    elif self.lcd.is_framebuf_enabled():
       #delay drawing PNGs until after framebuf is shown
       self.pngInfosToShow.append({
         "filename":filename,
@@ -99,13 +618,23 @@ class LcdFont:
     if scale < 1 or scale != int(scale):
       raise Exception("ERROR: invalid scale for PNM image,"
         + " only positive integer scaling is supported")
-    (w, h) = self.lcd.pnm(filename, self.cursor['x'], self.cursor['y'], int(scale))
+    if self.measureBox != None:
+      (w, h) = self.lcd.pnm_size(filename)
+      self.measureAdd(self.cursor['x'], self.cursor['y'], w * scale, h * scale)
+    else:
+      (w, h) = self.lcd.pnm(filename, self.cursor['x'], self.cursor['y'], int(scale))
     self.cursor['x'] += w * scale
   def cursorDrawRect(self, w, h, fill=True):
-    self.lcd.rect(self.cursor['x'], self.cursor['y'], w, h, self.getCursorColor(), fill)
+    if self.measureBox != None:
+      self.measureAdd(self.cursor['x'], self.cursor['y'], w, h)
+    else:
+      self.lcd.rect(self.cursor['x'], self.cursor['y'], w, h, self.getCursorColor(), fill)
     self.cursor['x'] += w
   def cursorDrawEllipse(self, radX, radY, fill=True):
-    self.lcd.ellipse(self.cursor['x'] + radX, self.cursor['y'] + radY, radX, radY, self.getCursorColor(), fill)
+    if self.measureBox != None:
+      self.measureAdd(self.cursor['x'], self.cursor['y'], radX * 2 + 1, radY * 2 + 1)
+    else:
+      self.lcd.ellipse(self.cursor['x'] + radX, self.cursor['y'] + radY, radX, radY, self.getCursorColor(), fill)
     self.cursor['x'] += radX * 2 + 1
   def cursorDrawBar(self, w, h, pct, fillColor, emptyColor):
     x = self.cursor['x']
@@ -118,35 +647,270 @@ class LcdFont:
       fillH = int(fillH * pct / 100.0)
       fillY += h-fillH
 
-    self.lcd.rect(emptyX, emptyY, emptyW, emptyH, self.getOptColor(emptyColor), True)
-    self.lcd.rect(fillX, fillY, fillW, fillH, self.getOptColor(fillColor), True)
+    if self.measureBox != None:
+      self.measureAdd(x, y, w, h)
+    else:
+      self.lcd.rect(emptyX, emptyY, emptyW, emptyH, self.getOptColor(emptyColor), True)
+      self.lcd.rect(fillX, fillY, fillW, fillH, self.getOptColor(fillColor), True)
+    self.cursor['x'] += w
+  def cursorDrawGraph(self, graphId, w, h, minVal, maxVal, color):
+    if self.measureBox != None:
+      self.measureAdd(self.cursor['x'], self.cursor['y'], w, h)
+    elif w > 0 and h > 0:
+      if color == None:
+        color = self.getCursorColor()
+      graph = self.graphs.get(graphId, None)
+      if graph == None or len(graph['samples']) != w:
+        graph = {"samples": array('h', [0]*w), "head": 0, "count": 0}
+        self.graphs[graphId] = graph
+      #the position on the screen, for pushGraph()
+      self.widgets[graphId] = {
+        "op": (OP_GRAPH, graphId, w, h, minVal, maxVal, color),
+        "cursor": self.cursor.copy(),
+        "box": (self.cursor['x'], self.cursor['y'], w, h),
+      }
+      self.drawGraphColumns(graphId, 0)
     self.cursor['x'] += w
+  def cursorDrawVec(self, mode, color, coords, bounds):
+    (x, y) = (self.cursor['x'], self.cursor['y'])
+    (minX, minY, maxX, maxY) = bounds
+    if self.measureBox != None:
+      self.measureAdd(x + minX, y + minY, maxX - minX + 1, maxY - minY + 1)
+    else:
+      if color == None:
+        color = self.getCursorColor()
+      self.drawVec(mode, coords, x, y, color)
+    self.cursor['x'] += max(0, maxX + 1)
   def cursorNewLine(self):
+    if self.isMeasureLine:
+      self.isMeasureDone = True
     self.cursor['x'] = self.cursor['startX']
     self.cursor['y'] += int(self.cursor['size'] * (self.fontHeight + self.cursor['vspace']))
   def cursorHline(self):
     color = self.getCursorColor()
     (winW, winH) = self.lcd.get_target_window_size()
-    self.lcd.hline(self.cursor['startX'], self.cursor['y'], winW, color)
+    if self.isMeasureLine:
+      self.isMeasureDone = True
+    elif self.measureBox != None:
+      self.measureAdd(self.cursor['startX'], self.cursor['y'], winW, 1)
+    else:
+      self.lcd.hline(self.cursor['startX'], self.cursor['y'], winW, color)
     self.cursor['x'] = self.cursor['startX']
     self.cursor['y'] += 1
-  def cursorDrawText(self, text):
+  # move the cursor right, so the rest of the line ends at the right edge of the window
+  #   or is centered between the cursor and the right edge, as in [align=<ALIGN>]
+  #   the line is leadText, if given, followed by ops[opIdx:] up to the next newline
+  def cursorAlignLine(self, ops, opIdx, leadText=None):
+    if self.cursor['align'] == "left":
+      return
+    (winW, winH) = self.lcd.get_target_window_size()
+    x = self.cursor['x']
+    (boxX, boxY, boxW, boxH) = self.measureOpsAtCursor(
+      ops, opIdx, len(ops), isLineOnly=True, leadText=leadText)
+    lineW = boxX + boxW - x
+    if self.cursor['align'] == "right":
+      self.cursor['x'] = winW - lineW
+    elif self.cursor['align'] == "center":
+      self.cursor['x'] = x + (winW - x - lineW) // 2
+  # draw text at the cursor, wrapping it to the window if cursor 'wrap' is set
+  #   ops[nextOpIdx:] are the ops after text, to align each wrapped line
+  def cursorDrawText(self, text, ops=None, nextOpIdx=0):
+    if not self.cursor['wrap']:
+      self.cursorDrawTextRun(text)
+      return
+
+    isFirstLine = True
+    for (lineStart, lineEnd) in self.getLineBreaks(text):
+      if not isFirstLine:
+        self.cursorNewLine()
+        if ops != None and self.measureBox == None:
+          self.cursorAlignLine(ops, nextOpIdx, text[lineStart:])
+      isFirstLine = False
+      self.cursorDrawTextRun(text[lineStart:lineEnd])
+
+  # split text into lines that fit between the cursor and the right of the window
+  #   as a list of (start, end) indexes, from the cache if the layout is unchanged
+  #   lines break at the last space that fits, which is dropped, and at each newline
+  #   words wider than the window are split, and the first line may be empty,
+  #     if the first word does not fit after the cursor
+  def getLineBreaks(self, text):
+    (winW, winH) = self.lcd.get_target_window_size()
+    size = self.cursor['size']
+    hspacePx = int(size * self.cursor['hspace'])
+    (x, startX) = (self.cursor['x'], self.cursor['startX'])
+
+    key = (self.fontName, text, size, hspacePx, x, startX, winW)
+    lines = self.lineBreakCache.get(key)
+    if lines != None:
+      return lines
+
+    lines = []
+    (lineStart, lineStartX, spaceIdx) = (0, x, -1)
+    i = 0
+    while i < len(text):
+      ch = text[i]
+      if ch == "\n":
+        lines.append((lineStart, i))
+        (lineStart, lineStartX, spaceIdx) = (i+1, startX, -1)
+        (i, x) = (i+1, startX)
+        continue
+      elif ch == " ":
+        spaceIdx = i
+
+      charW = size * self.getCharAdvance(ch)
+      if x + charW > winW and ch != " ":
+        lineEnd = None
+        if spaceIdx >= lineStart:
+          #break at the last space
+          (lineEnd, nextStart) = (spaceIdx, spaceIdx+1)
+        elif lineStartX > startX:
+          #move the entire word to the next line
+          (lineEnd, nextStart) = (lineStart, lineStart)
+        elif i > lineStart:
+          #the word is wider than the window, split it
+          (lineEnd, nextStart) = (i, i)
+
+        if lineEnd != None:
+          lines.append((lineStart, lineEnd))
+          (lineStart, lineStartX, spaceIdx) = (nextStart, startX, -1)
+          (i, x) = (nextStart, startX)
+          continue
+
+      x += charW + hspacePx
+      i += 1
+    lines.append((lineStart, len(text)))
+
+    self.lineBreakCache.put(key, lines, len(text) + 8*len(lines) + 32)
+    return lines
+
+  def getCharAdvance(self, charStr):
+    glyphIdx = self.getGlyphIndex(charStr)
+    if glyphIdx < 0:
+      return self.fontWidth
+    return self.font.getAdvance(glyphIdx)
+
+  # draw text without wrapping, moving to the next line only at newlines
+  def cursorDrawTextRun(self, text):
+    if self.isMeasureLine:
+      for ch in text:
+        if self.isMeasureDone:
+          return
+        elif ch == "\n":
+          self.cursorNewLine()
+        else:
+          self.cursorDrawChar(ch)
+      return
+
+    if self.isNativeTextEnabled():
+      isFirstLine = True
+      for line in text.split("\n"):
+        if not isFirstLine:
+          self.cursorNewLine()
+        isFirstLine = False
+        if not self.cursorDrawNativeText(line):
+          for ch in line:
+            self.cursorDrawChar(ch)
+      return
+
     for ch in text:
       if ch == "\n":
         self.cursorNewLine()
       else:
         self.cursorDrawChar(ch)
 
+  # font modules are drawn by the LCD driver in direct mode, at SIZE=1, with a [bg]
+  #   the driver always fills the background, so transparent chars are drawn one at a time
+  def isNativeTextEnabled(self):
+    return (self.measureBox == None
+      and isinstance(self.font, ModuleFont)
+      and self.cursor['size'] == 1
+      and self.cursor['bg'] != None
+      and not self.lcd.is_framebuf_enabled())
+
+  # draw a line of text with st7789.text()/write(), in one call if there is no hspace
+  #   returns False without drawing if any char cannot be drawn natively
+  def cursorDrawNativeText(self, text):
+    font = self.font
+    if not font.canDrawNative(text):
+      return False
+    hspacePx = int(self.cursor['size'] * self.cursor['hspace'])
+    if hspacePx == 0:
+      runs = [text]
+    else:
+      runs = text
+    color = self.getCursorColor()
+    for run in runs:
+      w = 0
+      for ch in run:
+        w += font.getAdvance(font.getGlyphIndex(ord(ch)))
+      isDrawn = self.lcd.draw_text_native(font.module, font.isWriteFont, run,
+        self.cursor['x'], self.cursor['y'], w, font.height, color, self.cursor['bg'])
+      if not isDrawn:
+        for ch in run:
+          self.cursorDrawChar(ch)
+      else:
+        self.cursor['x'] += w + hspacePx
+    return True
+
   # charStr    a string containing a single character
   # (x, y)     the top-left corner of the character in pixels
   # size       pixels-per-dot of the font (characterHeight = fontHeight * pxPerDot)
   # color      color in the colorspace of the lcd
   def drawChar(self, charStr, x, y, size, color):
-    fontCharBytes = self.getFontCharBytes(charStr)
+    glyphIdx = self.getGlyphIndex(charStr)
+    if glyphIdx >= 0:
+      self.drawGlyph(glyphIdx, x, y, size, color)
+
+  def drawGlyph(self, glyphIdx, x, y, size, color):
+    color = self.getOptColor(color)
+
+    if self.lcd.is_framebuf_enabled():
+      glyphFB = self.getGlyphFramebuf(glyphIdx, size)
+      if glyphFB != None:
+        self.lcd.blit_mono(glyphFB, x, y, self.fontWidth * size, self.fontHeight * size, color)
+        return
+
+    if not self.drawGlyphRects(self.lcd, glyphIdx, x, y, size, color):
+      fontCharBytes = self.font.getGlyphBytes(glyphIdx)
+      self.drawGlyphDots(self.lcd, fontCharBytes, x, y, size, color)
+
+  # direct-mode only: draw the char and its background in a single LCD window write
+  #   cellW x cellH is the char plus spacing, filled with bgColor where there is no dot
+  #   falls back to a bgColor rect and drawGlyph() if the cell does not fit on the LCD
+  def drawGlyphBlock(self, glyphIdx, x, y, size, color, bgColor, cellW, cellH):
+    fontCharBytes = self.font.getGlyphBytes(glyphIdx)
+    color = self.getOptColor(color)
+    cellW = max(cellW, size * self.fontWidth)
+    cellH = max(cellH, size * self.fontHeight)
+    isDrawn = self.lcd.draw_glyph_block(fontCharBytes, self.fontWidth, self.fontHeight,
+      x, y, size, cellW, cellH, color, bgColor)
+    if not isDrawn:
+      self.lcd.fill_rect(x, y, cellW, cellH, bgColor)
+      self.drawGlyph(glyphIdx, x, y, size, color)
+
+  # call target.fill_rect() once for each rect in the precomputed rect cover of the glyph
+  #   returns False without drawing if there is no rect cover for the char
+  def drawGlyphRects(self, target, glyphIdx, x, y, size, color):
+    rects = self.rectsData
+    if rects == None:
+      return False
+    (glyphCount,) = ustruct.unpack_from('<H', rects, 0)
+    if glyphIdx >= glyphCount:
+      return False
+    (rectStart, rectEnd) = ustruct.unpack_from('<HH', rects, 2 + glyphIdx*2)
+    rectsOffset = 2 + (glyphCount+1)*2
+    for rectIdx in range(rectStart, rectEnd):
+      i = rectsOffset + rectIdx*4
+      target.fill_rect(x + rects[i]*size, y + rects[i+1]*size,
+        rects[i+2]*size, rects[i+3]*size, color)
+    return True
+
+  # call target.fill_rect() once for each lit dot in the glyph
+  #   target is either the LCD or a FrameBuffer
+  def drawGlyphDots(self, target, fontCharBytes, x, y, size, color):
     byteIndex = 0
     bitIndex = 0
     byte = fontCharBytes[byteIndex]
-    color = self.getOptColor(color)
     for chX in range(self.fontWidth):
       for chY in range(self.fontHeight):
         if bitIndex >= 8:
@@ -156,7 +920,37 @@ class LcdFont:
         dotBit = byte >> bitIndex & 0x1
         bitIndex += 1
         if dotBit == 1:
-          self.lcd.rect(x + chX*size, y + chY*size, size, size, color, True)
+          target.fill_rect(x + chX*size, y + chY*size, size, size, color)
+
+  # a 1-bit FrameBuffer of the glyph scaled to size, from the LRU cache
+  #   returns None if the scaled glyph is too large to cache
+  def getGlyphFramebuf(self, glyphIdx, size):
+    key = (self.fontName, glyphIdx, size)
+    glyphFB = self.glyphCache.get(key)
+    if glyphFB != None:
+      return glyphFB
+
+    (w, h) = (self.fontWidth * size, self.fontHeight * size)
+    bufSizeBytes = w * ((h + 7) // 8)
+    if bufSizeBytes > GLYPH_CACHE_MAX_ENTRY_BYTES:
+      return None
+
+    #glyph bytes are copied, so the FrameBuffer does not hold a page of a sparse font in RAM
+    if size == 1 and self.font.isRowMajor:
+      #pre-rendered row-major glyph, same layout as MONO_HLSB
+      bufSizeBytes = ((w + 7) // 8) * h
+      glyphFB = framebuf.FrameBuffer(bytearray(self.font.getGlyphRowBytes(glyphIdx)),
+        w, h, framebuf.MONO_HLSB)
+    elif size == 1 and self.fontHeight == 8:
+      #one byte per column, font bytes are already MONO_VLSB
+      glyphFB = framebuf.FrameBuffer(bytearray(self.font.getGlyphBytes(glyphIdx)),
+        w, h, framebuf.MONO_VLSB)
+    else:
+      glyphFB = framebuf.FrameBuffer(bytearray(bufSizeBytes), w, h, framebuf.MONO_VLSB)
+      self.drawGlyphDots(glyphFB, self.font.getGlyphBytes(glyphIdx), 0, 0, size, 1)
+
+    self.glyphCache.put(key, glyphFB, bufSizeBytes)
+    return glyphFB
 
   def drawText(self, text, x=0, y=0, size=5, color=None, hspace=1.0, vspace=1.0):
     self.cursorSet(x, y, x, y, size, color, hspace, vspace)
@@ -168,12 +962,18 @@ class LcdFont:
     self.show()
 
   def maybeReadCmdVal(self, cmd, valStr, defaultVal):
-    if cmd == "color":
+    if cmd == "color" or cmd == "bg":
       return self.maybeReadColor(valStr, defaultVal)
     elif cmd == "size" or cmd == "x" or cmd == "y":
       return self.maybeReadInt(valStr, defaultVal)
     elif cmd == "hspace" or cmd == "vspace":
       return self.maybeReadFloat(valStr, defaultVal)
+    elif cmd == "font":
+      return valStr if self.loadFont(valStr) != None else defaultVal
+    elif cmd == "align":
+      return valStr if valStr in ["left", "center", "right"] else defaultVal
+    elif cmd == "wrap":
+      return self.maybeReadBool(valStr, defaultVal)
     else:
       return defaultVal
   def maybeReadColor(self, valStr, defaultVal):
@@ -254,36 +1054,442 @@ class LcdFont:
     for pngInfo in self.pngInfosToShow:
       self.lcd.png(pngInfo['filename'], pngInfo['x'], pngInfo['y'])
 
+  # show only the WxH+X+Y part of the framebuf, and the PNGs that overlap it
+  def showRegion(self, x, y, w, h):
+    self.lcd.show_region(x, y, w, h)
+    for pngInfo in self.pngInfosToShow:
+      (pngX, pngY) = (pngInfo['x'], pngInfo['y'])
+      if pngX < x + w and pngY < y + h:
+        (pngW, pngH) = self.lcd.png_size(pngInfo['filename'])
+        if pngX + pngW > x and pngY + pngH > y:
+          self.lcd.png(pngInfo['filename'], pngX, pngY)
+
+  #a palette framebuf that ran out of colors gets a new palette, so clear before compiling
   def clear(self):
+    self.lcd.maybe_reset_palette()
     self.lcd.fill(self.lcd.black)
     self.clearPNG()
+    self.clearRetained()
 
   def clearFullLCD(self):
     self.lcd.fill_mem_blank()
     self.clearPNG()
+    self.clearRetained()
+
+  #forget the layout, widgets and frame on the screen, after something else is drawn over them
+  def clearRetained(self):
+    self.layout = None
+    self.widgets = {}
+    self.frame = None
 
   def clearPNG(self):
     self.pngInfosToShow = []
 
+  # draw markup, after filling the window with black if isClear
+  #   if isDiff, instead of clearing, erase and redraw only what changed since the last
+  #     markup drawn with isDiff, see drawMarkupDiff()
   def markup(self, markup, isClear=True, isShow=True,
+    x=0, y=0, size=5, color=None, hspace=1.0, vspace=1.0, isDiff=False
+  ):
+    if not isDiff and isClear and isShow and self.lcd.is_band_enabled():
+      self.drawBands(lambda: self.getCompiledMarkup(markup), x, y, size, color, hspace, vspace)
+      return
+
+    if isDiff:
+      self.drawMarkupDiff(markup, x, y, size, color, hspace, vspace)
+    else:
+      if isClear:
+        self.clear()
+      self.drawMarkup(markup, x, y, size, color, hspace, vspace)
+    if isShow:
+      self.show()
+
+  # draw markup over the last markup drawn with isDiff, without clearing the window
+  #   the markup is first measured op by op, to get the key and box of each draw op:
+  #     the op, the cursor it is drawn at, and the text of [var] or [rtc]
+  #   boxes of ops from the last frame that are not in this one are filled with black,
+  #     and only new ops, and unchanged ops that overlap erased/new boxes, are drawn
+  #   the rest of the ops only move the cursor, as when measuring
+  #   wrapped text that may be aligned cannot be measured op by op, so it is redrawn in full
+  def drawMarkupDiff(self, markup, x, y, size, color, hspace, vspace):
+    if not self.fontReady:
+      print("ERROR: no font loaded")
+      return
+
+    (prevFrame, self.frame) = (self.frame, None)
+    if prevFrame == None:
+      self.clear()
+    self.cursorSet(x, y, x, y, size, color, hspace, vspace)
+    ops = self.getCompiledMarkup(markup)
+    self.layout = None
+    self.clearPNG()
+
+    (isWrap, isAlign, isRTC) = (False, False, False)
+    for op in ops:
+      if op[0] == OP_CURSOR and op[1] == "wrap":
+        isWrap = True
+      elif op[0] == OP_CURSOR and op[1] == "align":
+        isAlign = True
+      elif op[0] == OP_RTC:
+        isRTC = True
+    if isWrap and isAlign:
+      self.clear()
+      self.drawMarkup(markup, x, y, size, color, hspace, vspace)
+      return
+
+    #both passes draw the same time
+    rtcEpoch = self.getRTCEpoch() if isRTC else None
+
+    self.cursorSet(x, y, x, y, size, color, hspace, vspace)
+    frame = self.newFrameState([], None)
+    state = self.newRenderState()
+    (state['rtcEpoch'], state['frame']) = (rtcEpoch, frame)
+    self.measureBox = [x, y, x, y]
+    try:
+      self.renderOps(ops, 0, len(ops), state)
+    finally:
+      self.measureBox = None
+    records = frame['records']
+
+    if prevFrame == None:
+      skipIdxs = set()
+    else:
+      (eraseBoxes, skipIdxs) = self.getFrameDiff(prevFrame, records)
+      for (boxX, boxY, boxW, boxH) in eraseBoxes:
+        self.lcd.fill_rect(boxX, boxY, boxW, boxH, self.lcd.black)
+
+    self.cursorSet(x, y, x, y, size, color, hspace, vspace)
+    state = self.newRenderState()
+    (state['rtcEpoch'], state['frame']) = (rtcEpoch, self.newFrameState(None, skipIdxs))
+    self.renderOps(ops, 0, len(ops), state)
+
+    self.frame = records
+
+  # renderOps() state for drawMarkupDiff(), either recording (key, box) of each draw op,
+  #   or skipping the draw ops at skipIdxs
+  def newFrameState(self, records, skipIdxs):
+    return {
+      "records": records,
+      "skipIdxs": skipIdxs,
+      #index of the current draw op
+      "opIdx": -1,
+      "key": None,
+      "isSkipping": False,
+    }
+
+  # called by renderOps() before each draw op of a frame
+  def frameOpStart(self, frame, op, rtcEpoch):
+    frame['opIdx'] += 1
+    (x, y) = (self.cursor['x'], self.cursor['y'])
+    if frame['records'] != None:
+      frame['key'] = self.getFrameOpKey(op, rtcEpoch)
+      self.measureBox = [x, y, x, y]
+    elif frame['opIdx'] in frame['skipIdxs']:
+      #measure instead of drawing, to move the cursor
+      self.measureBox = [x, y, x, y]
+      frame['isSkipping'] = True
+
+  # called by renderOps() after each op of a frame, and at the end
+  def frameOpEnd(self, frame):
+    if frame['key'] != None:
+      (minX, minY, maxX, maxY) = self.measureBox
+      key = frame['key']
+      if key[0][0] in (OP_TEXT, OP_VAR, OP_RTC) and maxX > minX:
+        #glyph blocks are drawn with their hspace+vspace, in the background color
+        size = key[3]
+        maxX += max(0, int(size * key[6]))
+        maxY += max(0, int(size * (self.fontHeight + key[7])) - size * self.fontHeight)
+      frame['records'].append((key, (minX, minY, maxX - minX, maxY - minY)))
+      frame['key'] = None
+    elif frame['isSkipping']:
+      self.measureBox = None
+      frame['isSkipping'] = False
+
+  # everything that changes how a draw op is drawn
+  def getFrameOpKey(self, op, rtcEpoch):
+    opCode = op[0]
+    if opCode == OP_VEC:
+      #array('h') is not hashable
+      op = (OP_VEC, op[1], op[2], bytes(op[3]))
+    elif opCode == OP_VAR:
+      op = (OP_VAR, self.vars.get(op[1], ""))
+    elif opCode == OP_RTC:
+      op = (OP_RTC, self.formatTime(op[1], rtcEpoch))
+    cursor = self.cursor
+    return (op, cursor['x'], cursor['y'], cursor['size'], cursor['color'], cursor['font'],
+      cursor['hspace'], cursor['vspace'], cursor['startX'], cursor['wrap'], cursor['bg'])
+
+  # boxes to erase, and indexes of draw ops to skip, from the (key, box) of two frames
+  #   an op is skipped if the last frame drew the same key, unless its box overlaps
+  #     an erased box or a box that is drawn, since drawing it again may overwrite it
+  #   framebuf PNGs are drawn on the LCD after each show(), so they are never skipped
+  def getFrameDiff(self, prevRecords, records):
+    prevKeyCounts = {}
+    for (key, box) in prevRecords:
+      prevKeyCounts[key] = prevKeyCounts.get(key, 0) + 1
+
+    isFramebuf = self.lcd.is_framebuf_enabled()
+    (dirtyBoxes, unchanged) = ([], [])
+    for opIdx in range(0, len(records)):
+      (key, box) = records[opIdx]
+      isPNG = key[0][0] == OP_PNG
+      if prevKeyCounts.get(key, 0) > 0 and not (isFramebuf and isPNG):
+        prevKeyCounts[key] -= 1
+        unchanged.append((opIdx, box))
+      else:
+        dirtyBoxes.append(box)
+
+    eraseBoxes = []
+    for (key, box) in prevRecords:
+      if prevKeyCounts.get(key, 0) > 0:
+        prevKeyCounts[key] -= 1
+        eraseBoxes.append(box)
+    dirtyBoxes += eraseBoxes
+
+    skipIdxs = set([opIdx for (opIdx, box) in unchanged])
+    isChanged = True
+    while isChanged:
+      isChanged = False
+      for (opIdx, box) in unchanged:
+        if opIdx in skipIdxs:
+          for dirtyBox in dirtyBoxes:
+            if self.isBoxOverlap(box, dirtyBox):
+              skipIdxs.remove(opIdx)
+              dirtyBoxes.append(box)
+              isChanged = True
+              break
+    return (eraseBoxes, skipIdxs)
+
+  def isBoxOverlap(self, box1, box2):
+    (x1, y1, w1, h1) = box1
+    (x2, y2, w2, h2) = box2
+    if w1 <= 0 or h1 <= 0 or w2 <= 0 or h2 <= 0:
+      return False
+    return x1 < x2 + w2 and x2 < x1 + w1 and y1 < y2 + h2 and y2 < y1 + h1
+
+  def markupChunks(self, chunks, isClear=True, isShow=True,
     x=0, y=0, size=5, color=None, hspace=1.0, vspace=1.0
   ):
+    if isClear and isShow and self.lcd.is_band_enabled():
+      #bands need all of the markup
+      markup = b"".join(chunks).decode("utf8")
+      self.drawBands(lambda: self.getCompiledMarkup(markup), x, y, size, color, hspace, vspace)
+      return
     if isClear:
       self.clear()
-    self.drawMarkup(markup, x, y, size, color, hspace, vspace)
+    self.drawMarkupChunks(chunks, x, y, size, color, hspace, vspace)
     if isShow:
       self.show()
 
+  # draw markup from UTF-8 byte chunks, e.g.: as they arrive on a socket
+  #   same as drawMarkup() with all the chunks joined,
+  #   but each part is drawn as soon as nothing after it can change how it is drawn
+  #   markup that arrives in a single chunk is compiled with the markup cache, as in drawMarkup()
+  def drawMarkupChunks(self, chunks, x, y, size, color, hspace, vspace):
+    if not self.fontReady:
+      print("ERROR: no font loaded")
+      return
+
+    self.cursorSet(x, y, x, y, size, color, hspace, vspace)
+    self.layout = None
+    self.frame = None
+    renderState = self.newRenderState()
+    prevCmds = []
+
+    (markup, utf8Tail) = ("", b"")
+    chunkIter = iter(chunks)
+    nextChunk = getNextOrNone(chunkIter)
+    isFirstChunk = True
+    while nextChunk != None:
+      chunk = nextChunk
+      nextChunk = getNextOrNone(chunkIter)
+      if isFirstChunk and nextChunk == None:
+        ops = self.getCompiledMarkup(chunk.decode("utf8"))
+        self.renderOps(ops, 0, len(ops), renderState)
+        return
+      isFirstChunk = False
+
+      data = utf8Tail + chunk
+      tailIdx = getUtf8TailIdx(data)
+      (data, utf8Tail) = (data[:tailIdx], data[tailIdx:])
+      markup += data.decode("utf8")
+
+      cut = self.getMarkupStreamCut(markup)
+      if cut > 0:
+        ops = self.compileMarkup(markup[:cut], prevCmds)
+        self.renderOps(ops, 0, len(ops), renderState)
+        markup = markup[cut:]
+
+    markup += utf8Tail.decode("utf8")
+    if len(markup) > 0:
+      ops = self.compileMarkup(markup, prevCmds)
+      self.renderOps(ops, 0, len(ops), renderState)
+
+  # length of the start of partial markup that can be drawn before the rest arrives
+  #   never splits a tag, or what is measured together:
+  #     [fit] up to its [/fit], a line that may be aligned, a word that may be wrapped,
+  #     or the text of an [id=NAME]
+  def getMarkupStreamCut(self, markup):
+    isAlignPossible = self.cursor['align'] != "left"
+    isWrapPossible = self.cursor['wrap']
+    (lineEnd, fitStart) = (0, -1)
+    #an [id=NAME] whose text may continue in the next chunk
+    (idStart, isIdText) = (-1, False)
+
+    markupLen = len(markup)
+    cut = markupLen
+    i = 0
+    while i < markupLen:
+      ch = markup[i]
+      if ch == "[":
+        if i+1 < markupLen and markup[i+1] == '[':
+          i += 2
+          continue
+        end = markup.find(']', i+1)
+        if end < 0:
+          #incomplete tag, or the first half of '[['
+          cut = i
+          break
+        cmd = markup[i+1:end].split("=", 1)[0].lower()
+        if cmd == "id":
+          (idStart, isIdText) = (i, False)
+        elif isIdText or cmd in ("bar", "png", "pnm"):
+          idStart = -1
+        if cmd == "fit" and fitStart < 0:
+          fitStart = i
+        elif cmd == "/fit":
+          fitStart = -1
+        elif cmd == "align":
+          isAlignPossible = True
+        elif cmd == "wrap":
+          isWrapPossible = True
+        elif cmd == "n" or cmd == "hline" or cmd == "hl" or cmd == "hr":
+          lineEnd = end+1
+        i = end+1
+      elif ch == "\n":
+        lineEnd = i+1
+        idStart = -1
+        i += 1
+      else:
+        isIdText = True
+        end = markup.find('[', i)
+        newlineIdx = markup.find('\n', i)
+        if end < 0 or 0 <= newlineIdx < end:
+          end = newlineIdx
+        if end < 0:
+          #text up to the end, only whole words if it may be wrapped
+          if isWrapPossible:
+            cut = markup.rfind(' ', i) + 1
+            if cut == 0:
+              cut = i
+          break
+        i = end
+
+    if isAlignPossible:
+      cut = min(cut, lineEnd)
+    if fitStart >= 0:
+      cut = min(cut, fitStart)
+    if idStart >= 0:
+      cut = min(cut, idStart)
+    return cut
+
+  # run markup() with lcd in place of the LCD, e.g.: a CostLCD that only counts the work
+  #   the dry run must not change any retained state of the real LCD:
+  #     PNGs waiting for show(), the layout, widgets, diff frame and graph history
+  def markupWithLCD(self, lcd, markup, isClear=True, isShow=True):
+    (savedLCD, savedPNGInfos) = (self.lcd, self.pngInfosToShow)
+    (savedLayout, savedWidgets) = (self.layout, self.widgets)
+    (savedFrame, savedGraphs) = (self.frame, self.graphs)
+    self.lcd = lcd
+    self.pngInfosToShow = []
+    self.widgets = {}
+    #graphs are drawn with their real history, but a resized [graph] replaces only the copy
+    self.graphs = dict(self.graphs)
+    try:
+      self.markup(markup, isClear=isClear, isShow=isShow)
+    finally:
+      (self.lcd, self.pngInfosToShow) = (savedLCD, savedPNGInfos)
+      (self.layout, self.widgets) = (savedLayout, savedWidgets)
+      (self.frame, self.graphs) = (savedFrame, savedGraphs)
+
+  def displayList(self, data, isClear=True, isShow=True,
+    x=0, y=0, size=5, color=None, hspace=1.0, vspace=1.0
+  ):
+    if isClear and isShow and self.lcd.is_band_enabled():
+      self.drawBands(lambda: self.decodeDisplayList(data), x, y, size, color, hspace, vspace)
+      return
+    if isClear:
+      self.clear()
+    self.drawDisplayList(data, x, y, size, color, hspace, vspace)
+    if isShow:
+      self.show()
+
+  # draw a binary display list, same as drawMarkup() with the markup it was compiled from
+  def drawDisplayList(self, data, x, y, size, color, hspace, vspace):
+    if not self.fontReady:
+      print("ERROR: no font loaded")
+      return
+
+    self.cursorSet(x, y, x, y, size, color, hspace, vspace)
+    self.layout = None
+    self.frame = None
+    ops = self.decodeDisplayList(data)
+    self.renderOps(ops, 0, len(ops))
+
+  # clear, draw and show the ops from getOps() one band of rows at a time,
+  #   instead of directly on the LCD, when the framebuf is off
+  #   each band is cleared and drawn in a small framebuf, clipped to the band, and then shown
+  #     so nothing is visible before it is completely drawn
+  #   the ops are drawn once per band, and [rtc] shows the same time in every band
+  #   PNGs are drawn directly on the LCD after the last band
+  def drawBands(self, getOps, x, y, size, color, hspace, vspace):
+    if not self.fontReady:
+      print("ERROR: no font loaded")
+      return
+
+    self.clearRetained()
+    self.cursorSet(x, y, x, y, size, color, hspace, vspace)
+    ops = getOps()
+    rtcEpoch = None
+    for op in ops:
+      if op[0] == OP_RTC:
+        rtcEpoch = self.getRTCEpoch()
+        break
+
+    lcdH = self.lcd.get_lcd_rotated_height()
+    try:
+      for bandY in range(0, lcdH, self.lcd.get_framebuf_conf().bandH):
+        self.lcd.start_band(bandY)
+        self.lcd.fill(self.lcd.black)
+        #the PNGs are the same in every band
+        self.clearPNG()
+        self.cursorSet(x, y, x, y, size, color, hspace, vspace)
+        state = self.newRenderState()
+        state['rtcEpoch'] = rtcEpoch
+        self.renderOps(ops, 0, len(ops), state)
+        self.lcd.show()
+    finally:
+      self.lcd.end_bands()
+
+    for pngInfo in self.pngInfosToShow:
+      self.lcd.png(pngInfo['filename'], pngInfo['x'], pngInfo['y'])
+    self.clearPNG()
+
   def drawMarkup(self, markup, x, y, size, color, hspace, vspace):
     #  ### MARKUP_SYNTAX ###
     #  markup syntax is:
     #    [CURSOR_CMD=VAL]
-    #      CURSOR_CMD = color|size|x|y|hspace|vspace
+    #      CURSOR_CMD = color|bg|size|x|y|hspace|vspace|font|align|wrap
     #        [color=<COLOR>]
     #          set the cursor color to COLOR
     #          COLOR = either a NAMED_COLOR or a HEX_COLOR
     #          NAMED_COLOR = one of white black red green blue cyan magenta yellow aqua purple
     #          HEX_COLOR   = rgb hex color formatted '#RRGGBB' e.g.: '#C0C0C0'
+    #        [bg=<COLOR>]
+    #          fill the cell of each char, including its hspace/vspace gap, with COLOR
+    #            -COLOR is formatted as in [color=<COLOR>]
+    #            -by default, chars are transparent, and only their dots are drawn
+    #            -use [bg=prev] to make chars transparent again
     #        [size=<SIZE>]
     #          set the pixels-per-dot to SIZE
     #          for 5x8 font, font size in px is: 8*SIZE
@@ -299,9 +1505,47 @@ class LcdFont:
     #          leave floor(VSPACE*SIZE) dots between lines
     #            any non-negative number, 1.0=default, 0=no space, 2.0=wide
     #            for 5x8 font, total height of a line in px is: SIZE*(8+VSPACE)
+    #        [font=<FONT_FILE>]
+    #          draw chars with the font at FONT_FILE, already present in the filesystem
+    #            -default is font5x8.bin, a fixed-width 5x8 font of the first 256 codepoints
+    #            -chars not in the font are drawn as '?'
+    #            -SIZE is still pixels-per-dot of the font, and HSPACE/VSPACE are still in dots
+    #            -create fonts with the font-compiler script from BDF/TTF/OTF fonts
+    #              pre-rendered at a given px height, with proportional advance widths,
+    #              and use them at [size=1][hspace=0][vspace=0] for crisp text
+    #            -if FONT_FILE cannot be loaded, the font is not changed
+    #          e.g.: [font=dejavu-16x19.bin][size=1][hspace=0][vspace=0]café 中文
+    #        [font=mod:<MODULE_NAME>]
+    #          draw chars with the st7789 font module MODULE_NAME, frozen into the firmware
+    #            -either a bitmap font (WIDTH/HEIGHT/FIRST/LAST/FONT) for st7789 text(),
+    #             or a 1-bit proportional font (MAP/WIDTHS/OFFSETS/BITMAPS) for st7789 write()
+    #            -with framebuf=off and SIZE=1, text is drawn natively by the LCD driver,
+    #               one call per line (or one per char, if floor(HSPACE) is not 0)
+    #               -bitmap fonts are only drawn natively for ASCII text
+    #               -text that does not fit on the LCD, or has chars not in the font,
+    #                 is drawn one char at a time instead, as with FONT_FILE
+    #          e.g.: [font=mod:vga1_8x16][size=1][hspace=0]fast text
+    #        [align=<ALIGN>]
+    #          horizontally align each following line, until the next [align=<ALIGN>]
+    #            ALIGN = left | center | right
+    #              left   = start each line at the left of the window (default)
+    #              right  = move the cursor right, so the line ends at the right of the window
+    #              center = move the cursor right, halfway to where 'right' would
+    #            -applies to the rest of the current line, and each line after it
+    #            -the line is measured first, as in the 'measure' command
+    #          e.g.: [align=center][size=4]TITLE[n][align=left][size=2]body text
+    #        [wrap=<WRAP>]
+    #          if WRAP is 'true' or '1' or 'y', break text into lines that fit in the window
+    #            -lines break at the last space that fits, which is not drawn
+    #            -words wider than the window are split between lines
+    #            -each new line starts at the left of the window, as in [n]
+    #            -markup commands are also word boundaries,
+    #               e.g.: a word after [color=red] may start on the next line
+    #          if WRAP is 'false' or '0' or 'n', text runs past the right of the window (default)
+    #          e.g.: [wrap=y][size=3]a long log line that is broken into words
     #
     #    [CURSOR_CMD=prev]
-    #      CURSOR_CMD = color|size|x|y|hspace|vspace
+    #      CURSOR_CMD = color|bg|size|x|y|hspace|vspace|font|align|wrap
     #        if VAL is 'prev', restore the value of CURSOR_CMD before the last change
     #        e.g.:   [color=white] A [color=blue] B [color=prev] C
     #                  is the same as:
@@ -495,6 +1739,36 @@ class LcdFont:
     #       add <H> to <CURSOR_Y> (move the cursor <Y> pixels down, negative <H> for up)
     #       e.g.: [shift=0x-20]    move the cursor up 20 pixels
     #
+    #    [graph=<ID>,<W>x<H>,<MIN>,<MAX>,<COLOR>]
+    #    [graph=<ID>,<W>,<H>,<MIN>,<MAX>,<COLOR>]
+    #       draw the recent samples of the graph <ID>, one column per sample, newest on the right
+    #         ID    = name of the graph, for the 'push' command
+    #         W     = the width of the graph in pixels, and the number of samples kept
+    #         H     = the height of the graph in pixels
+    #         MIN   = the *integer* sample value at the bottom of the graph
+    #         MAX   = the *integer* sample value at the top of the graph
+    #         COLOR = the color of the columns, or the cursor color if empty
+    #       -each column is filled from the bottom, up to the height of its sample
+    #       -the samples are kept on the device, until the graph is drawn with a different <W>
+    #       -'push' adds samples, and scrolls the graph on the screen without redrawing it
+    #       -move the cursor right <W> pixels
+    #       e.g.: [graph=cpu,100x20,0,100,green]
+    #
+    #    [vec=<MODE>,<COLOR>,<BASE64>]
+    #       draw lines or a polygon through packed int16 X,Y coordinates, relative to the cursor
+    #         MODE   = one of:
+    #                    lines     separate line segments, 4 values each: X1,Y1,X2,Y2
+    #                    polyline  an open path through all the points
+    #                    poly      a closed polygon outline
+    #                    fill      a filled polygon
+    #         COLOR  = the color of the lines, or the cursor color if empty
+    #         BASE64 = base64 of little-endian int16 values: X1,Y1,X2,Y2,...
+    #                  without the trailing '=' padding
+    #       -the coordinates are decoded once, when the markup is compiled,
+    #          and drawn with framebuf/st7789 line and polygon primitives
+    #       -move the cursor right to the rightmost X
+    #       e.g.: [vec=fill,red,AAAKAAoACgAFAAAA]   (triangle 0,10 10,10 5,0)
+    #
     #    [rtc=FORMAT]
     #        use time from DS3231 rtc clock (if supported) and format with FORMAT string
     #        NOTE: all [rtc=FORMAT] entries in markup share a single epoch time,
@@ -513,6 +1787,19 @@ class LcdFont:
     #          %a   abbreviated day of week Mon/Tue/Wed/Thu/Fri/Sat/Sun
     #          %b   abbreviated month Jan/Feb/Mar/Apr/May/Jun/Jul/Aug/Sep/Oct/Nov/Dec
     #          %%   literal '%' character
+    #    [var=NAME]
+    #        draw the value of the variable NAME as text, or nothing if it is not set
+    #          -variables are set with the 'set' command, or by the device for templates
+    #          -the value is plain text, markup in it is drawn literally
+    #          -in a layout, setting a variable redraws only the lines that show it
+    #    [id=NAME]
+    #        name the next text, [bar], [png] or [pnm], so the 'update' command can redraw it
+    #          -text is everything up to the next markup tag or newline
+    #          -the device keeps the position and bounding box of each named element
+    #            until the screen is cleared
+    #          -an update erases and redraws only that element, and in framebuf mode,
+    #            writes only that part of the framebuf to the LCD
+    #          -updated text is drawn at the same position, without re-aligning or wrapping
     #    [n]
     #        treated the same as a newline literal
     #          moves the cursor down (8+vspace)*size px,
@@ -526,7 +1813,19 @@ class LcdFont:
     #        literal '[' character
     #    [show]
     #        show the current framebuf before processing any more markup
-    #        (no effect if framebuf is not set)
+    #        (no effect if framebuf is not set, ignored in band mode)
+    #    [fit]
+    #        set SIZE to the largest size at which all markup up to the next [/fit]
+    #          (or the end of the markup) fits in the window, starting at the cursor
+    #        -the markup is measured at each SIZE, as in the 'measure' command
+    #        -SIZE is 1 if the markup does not fit at any size
+    #        -[size=<SIZE>] inside the block overrides the fit size
+    #    [/fit]
+    #        restore SIZE to the value before the matching [fit]
+    #      e.g.: [fit]ALERT[n]disk full[/fit][n]details
+    #
+    #  NOTE: with framebuf=off, SIZE less than 8, and [bg=<COLOR>],
+    #        each character is written to the LCD as a single block, which is much faster
     #  e.g.:
     #      hello[n][size=6][color=red]world[[]]
     #        looks similar to the following HTML:
@@ -538,10 +1837,248 @@ class LcdFont:
       return
 
     self.cursorSet(x, y, x, y, size, color, hspace, vspace)
-    prevVals = {}
+    self.layout = None
+    self.frame = None
+    self.renderMarkup(markup)
 
-    #calculate once, but only if [rtc] command present
-    rtcEpoch = None
+  # draw named markup in full, as in markup(), keeping the cursor at the start of each line
+  #   so that setLayoutVars() can redraw just the lines that show the vars it changes
+  #   lines that may wrap, or are inside [fit], are redrawn with the entire layout
+  def drawLayout(self, name, markup, isClear=True, isShow=True):
+    if not self.fontReady:
+      print("ERROR: no font loaded")
+      return
+
+    if isClear:
+      self.clear()
+    self.frame = None
+    self.cursorSet(0, 0, 0, 0, 5, None, 1.0, 1.0)
+    ops = self.getCompiledMarkup(markup)
+
+    #the ops of each line, ending with its [n] or [hr]
+    lines = []
+    lineStart = 0
+    for opIdx in range(0, len(ops)):
+      if ops[opIdx][0] == OP_NEWLINE or ops[opIdx][0] == OP_HLINE:
+        lines.append((lineStart, opIdx+1))
+        lineStart = opIdx+1
+    lines.append((lineStart, len(ops)))
+
+    fitRanges = [(opIdx, op[1]) for (opIdx, op) in enumerate(ops) if op[0] == OP_FIT]
+    isWrapUsed = False
+    for op in ops:
+      if op[0] == OP_CURSOR and op[1] == "wrap":
+        isWrapUsed = True
+
+    varLineIdxs = {}
+    fullRedrawVars = []
+    for lineIdx in range(0, len(lines)):
+      (start, end) = lines[lineIdx]
+      for opIdx in range(start, end):
+        if ops[opIdx][0] != OP_VAR:
+          continue
+        varName = ops[opIdx][1]
+        isInFit = False
+        for (fitStart, fitEnd) in fitRanges:
+          if fitStart < opIdx < fitEnd:
+            isInFit = True
+        if isWrapUsed or isInFit:
+          fullRedrawVars.append(varName)
+        elif varName in varLineIdxs:
+          varLineIdxs[varName].append(lineIdx)
+        else:
+          varLineIdxs[varName] = [lineIdx]
+
+    state = self.newRenderState()
+    snapshots = []
+    for (start, end) in lines:
+      snapshots.append(self.getRenderSnapshot(state))
+      self.renderOps(ops, start, end, state)
+
+    self.layout = {
+      "name": name,
+      "markup": markup,
+      "ops": ops,
+      "lines": lines,
+      "snapshots": snapshots,
+      "varLineIdxs": varLineIdxs,
+      "fullRedrawVars": fullRedrawVars,
+    }
+
+    if isShow:
+      self.show()
+
+  # set [var=NAME] values, and redraw the lines of the current layout that show them
+  #   returns the number of lines redrawn, or -1 if the entire layout was redrawn
+  def setLayoutVars(self, keyVals, isShow=True):
+    layout = self.layout
+    changedVars = [key for key in keyVals if self.vars.get(key, None) != keyVals[key]]
+    if layout == None:
+      self.vars.update(keyVals)
+      return 0
+
+    for varName in changedVars:
+      if varName in layout['fullRedrawVars']:
+        self.vars.update(keyVals)
+        self.drawLayout(layout['name'], layout['markup'], isShow=isShow)
+        return -1
+
+    lineIdxs = []
+    for varName in changedVars:
+      for lineIdx in layout['varLineIdxs'].get(varName, []):
+        if lineIdx not in lineIdxs:
+          lineIdxs.append(lineIdx)
+    lineIdxs.sort()
+
+    (ops, lines, snapshots) = (layout['ops'], layout['lines'], layout['snapshots'])
+    (winW, winH) = self.lcd.get_target_window_size()
+
+    #measure each line with the old values, to erase it
+    oldBoxes = []
+    for lineIdx in lineIdxs:
+      (start, end) = lines[lineIdx]
+      self.restoreRenderSnapshot(snapshots[lineIdx])
+      (x, y, w, h) = self.measureOpsAtCursor(ops, start, end)
+      isAligned = self.cursor['align'] != "left"
+      for opIdx in range(start, end):
+        if ops[opIdx][0] == OP_CURSOR and ops[opIdx][1] == "align":
+          isAligned = True
+      if isAligned:
+        #measuring ignores align, so erase the entire width of the line
+        (x, w) = (self.cursor['startX'], winW - self.cursor['startX'])
+      oldBoxes.append((x, y, w, h))
+
+    self.vars.update(keyVals)
+
+    for i in range(0, len(lineIdxs)):
+      (start, end) = lines[lineIdxs[i]]
+      (x, y, w, h) = oldBoxes[i]
+      self.lcd.fill_rect(x, y, w, h, self.lcd.black)
+      state = self.restoreRenderSnapshot(snapshots[lineIdxs[i]])
+      self.renderOps(ops, start, end, state)
+
+    if isShow and len(lineIdxs) > 0:
+      self.show()
+    return len(lineIdxs)
+
+  def getLayoutName(self):
+    if self.layout == None:
+      return None
+    return self.layout['name']
+
+  # copy of the cursor, font and render state, at the start of a layout line
+  def getRenderSnapshot(self, state):
+    return (self.cursor.copy(), {
+      "prevVals": state['prevVals'].copy(),
+      "rtcEpoch": None,
+      "isAlignNeeded": state['isAlignNeeded'],
+      "fitPrevSizes": list(state['fitPrevSizes']),
+      "widgetId": state['widgetId'],
+      "frame": None,
+    })
+
+  # restore the cursor and font from getRenderSnapshot(), and return a copy of its state
+  def restoreRenderSnapshot(self, snapshot):
+    (cursor, state) = snapshot
+    self.cursor = cursor.copy()
+    self.selectFont(self.cursor['font'])
+    return {
+      "prevVals": state['prevVals'].copy(),
+      "rtcEpoch": None,
+      "isAlignNeeded": state['isAlignNeeded'],
+      "fitPrevSizes": list(state['fitPrevSizes']),
+      "widgetId": state['widgetId'],
+      "frame": None,
+    }
+
+  # bounding box (x, y, w, h) in px of everything in the markup, without drawing anything
+  #   chars are SIZE*fontWidth x SIZE*fontHeight, without HSPACE/VSPACE
+  #   images are measured by their headers, and [align=<ALIGN>] is ignored
+  def measureMarkup(self, markup, x=0, y=0, size=5, color=None, hspace=1.0, vspace=1.0):
+    if not self.fontReady:
+      print("ERROR: no font loaded")
+      return (x, y, 0, 0)
+
+    self.cursorSet(x, y, x, y, size, color, hspace, vspace)
+    ops = self.getCompiledMarkup(markup)
+    return self.measureOpsAtCursor(ops, 0, len(ops))
+
+  # measure ops[start:end] starting at the current cursor, and then restore the cursor
+  #   if isLineOnly, stop at the first newline
+  #   leadText is measured before the ops, e.g.: the rest of a wrapped text op
+  def measureOpsAtCursor(self, ops, start, end, isLineOnly=False, leadText=None):
+    savedCursor = self.cursor.copy()
+    savedFontName = self.fontName
+    savedMeasure = (self.measureBox, self.isMeasureLine, self.isMeasureDone)
+
+    (x, y) = (self.cursor['x'], self.cursor['y'])
+    self.measureBox = [x, y, x, y]
+    self.isMeasureLine = isLineOnly
+    self.isMeasureDone = False
+    try:
+      if leadText != None:
+        self.cursorDrawText(leadText)
+      self.renderOps(ops, start, end)
+      (minX, minY, maxX, maxY) = self.measureBox
+    finally:
+      self.cursor = savedCursor
+      self.selectFont(savedFontName)
+      (self.measureBox, self.isMeasureLine, self.isMeasureDone) = savedMeasure
+    return (minX, minY, maxX - minX, maxY - minY)
+
+  # the largest SIZE at which ops[start:end], drawn at the cursor, fit in the window
+  #   or 1 if they do not fit at any SIZE
+  def getFitSize(self, ops, start, end):
+    (winW, winH) = self.lcd.get_target_window_size()
+    savedSize = self.cursor['size']
+    (lo, hi) = (1, max(1, winH // self.fontHeight))
+    while lo < hi:
+      mid = (lo + hi + 1) // 2
+      self.cursor['size'] = mid
+      (x, y, w, h) = self.measureOpsAtCursor(ops, start, end)
+      if x + w <= winW and y + h <= winH:
+        lo = mid
+      else:
+        hi = mid - 1
+    self.cursor['size'] = savedSize
+    return lo
+
+  def measureAdd(self, x, y, w, h):
+    if w <= 0 or h <= 0:
+      return
+    box = self.measureBox
+    box[0] = min(box[0], x)
+    box[1] = min(box[1], y)
+    box[2] = max(box[2], x + w)
+    box[3] = max(box[3], y + h)
+
+  # draw markup starting at the current cursor
+  def renderMarkup(self, markup):
+    ops = self.getCompiledMarkup(markup)
+    self.renderOps(ops, 0, len(ops))
+
+  # compiled ops for the markup, from the cache if it was compiled before
+  #   colors depend on the color profile, its byte order and the palette, so they are part of the key
+  def getCompiledMarkup(self, markup):
+    key = (markup, self.lcd.colorProfile, self.lcd.isColorProfileBigEndian, self.lcd.paletteGen)
+    ops = self.markupCache.get(key)
+    if ops == None:
+      ops = self.compileMarkup(markup)
+      self.markupCache.put(key, ops, 2*len(markup) + MARKUP_OP_BYTES*len(ops))
+    return ops
+
+  # parse markup into a list of ops, tuples of (OP_<NAME>, ARG, ARG, ...)
+  #   ints, bools and colors are parsed once here,
+  #   fonts, images and [rtc] are read when the ops are rendered
+  #   prevCmds carries over between calls for the same markup, e.g.: when streaming
+  def compileMarkup(self, markup, prevCmds=None):
+    ops = []
+
+    #[fit] ops that are waiting for their [/fit]
+    openFitOpIdxs = []
+    #cursor cmds that have a value for [CMD=prev]
+    if prevCmds == None:
+      prevCmds = []
 
     markupLen = len(markup)
 
@@ -569,40 +2106,26 @@ class LcdFont:
         if len(cmdVal) == 2:
           val = cmdVal[1]
 
-        maxArgCounts = {
-          "rect"    :4,
-          "ellipse" :4,
-          "bar"     :5,
-          "shift"   :2,
-          "pnm"     :2,
-        }
-        pointArgCmdNames = [
-          "rect",
-          "ellipse",
-          "bar",
-          "shift",
-        ]
-
         valArgList = []
-        if cmd in maxArgCounts:
-          valArgList = val.split(",", maxArgCounts[cmd]-1)
+        if cmd in MARKUP_MAX_ARG_COUNTS:
+          valArgList = val.split(",", MARKUP_MAX_ARG_COUNTS[cmd]-1)
 
-          if cmd in pointArgCmdNames and "x" in valArgList[0]:
+          if cmd in MARKUP_POINT_ARG_CMDS and "x" in valArgList[0]:
             #allow <X>x<Y> syntax instead of <X>,<Y> for first arg
             val = val.replace("x", ",", 1)
-            valArgList = val.split(",", maxArgCounts[cmd]-1)
+            valArgList = val.split(",", MARKUP_MAX_ARG_COUNTS[cmd]-1)
 
         if cmd == "bracket":
           # literal '[', either '[bracket]' or '[['
-          self.cursorDrawChar('[')
+          self.appendTextOp(ops, '[')
         elif cmd == "n":
           # '[n]' => newline
-          self.cursorNewLine()
+          ops.append((OP_NEWLINE,))
         elif cmd == "hline" or cmd == "hl" or cmd == "hr":
           # '[hr]' => hline
-          self.cursorHline()
+          ops.append((OP_HLINE,))
         elif cmd == "png":
-          self.cursorDrawPNG(val)
+          ops.append((OP_PNG, val))
         elif cmd == "pnm":
           if len(valArgList) == 1:
             scale = 1
@@ -610,7 +2133,7 @@ class LcdFont:
           elif len(valArgList) == 2:
             scale = self.maybeReadInt(valArgList[0], 1)
             filename = valArgList[1]
-          self.cursorDrawPNM(filename, scale)
+          ops.append((OP_PNM, filename, scale))
         elif cmd == "rect":
           (w, h, isFill, isSymbol) = (0, 0, True, False)
           if len(valArgList) >= 2:
@@ -620,16 +2143,9 @@ class LcdFont:
             isFill = self.maybeReadBool(valArgList[2], True)
           if len(valArgList) >= 4:
             isSymbol = self.maybeReadBool(valArgList[3], True)
-
-          if isSymbol:
-            w = w * self.cursor['size']
-            h = h * self.cursor['size']
-          self.cursorDrawRect(w, h, isFill)
-          if isSymbol:
-            self.cursorIndentHspace()
+          ops.append((OP_RECT, w, h, isFill, isSymbol))
         elif cmd == "ellipse":
           (radX, radY, isFill, isSymbol) = (0, 0, True, False)
-
           if len(valArgList) >= 2:
             radX = self.maybeReadFloat(valArgList[0], 0)
             radY = self.maybeReadFloat(valArgList[1], 0)
@@ -637,61 +2153,532 @@ class LcdFont:
             isFill = self.maybeReadBool(valArgList[2], True)
           if len(valArgList) >= 4:
             isSymbol = self.maybeReadBool(valArgList[3], False)
-
-          if isSymbol:
-            radX = (radX*2+1) * self.cursor['size'] / 2
-            radY = (radY*2+1) * self.cursor['size'] / 2
-          (radX, radY) = (int(radX), int(radY))
-          self.cursorDrawEllipse(radX, radY, isFill)
-          if isSymbol:
-            self.cursorIndentHspace()
+          ops.append((OP_ELLIPSE, radX, radY, isFill, isSymbol))
         elif cmd == "shift":
           (x, y) = (0, 0)
           if len(valArgList) == 2:
             x = self.maybeReadInt(valArgList[0], 0)
             y = self.maybeReadInt(valArgList[1], 0)
-          self.cursor['x'] += x
-          self.cursor['y'] += y
+          ops.append((OP_SHIFT, x, y))
         elif cmd == "bar":
           (w, h, pct, fillColor, emptyColor) = (0,0,0,None,None)
-
           if len(valArgList) == 5:
             w = self.maybeReadInt(valArgList[0], 0)
             h = self.maybeReadInt(valArgList[1], 0)
             pct = self.maybeReadInt(valArgList[2], 0)
             fillColor = self.maybeReadColor(valArgList[3], None)
             emptyColor = self.maybeReadColor(valArgList[4], None)
-
-          self.cursorDrawBar(w, h, pct, fillColor, emptyColor)
+          ops.append((OP_BAR, w, h, pct, fillColor, emptyColor))
         elif cmd == "rtc":
-          if rtcEpoch == None:
-            if self.rtc == None:
-              print("WARNING: external rtc epoch not available, using system rtc\n")
-              rtcEpoch = time.time()
+          ops.append((OP_RTC, val))
+        elif cmd == "var":
+          ops.append((OP_VAR, val))
+        elif cmd == "id":
+          ops.append((OP_ID, val))
+        elif cmd == "vec":
+          (mode, color, coords) = ("lines", None, array('h'))
+          if len(valArgList) == 3:
+            if valArgList[0] in VEC_MODES:
+              mode = valArgList[0]
             else:
-              rtcEpoch = self.rtc.getTimeEpochPlusTZOffset()
-          self.cursorDrawText(self.formatTime(val, rtcEpoch))
+              print("WARNING: invalid vec mode " + valArgList[0])
+            if valArgList[1] != "":
+              color = self.maybeReadColor(valArgList[1], None)
+            #'=' padding cannot be used in markup, so it is added back here
+            b64 = valArgList[2] + "=" * (-len(valArgList[2]) % 4)
+            try:
+              coords = self.unpackVecCoords(ubinascii.a2b_base64(b64))
+            except Exception as e:
+              print("WARNING: invalid vec base64 coordinates\n" + str(e))
+          ops.append((OP_VEC, mode, color, coords, self.getVecBounds(coords)))
+        elif cmd == "graph":
+          (graphId, w, h, minVal, maxVal, color) = ("", 0, 0, 0, 100, None)
+          if len(valArgList) == 5 and "x" in valArgList[1]:
+            #allow <W>x<H> syntax instead of <W>,<H> for second arg
+            valArgList = [valArgList[0]] + valArgList[1].split("x", 1) + valArgList[2:]
+          if len(valArgList) == 6:
+            graphId = valArgList[0]
+            w = self.maybeReadInt(valArgList[1], 0)
+            h = self.maybeReadInt(valArgList[2], 0)
+            minVal = self.maybeReadInt(valArgList[3], 0)
+            maxVal = self.maybeReadInt(valArgList[4], 100)
+            if valArgList[5] != "":
+              color = self.maybeReadColor(valArgList[5], None)
+          ops.append((OP_GRAPH, graphId, w, h, minVal, maxVal, color))
         elif cmd == "show":
-          self.show()
+          ops.append((OP_SHOW,))
+        elif cmd == "fit":
+          #the end of the [fit] is set at the next [/fit]
+          openFitOpIdxs.append(len(ops))
+          ops.append((OP_FIT, None))
+        elif cmd == "/fit":
+          if len(openFitOpIdxs) > 0:
+            for fitOpIdx in openFitOpIdxs:
+              ops[fitOpIdx] = (OP_FIT, len(ops))
+            openFitOpIdxs = []
+            ops.append((OP_FIT_END,))
+          else:
+            print("WARNING: ignoring '[/fit]' without '[fit]'\n" + markup)
         elif cmd in self.cursor and len(val) > 0:
           # '[CMD=VAL]' => manipulate cursor without drawing anything
           if val == "prev":
-            if cmd in prevVals:
-              self.cursor[cmd] = prevVals[cmd]
+            if cmd in prevCmds:
+              ops.append((OP_CURSOR_PREV, cmd))
             else:
               print("WARNING: ignoring 'prev' value without previous value\n" + markup)
           else:
-            prevVals[cmd] = self.cursor[cmd]
-            self.cursor[cmd] = self.maybeReadCmdVal(cmd, val, self.cursor[cmd])
+            if cmd not in prevCmds:
+              prevCmds.append(cmd)
+            if cmd == "font":
+              #fonts are loaded when the op is rendered
+              (cursorVal, valStr) = (None, val)
+            else:
+              (cursorVal, valStr) = (self.maybeReadCmdVal(cmd, val, None), None)
+            ops.append((OP_CURSOR, cmd, cursorVal, valStr))
         else:
           # unknown command, just draw the full markup segment
           print("WARNING: invalid markup (unknown command)\n" + markup)
-          self.cursorDrawText('[' + cmdValStr + ']')
+          self.appendTextOp(ops, '[' + cmdValStr + ']')
 
         i = end+1 #skip '[CMDVALSTR]'
       elif ch == "\n":
-        self.cursorNewLine()
+        ops.append((OP_NEWLINE,))
         i += 1
       else:
-        self.cursorDrawChar(ch)
+        #all text up to the next '[' or newline at once
+        end = markup.find('[', i)
+        if end < 0:
+          end = markupLen
+        newlineIdx = markup.find('\n', i, end)
+        if newlineIdx >= 0:
+          end = newlineIdx
+        self.appendTextOp(ops, markup[i:end])
+        i = end
+
+    for fitOpIdx in openFitOpIdxs:
+      ops[fitOpIdx] = (OP_FIT, len(ops))
+
+    return ops
+
+  # append text to the previous op if it is text, e.g.: 'a[[b' is one text op
+  def appendTextOp(self, ops, text):
+    if len(ops) > 0 and ops[-1][0] == OP_TEXT:
+      ops[-1] = (OP_TEXT, ops[-1][1] + text)
+    else:
+      ops.append((OP_TEXT, text))
+
+  # draw ops[start:end] starting at the current cursor
+  #   state is from newRenderState(), to continue from a previous call, e.g.: when streaming
+  def renderOps(self, ops, start, end, state=None):
+    if state == None:
+      state = self.newRenderState()
+    prevVals = state['prevVals']
+    rtcEpoch = state['rtcEpoch']
+    isAlignNeeded = state['isAlignNeeded']
+    fitPrevSizes = state['fitPrevSizes']
+    widgetId = state['widgetId']
+    frame = state['frame']
+
+    for opIdx in range(start, end):
+      if self.isMeasureDone:
+        break
+
+      op = ops[opIdx]
+      opCode = op[0]
+
+      if frame != None:
+        self.frameOpEnd(frame)
+
+      if isAlignNeeded and opCode not in NON_DRAWING_OPS:
+        #a frame is aligned as drawn, even while it is measured op by op
+        if self.measureBox == None or frame != None:
+          self.cursorAlignLine(ops, opIdx)
+        isAlignNeeded = False
+
+      if widgetId != None and opCode in WIDGET_OPS:
+        if self.measureBox == None:
+          self.addWidget(widgetId, op)
+        widgetId = None
+
+      if frame != None and (opCode not in NON_DRAWING_OPS or opCode == OP_HLINE):
+        self.frameOpStart(frame, op, rtcEpoch)
+
+      if opCode == OP_TEXT:
+        self.cursorDrawText(op[1], ops, opIdx+1)
+      elif opCode == OP_ID:
+        widgetId = op[1]
+      elif opCode == OP_CURSOR:
+        (cmd, val) = (op[1], op[2])
+        prevVals[cmd] = self.cursor[cmd]
+        if cmd == "font":
+          self.cursor[cmd] = self.maybeReadCmdVal(cmd, op[3], self.cursor[cmd])
+          self.selectFont(self.cursor['font'])
+        elif val != None:
+          self.cursor[cmd] = val
+        if cmd == "align":
+          isAlignNeeded = True
+      elif opCode == OP_CURSOR_PREV:
+        cmd = op[1]
+        if cmd in prevVals:
+          self.cursor[cmd] = prevVals[cmd]
+        if cmd == "font":
+          self.selectFont(self.cursor['font'])
+        elif cmd == "align":
+          isAlignNeeded = True
+      elif opCode == OP_NEWLINE:
+        self.cursorNewLine()
+        isAlignNeeded = True
+      elif opCode == OP_HLINE:
+        self.cursorHline()
+        isAlignNeeded = True
+      elif opCode == OP_PNG:
+        self.cursorDrawPNG(op[1])
+      elif opCode == OP_PNM:
+        self.cursorDrawPNM(op[1], op[2])
+      elif opCode == OP_RECT:
+        (w, h, isFill, isSymbol) = op[1:]
+        if isSymbol:
+          w = w * self.cursor['size']
+          h = h * self.cursor['size']
+        self.cursorDrawRect(w, h, isFill)
+        if isSymbol:
+          self.cursorIndentHspace()
+      elif opCode == OP_ELLIPSE:
+        (radX, radY, isFill, isSymbol) = op[1:]
+        if isSymbol:
+          radX = (radX*2+1) * self.cursor['size'] / 2
+          radY = (radY*2+1) * self.cursor['size'] / 2
+        (radX, radY) = (int(radX), int(radY))
+        self.cursorDrawEllipse(radX, radY, isFill)
+        if isSymbol:
+          self.cursorIndentHspace()
+      elif opCode == OP_SHIFT:
+        self.cursor['x'] += op[1]
+        self.cursor['y'] += op[2]
+      elif opCode == OP_BAR:
+        (w, h, pct, fillColor, emptyColor) = op[1:]
+        self.cursorDrawBar(w, h, pct, fillColor, emptyColor)
+      elif opCode == OP_GRAPH:
+        self.cursorDrawGraph(op[1], op[2], op[3], op[4], op[5], op[6])
+      elif opCode == OP_VEC:
+        self.cursorDrawVec(op[1], op[2], op[3], op[4])
+      elif opCode == OP_RTC:
+        if rtcEpoch == None:
+          rtcEpoch = self.getRTCEpoch()
+        self.cursorDrawText(self.formatTime(op[1], rtcEpoch), ops, opIdx+1)
+      elif opCode == OP_VAR:
+        self.cursorDrawText(self.vars.get(op[1], ""), ops, opIdx+1)
+      elif opCode == OP_SHOW:
+        #a band is drawn in full and written to the LCD once, by drawBands()
+        if self.measureBox == None and not self.lcd.is_band_active():
+          self.show()
+      elif opCode == OP_FIT:
+        fitPrevSizes.append(self.cursor['size'])
+        self.cursor['size'] = self.getFitSize(ops, opIdx+1, op[1])
+      elif opCode == OP_FIT_END:
+        #ops measured from the middle of a [fit] can end without it
+        if len(fitPrevSizes) > 0:
+          self.cursor['size'] = fitPrevSizes.pop()
+
+    if frame != None:
+      self.frameOpEnd(frame)
+
+    state['rtcEpoch'] = rtcEpoch
+    state['isAlignNeeded'] = isAlignNeeded
+    state['widgetId'] = widgetId
+
+  def getRTCEpoch(self):
+    if self.rtc == None:
+      print("WARNING: external rtc epoch not available, using system rtc\n")
+      return time.time()
+    else:
+      return self.rtc.getTimeEpochPlusTZOffset()
+
+  # state of renderOps() that carries over between calls for the same markup
+  def newRenderState(self):
+    return {
+      #[CMD=prev] values
+      "prevVals": {},
+      #calculate once, but only if [rtc] op present
+      "rtcEpoch": None,
+      #after the start of the ops, and after each newline or [align=<ALIGN>],
+      #  align the rest of the line just before drawing anything on it
+      "isAlignNeeded": True,
+      #the size before each unclosed [fit]
+      "fitPrevSizes": [],
+      #[id=NAME] waiting for the next widget op
+      "widgetId": None,
+      #newFrameState(), only for the draw ops of drawMarkupDiff()
+      "frame": None,
+    }
+
+  # remember a widget op about to be drawn at the cursor, for updateWidget()
+  def addWidget(self, widgetId, op):
+    self.widgets[widgetId] = {
+      "op": op,
+      "cursor": self.cursor.copy(),
+      "box": self.measureOpsAtCursor([op], 0, 1),
+    }
+
+  # add samples to the [graph] graphId, and scroll it if it is on the screen
+  #   in framebuf mode, the old columns are moved left in the framebuf,
+  #     and only the new columns are drawn, and only the graph is shown
+  #   returns False if no graph graphId was ever drawn
+  def pushGraph(self, graphId, vals, isShow=True):
+    graph = self.graphs.get(graphId, None)
+    if graph == None:
+      print("WARNING: no graph with id=" + str(graphId))
+      return False
+    self.frame = None
+    samples = graph['samples']
+    for val in vals:
+      samples[graph['head']] = max(-32768, min(32767, val))
+      graph['head'] = (graph['head'] + 1) % len(samples)
+      graph['count'] = min(graph['count'] + 1, len(samples))
+
+    widget = self.widgets.get(graphId, None)
+    if widget == None or widget['op'][0] != OP_GRAPH:
+      return True
+
+    (x, y, w, h) = widget['box']
+    (winW, winH) = self.lcd.get_target_window_size()
+    isInWindow = x >= 0 and y >= 0 and x + w <= winW and y + h <= winH
+    if self.lcd.is_framebuf_enabled() and isInWindow and len(vals) < w:
+      self.lcd.scroll_framebuf_region_left(x, y, w, h, len(vals))
+      self.drawGraphColumns(graphId, w - len(vals))
+    else:
+      self.drawGraphColumns(graphId, 0)
+
+    if isShow and self.lcd.is_framebuf_enabled():
+      self.showRegion(x, y, w, h)
+    return True
+
+  # draw columns [startCol, W) of an on-screen [graph], oldest sample on the left
+  def drawGraphColumns(self, graphId, startCol):
+    graph = self.graphs[graphId]
+    (opCode, graphId, w, h, minVal, maxVal, color) = self.widgets[graphId]['op']
+    (x, y) = self.widgets[graphId]['box'][0:2]
+    (samples, head, count) = (graph['samples'], graph['head'], graph['count'])
+    valRange = max(1, maxVal - minVal)
+    black = self.lcd.black
+    for col in range(startCol, w):
+      age = w - 1 - col
+      colH = 0
+      if age < count:
+        val = samples[(head - 1 - age) % w]
+        colH = (max(minVal, min(maxVal, val)) - minVal) * h // valRange
+      if colH < h:
+        self.lcd.vline(x + col, y, h - colH, black)
+      if colH > 0:
+        self.lcd.vline(x + col, y + h - colH, colH, color)
+
+  # redraw the widget named with [id=NAME], with a new text, bar pct or image file
+  #   erases only the widget's old bounding box, and shows only the changed region
+  #   returns the new bounding box (x, y, w, h), or None if there is no such widget
+  def updateWidget(self, widgetId, text=None, pct=None, filename=None, isShow=True):
+    if widgetId not in self.widgets:
+      print("WARNING: no widget with id=" + str(widgetId))
+      return None
+    self.frame = None
+    widget = self.widgets[widgetId]
+    op = widget['op']
+    opCode = op[0]
+    if opCode == OP_TEXT and text != None:
+      op = (OP_TEXT, text)
+    elif opCode == OP_BAR and pct != None:
+      op = op[0:3] + (pct,) + op[4:]
+    elif opCode == OP_PNG and filename != None:
+      op = (OP_PNG, filename)
+    elif opCode == OP_PNM and filename != None:
+      op = (OP_PNM, filename, op[2])
+
+    (savedCursor, savedFontName) = (self.cursor, self.fontName)
+    self.cursor = widget['cursor'].copy()
+    self.selectFont(self.cursor['font'])
+    try:
+      (oldX, oldY, oldW, oldH) = widget['box']
+      (x, y, w, h) = self.measureOpsAtCursor([op], 0, 1)
+      #a bar always covers its entire box
+      if opCode != OP_BAR:
+        self.lcd.fill_rect(oldX, oldY, oldW, oldH, self.lcd.black)
+      if opCode == OP_PNG:
+        #replace the framebuf PNG at this position
+        self.pngInfosToShow = [pngInfo for pngInfo in self.pngInfosToShow
+          if pngInfo['x'] != self.cursor['x'] or pngInfo['y'] != self.cursor['y']]
+
+      state = self.newRenderState()
+      state['isAlignNeeded'] = False
+      self.renderOps([op], 0, 1, state)
+    finally:
+      self.cursor = savedCursor
+      self.selectFont(savedFontName)
+
+    widget['op'] = op
+    widget['box'] = (x, y, w, h)
+
+    if isShow and self.lcd.is_framebuf_enabled():
+      (minX, minY) = (min(x, oldX), min(y, oldY))
+      (maxX, maxY) = (max(x + w, oldX + oldW), max(y + h, oldY + oldH))
+      self.showRegion(minX, minY, maxX - minX, maxY - minY)
+    return (x, y, w, h)
+
+  # parse a binary display list into the same ops as compileMarkup()
+  #   stops at the first invalid op, keeping the ops before it
+  def decodeDisplayList(self, data):
+    ops = []
+    if data[0:4] != DISPLAY_LIST_MAGIC:
+      print("WARNING: invalid display list (missing magic)")
+      return ops
+    if len(data) < DISPLAY_LIST_HEADER_SIZE or data[4] != DISPLAY_LIST_VERSION:
+      print("WARNING: invalid display list (unsupported version)")
+      return ops
+
+    #[fit] ops that are waiting for their [/fit]
+    openFitOpIdxs = []
+
+    i = DISPLAY_LIST_HEADER_SIZE
+    try:
+      while i < len(data):
+        opCode = data[i]
         i += 1
+        if opCode == OP_TEXT:
+          (text, i) = self.readDisplayListStr(data, i, '<H', 2)
+          ops.append((OP_TEXT, text))
+        elif opCode == OP_NEWLINE or opCode == OP_HLINE or opCode == OP_SHOW:
+          ops.append((opCode,))
+        elif opCode in (OP_PNG, OP_RTC, OP_VAR, OP_ID):
+          (val, i) = self.readDisplayListStr(data, i, '<B', 1)
+          ops.append((opCode, val))
+        elif opCode == OP_PNM:
+          scale = data[i]
+          (filename, i) = self.readDisplayListStr(data, i+1, '<B', 1)
+          ops.append((OP_PNM, filename, scale))
+        elif opCode == OP_RECT or opCode == OP_ELLIPSE:
+          fmt = '<hhB' if opCode == OP_RECT else '<ffB'
+          (w, h, flags) = ustruct.unpack_from(fmt, data, i)
+          i += ustruct.calcsize(fmt)
+          ops.append((opCode, w, h, flags & 0x01 != 0, flags & 0x02 != 0))
+        elif opCode == OP_SHIFT:
+          (x, y) = ustruct.unpack_from('<hh', data, i)
+          i += 4
+          ops.append((OP_SHIFT, x, y))
+        elif opCode == OP_BAR:
+          (w, h, pct, fillRGB, emptyRGB) = ustruct.unpack_from('<hhhII', data, i)
+          i += 14
+          fillColor = self.getDisplayListColor(fillRGB)
+          emptyColor = self.getDisplayListColor(emptyRGB)
+          ops.append((OP_BAR, w, h, pct, fillColor, emptyColor))
+        elif opCode == OP_GRAPH:
+          (graphId, i) = self.readDisplayListStr(data, i, '<B', 1)
+          (w, h, minVal, maxVal, rgb) = ustruct.unpack_from('<hhhhI', data, i)
+          i += 12
+          ops.append((OP_GRAPH, graphId, w, h, minVal, maxVal, self.getDisplayListColor(rgb)))
+        elif opCode == OP_VEC:
+          (modeIdx, rgb, count) = ustruct.unpack_from('<BIH', data, i)
+          i += 7
+          coords = self.unpackVecCoords(data[i:i+count*2])
+          i += count*2
+          mode = VEC_MODES[modeIdx] if modeIdx < len(VEC_MODES) else "lines"
+          ops.append((OP_VEC, mode, self.getDisplayListColor(rgb), coords, self.getVecBounds(coords)))
+        elif opCode == OP_FIT:
+          openFitOpIdxs.append(len(ops))
+          ops.append((OP_FIT, None))
+        elif opCode == OP_FIT_END:
+          for fitOpIdx in openFitOpIdxs:
+            ops[fitOpIdx] = (OP_FIT, len(ops))
+          openFitOpIdxs = []
+          ops.append((OP_FIT_END,))
+        elif opCode == OP_CURSOR:
+          cmd = DISPLAY_LIST_CURSOR_KEYS[data[i]]
+          i += 1
+          (cursorVal, valStr) = (None, None)
+          if cmd == "color" or cmd == "bg":
+            (rgb,) = ustruct.unpack_from('<I', data, i)
+            i += 4
+            cursorVal = self.getDisplayListColor(rgb)
+          elif cmd == "size" or cmd == "x" or cmd == "y":
+            (cursorVal,) = ustruct.unpack_from('<h', data, i)
+            i += 2
+          elif cmd == "hspace" or cmd == "vspace":
+            (cursorVal,) = ustruct.unpack_from('<f', data, i)
+            i += 4
+          elif cmd == "font":
+            #fonts are loaded when the op is rendered
+            (valStr, i) = self.readDisplayListStr(data, i, '<B', 1)
+          elif cmd == "align":
+            cursorVal = DISPLAY_LIST_ALIGNS[data[i]]
+            i += 1
+          elif cmd == "wrap":
+            cursorVal = data[i] != 0
+            i += 1
+          ops.append((OP_CURSOR, cmd, cursorVal, valStr))
+        elif opCode == OP_CURSOR_PREV:
+          ops.append((OP_CURSOR_PREV, DISPLAY_LIST_CURSOR_KEYS[data[i]]))
+          i += 1
+        else:
+          print("WARNING: invalid display list (unknown opcode %d)" % opCode)
+          break
+    except Exception as e:
+      print("WARNING: invalid display list\n" + str(e))
+
+    for fitOpIdx in openFitOpIdxs:
+      ops[fitOpIdx] = (OP_FIT, len(ops))
+
+    return ops
+
+  # (str, nextIdx) for a UTF-8 string at data[i:], prefixed with its length as lenFmt
+  def readDisplayListStr(self, data, i, lenFmt, lenSize):
+    (strLen,) = ustruct.unpack_from(lenFmt, data, i)
+    i += lenSize
+    if i + strLen > len(data):
+      raise ValueError("string past the end of the display list")
+    return (str(data[i:i+strLen], "utf8"), i + strLen)
+
+  # draw packed int16 X,Y coordinates offset by x,y, as one of VEC_MODES, without the cursor
+  #   data is little-endian int16 values, as in [vec=<MODE>,<COLOR>,<BASE64>]
+  def vec(self, data, mode="polyline", color=None, x=0, y=0, isClear=False, isShow=True):
+    if isClear:
+      self.clear()
+    self.frame = None
+    coords = self.unpackVecCoords(data)
+    self.drawVec(mode, coords, x, y, self.getOptColor(color))
+    if isShow:
+      self.show()
+    return len(coords) // 2
+
+  def drawVec(self, mode, coords, x, y, color):
+    if len(coords) < 4:
+      return
+    if mode == "lines":
+      self.lcd.lines(coords, x, y, color)
+    elif mode == "polyline":
+      self.lcd.polyline(coords, x, y, color)
+    else:
+      self.lcd.poly(coords, x, y, color, mode == "fill")
+
+  # array('h') of little-endian int16 X,Y coordinates, dropping an unpaired last byte/value
+  def unpackVecCoords(self, data):
+    count = (len(data) // 4) * 2
+    return array('h', ustruct.unpack('<%dh' % count, data[0:count*2]))
+
+  # (minX, minY, maxX, maxY) of X,Y coordinates, or all 0 if there are none
+  def getVecBounds(self, coords):
+    if len(coords) < 2:
+      return (0, 0, 0, 0)
+    (minX, minY, maxX, maxY) = (coords[0], coords[1], coords[0], coords[1])
+    for i in range(2, len(coords), 2):
+      (x, y) = (coords[i], coords[i+1])
+      if x < minX:
+        minX = x
+      elif x > maxX:
+        maxX = x
+      if y < minY:
+        minY = y
+      elif y > maxY:
+        maxY = y
+    return (minX, minY, maxX, maxY)
+
+  def getDisplayListColor(self, rgb):
+    if rgb == DISPLAY_LIST_NO_COLOR:
+      return None
+    return self.lcd.get_color((rgb >> 16) & 0xFF, (rgb >> 8) & 0xFF, rgb & 0xFF)
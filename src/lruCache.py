@@ -0,0 +1,49 @@
+#LRU Cache - least-recently-used cache with a byte budget
+#Copyright 2026 Elliot Wolk
+#License: GPLv2
+
+from collections import OrderedDict
+
+class LRUCache:
+  def __init__(self, maxBytes):
+    self.maxBytes = maxBytes
+    self.usedBytes = 0
+    self.entries = OrderedDict()
+    self.entrySizes = {}
+
+  def get(self, key):
+    if key not in self.entries:
+      return None
+    #move to the end, most recently used
+    val = self.entries.pop(key)
+    self.entries[key] = val
+    return val
+
+  def contains(self, key):
+    return key in self.entries
+
+  # store val, evicting the least-recently-used entries until it fits
+  #   entries larger than the entire budget are not stored
+  def put(self, key, val, sizeBytes):
+    self.remove(key)
+    if sizeBytes > self.maxBytes:
+      return False
+    while self.usedBytes + sizeBytes > self.maxBytes and len(self.entries) > 0:
+      self.remove(next(iter(self.entries)))
+    self.entries[key] = val
+    self.entrySizes[key] = sizeBytes
+    self.usedBytes += sizeBytes
+    return True
+
+  def remove(self, key):
+    if key in self.entries:
+      del self.entries[key]
+      self.usedBytes -= self.entrySizes.pop(key)
+
+  def clear(self):
+    self.entries = OrderedDict()
+    self.entrySizes = {}
+    self.usedBytes = 0
+
+  def __len__(self):
+    return len(self.entries)